@@ -8,7 +8,12 @@ from dataactcore.utils.cloudLogger import CloudLogger
 from dataactcore.utils.jsonResponse import JsonResponse
 from dataactbroker.handlers.aws.sesEmail import sesEmail
 from dataactbroker.handlers.accountHandler import AccountHandler
-from dataactbroker.handlers.aws.session import DynamoInterface, SessionTable
+from dataactbroker.handlers.emailOutbox import EmailOutbox
+from dataactbroker.handlers.aws.session import SessionTable
+from dataactbroker.handlers.sessionBackends import createSessionInterface
+from dataactbroker.handlers.interfaceHolder import InterfaceHolder
+from dataactbroker.handlers.lookupCache import LookupCache
+from dataactbroker.handlers.passwordHasher import PasswordHasher
 from dataactbroker.fileRoutes import add_file_routes
 from dataactbroker.loginRoutes import add_login_routes
 from dataactbroker.userRoutes import add_user_routes
@@ -49,10 +54,19 @@ def createApp():
         else:
             cors = CORS(app, supports_credentials=True,
                 origins=CONFIG_SERVICES['cross_origin_url'])
-        # Enable AWS Sessions
-        app.session_interface = DynamoInterface()
-        # Set up bcrypt
+        # Enable sessions, stored in DynamoDB unless session_backend in the config names another backend
+        app.session_interface = createSessionInterface(CONFIG_BROKER)
+        # Set up bcrypt, starting the password hashing pool now since it forks and no other threads are running yet
         bcrypt = Bcrypt(app)
+        PasswordHasher.getPool()
+        # Start the email outbox workers in each process once it serves requests, so emails left in the outbox by
+        # a restart are sent without waiting for a new one to be queued.  Threads started here would not survive forking.
+        @app.before_first_request
+        def startEmailOutbox():
+            # A server that forked after createApp needs its own hashing pool, start it before this process has threads
+            PasswordHasher.getPool()
+            EmailOutbox.getOutbox().start()
+
         # Root will point to index.html
         @app.route("/", methods=["GET"])
         def root():
@@ -80,6 +94,14 @@ def createApp():
 
         SessionTable.setup(app, local)
 
+        # Load lookup tables, then empty the interface pool so no connections are shared with forked workers
+        interfaces = InterfaceHolder()
+        try:
+            LookupCache.load(interfaces)
+        finally:
+            interfaces.close()
+            InterfaceHolder.clearPool()
+
         return app
 
     except Exception as e:
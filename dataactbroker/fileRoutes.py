@@ -1,3 +1,4 @@
+from functools import partial
 from flask import request
 from dataactbroker.handlers.fileHandler import FileHandler
 from dataactbroker.permissions import permissions_check
@@ -30,6 +31,12 @@ def add_file_routes(app,CreateCredentials,isLocal,serverPath):
         fileManager = FileHandler(request,isLocal=IS_LOCAL, serverPath=SERVER_PATH)
         return RouteUtils.run_instance_function(fileManager, fileManager.getStatus)
 
+    @app.route("/v1/submission_events/<int:submission_id>/", methods = ["GET"])
+    @permissions_check
+    def submission_events(submission_id):
+        fileManager = FileHandler(request,isLocal=IS_LOCAL, serverPath=SERVER_PATH)
+        return RouteUtils.run_instance_function(fileManager, partial(fileManager.getSubmissionEvents, submission_id))
+
     @app.route("/v1/submission_error_reports/", methods = ["POST"])
     @permissions_check
     def submission_error_reports():
@@ -42,12 +49,60 @@ def add_file_routes(app,CreateCredentials,isLocal,serverPath):
         fileManager = FileHandler(request,isLocal=IS_LOCAL ,serverPath=SERVER_PATH)
         return RouteUtils.run_instance_function(fileManager, fileManager.getErrorMetrics)
 
+    @app.route("/v1/error_metrics_rollup/", methods = ["POST"])
+    @permissions_check
+    def error_metrics_rollup():
+        fileManager = FileHandler(request,isLocal=IS_LOCAL ,serverPath=SERVER_PATH)
+        return RouteUtils.run_instance_function(fileManager, fileManager.getErrorMetricsRollup)
+
     @app.route("/v1/local_upload/", methods = ["POST"])
     @permissions_check
     def upload_local_file():
         fileManager = FileHandler(request,isLocal=IS_LOCAL, serverPath=SERVER_PATH)
         return RouteUtils.run_instance_function(fileManager, fileManager.uploadFile)
 
+    @app.route("/v1/local_upload_stream/", methods = ["PUT"])
+    @permissions_check
+    def upload_local_file_stream():
+        fileManager = FileHandler(request,isLocal=IS_LOCAL, serverPath=SERVER_PATH)
+        return RouteUtils.run_instance_function(fileManager, fileManager.uploadFileStream)
+
+    @app.route("/v1/local_upload_stream/", methods = ["GET"])
+    @permissions_check
+    def local_upload_offset():
+        fileManager = FileHandler(request,isLocal=IS_LOCAL, serverPath=SERVER_PATH)
+        return RouteUtils.run_instance_function(fileManager, fileManager.getUploadOffset)
+
+    @app.route("/v1/multipart_upload/initiate/", methods = ["POST"])
+    @permissions_check
+    def initiate_multipart_upload():
+        fileManager = FileHandler(request,isLocal=IS_LOCAL, serverPath=SERVER_PATH)
+        return RouteUtils.run_instance_function(fileManager, fileManager.initiateMultipartUpload)
+
+    @app.route("/v1/multipart_upload/part_urls/", methods = ["POST"])
+    @permissions_check
+    def multipart_part_urls():
+        fileManager = FileHandler(request,isLocal=IS_LOCAL, serverPath=SERVER_PATH)
+        return RouteUtils.run_instance_function(fileManager, fileManager.getMultipartPartUrls)
+
+    @app.route("/v1/multipart_upload/parts/", methods = ["POST"])
+    @permissions_check
+    def multipart_upload_parts():
+        fileManager = FileHandler(request,isLocal=IS_LOCAL, serverPath=SERVER_PATH)
+        return RouteUtils.run_instance_function(fileManager, fileManager.getMultipartUploadParts)
+
+    @app.route("/v1/multipart_upload/complete/", methods = ["POST"])
+    @permissions_check
+    def complete_multipart_upload():
+        fileManager = FileHandler(request,isLocal=IS_LOCAL, serverPath=SERVER_PATH)
+        return RouteUtils.run_instance_function(fileManager, fileManager.completeMultipartUpload)
+
+    @app.route("/v1/multipart_upload/abort/", methods = ["POST"])
+    @permissions_check
+    def abort_multipart_upload():
+        fileManager = FileHandler(request,isLocal=IS_LOCAL, serverPath=SERVER_PATH)
+        return RouteUtils.run_instance_function(fileManager, fileManager.abortMultipartUpload)
+
     @app.route("/v1/get_rss/", methods = ["GET"])
     @permissions_check
     def get_rss():
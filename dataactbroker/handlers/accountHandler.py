@@ -1,16 +1,22 @@
-from flask import session as flaskSession
-from threading import Thread
+from flask import session as flaskSession, Response
 import re
-import time
-from dateutil.parser import parse
+import json
+import base64
+import binascii
+from datetime import datetime, timedelta
 from dataactcore.utils.requestDictionary import RequestDictionary
 from dataactcore.utils.jsonResponse import JsonResponse
 from dataactcore.utils.responseException import ResponseException
 from dataactcore.utils.statusCode import StatusCode
-from dataactbroker.handlers.userHandler import UserHandler
 from dataactbroker.handlers.interfaceHolder import InterfaceHolder
+from dataactbroker.handlers.lookupCache import LookupCache
+from dataactbroker.handlers.managerProxy import ManagerProxy
+from dataactbroker.handlers.jobHandler import JobHandler
+from dataactbroker.handlers.emailOutbox import EmailOutbox
+from dataactbroker.handlers.emailTemplateCache import EmailTemplateCache
 from dataactbroker.handlers.aws.sesEmail import sesEmail
 from dataactbroker.handlers.aws.session import LoginSession
+from dataactbroker.handlers.userContext import UserContext
 
 class AccountHandler:
     """
@@ -18,6 +24,14 @@ class AccountHandler:
     """
     # Handles login process, compares username and password provided
     FRONT_END = ""
+    # Submissions listed per page by default and at most
+    SUBMISSION_PAGE_SIZE = 100
+    MAX_SUBMISSION_PAGE_SIZE = 500
+    # Users listed per page by default and at most
+    USER_PAGE_SIZE = 100
+    MAX_USER_PAGE_SIZE = 1000
+    # Users who have not logged in for longer than this are marked inactive
+    INACTIVE_DAYS = 120
     # Instance fields include request, response, logFlag, and logFile
 
     def __init__(self,request, interfaces = None, bcrypt = None):
@@ -29,12 +43,10 @@ class AccountHandler:
         self.bcrypt = bcrypt
         if(interfaces != None):
             self.interfaces = interfaces
-            self.userManager = interfaces.userDb
 
     def addInterfaces(self,interfaces):
         """ Add interfaces to an existing account handler """
         self.interfaces = interfaces
-        self.userManager = interfaces.userDb
 
     def checkPassword(self,password):
         """Checks to make sure the password is valid"""
@@ -78,10 +90,7 @@ class AccountHandler:
                 if(self.interfaces.userDb.checkPassword(user,password,self.bcrypt)):
                     # We have a valid login
                     LoginSession.login(session,user.user_id)
-                    permissionList = []
-                    for permission in self.interfaces.userDb.getPermssionList():
-                        if(self.interfaces.userDb.hasPermission(user, permission.name)):
-                            permissionList.append(permission.permission_type_id)
+                    permissionList = sorted(self.interfaces.userDb.getPermissionsForUser(user).values())
                     self.interfaces.userDb.updateLastLogin(user)
                     return JsonResponse.create(StatusCode.OK,{"message":"Login successful","user_id": int(user.user_id),"name":user.name,"title":user.title ,"agency":user.agency, "permissions" : permissionList})
                 else :
@@ -133,26 +142,6 @@ class AccountHandler:
         Returns message that registration is successful or error message that fields are not valid
 
         """
-        def ThreadedFunction (from_email="",username="",title="",agency="",userEmail="" ,link="") :
-            """
-            This inner function sends emails in a new thread as there could be lots of admins
-
-            from_email -- (string) the from email address
-            username -- (string) the name of the  user
-            title  --   (string) the title of the  user
-            agency -- (string) the agency of the  user
-            userEmail -- (string) the email of the user
-            link  -- (string) the broker email link
-            """
-            threadedDatabase =  UserHandler()
-            try:
-                for user in threadedDatabase.getUsersByType("website_admin") :
-                    emailTemplate = {'[REG_NAME]': username, '[REG_TITLE]':title, '[REG_AGENCY]':agency,'[REG_EMAIL]' : userEmail,'[URL]':link}
-                    newEmail = sesEmail(user.email, system_email,templateType="account_creation",parameters=emailTemplate,database=threadedDatabase)
-                    newEmail.send()
-            finally:
-                InterfaceHolder.closeOne(threadedDatabase)
-
         requestFields = RequestDictionary(self.request)
         if(not (requestFields.exists("email") and requestFields.exists("name") and requestFields.exists("agency") and requestFields.exists("title") and requestFields.exists("password"))):
             # Missing a required field, return 400
@@ -174,15 +163,17 @@ class AccountHandler:
         self.interfaces.userDb.setPassword(user,requestFields.getValue("password"),self.bcrypt)
 
         userLink= "".join([AccountHandler.FRONT_END, '#/login?redirect=/admin'])
-        # Send email to approver list
-        emailThread = Thread(target=ThreadedFunction, kwargs=dict(from_email=system_email,username=user.name,title=user.title,agency=user.agency,userEmail=user.email,link=userLink))
-        emailThread.start()
+        # Email approver list
+        emailTemplate = {'[REG_NAME]': user.name, '[REG_TITLE]':user.title, '[REG_AGENCY]':user.agency,'[REG_EMAIL]' : user.email,'[URL]':userLink}
+        # Every admin gets the same message, so fill in the template once
+        subject, content = EmailTemplateCache.render("account_creation", emailTemplate, self.interfaces.userDb)
+        emails = [sesEmail(admin.email, system_email, content=content, subject=subject) for admin in self.interfaces.userDb.getUsersByType("website_admin")]
 
         #email user
-        link= AccountHandler.FRONT_END
         emailTemplate = {'[EMAIL]' : system_email}
-        newEmail = sesEmail(user.email, system_email,templateType="account_creation_user",parameters=emailTemplate,database=self.interfaces.userDb)
-        newEmail.send()
+        emails.append(sesEmail(user.email, system_email,templateType="account_creation_user",parameters=emailTemplate,database=self.interfaces.userDb))
+        # Emails are sent by the outbox workers, after this request returns
+        EmailOutbox.enqueue(self.interfaces.userDb, emails)
 
         LoginSession.logout(session)
         # Mark user as awaiting approval
@@ -219,7 +210,7 @@ class AccountHandler:
         link= "".join([AccountHandler.FRONT_END,'#/registration/',emailToken])
         emailTemplate = {'[USER]': email, '[URL]':link}
         newEmail = sesEmail(email, system_email,templateType="validate_email",parameters=emailTemplate,database=self.interfaces.userDb)
-        newEmail.send()
+        EmailOutbox.enqueue(self.interfaces.userDb, [newEmail])
         return JsonResponse.create(StatusCode.OK,{"message":"Email Sent"})
 
     def checkEmailConfirmationToken(self,session):
@@ -318,42 +309,133 @@ class AccountHandler:
                 link=  AccountHandler.FRONT_END
                 emailTemplate = { '[URL]':link,'[EMAIL]':system_email}
                 newEmail = sesEmail(user.email, system_email,templateType="account_approved",parameters=emailTemplate,database=self.interfaces.userDb)
-                newEmail.send()
+                EmailOutbox.enqueue(self.interfaces.userDb, [newEmail])
             elif (requestDict.getValue("new_status") == "denied"):
                 emailTemplate = {}
                 newEmail = sesEmail(user.email, system_email,templateType="account_rejected",parameters=emailTemplate,database=self.interfaces.userDb)
-                newEmail.send()
+                EmailOutbox.enqueue(self.interfaces.userDb, [newEmail])
         # Change user's status
         self.interfaces.userDb.changeStatus(user,requestDict.getValue("new_status"))
         return JsonResponse.create(StatusCode.OK,{"message":"Status change successful"})
 
     def listUsersWithStatus(self):
-        """ List all users with the specified status.  Associated request body must have key 'status' """
+        """ List users with the specified status, ordered by user ID, all at once or one page at a time
+
+        Associated request body must have key 'status', and may include "limit", the page size, and "cursor", the
+        next_cursor value from the previous page.  Without limit or cursor every user is listed, as before paging was
+        added.  Users are written out as they are read from the database.
+        """
         requestDict = RequestDictionary(self.request)
         if(not (requestDict.exists("status"))):
             # Missing a required field, return 400
             exc = ResponseException("Request body must include status", StatusCode.CLIENT_ERROR)
             return JsonResponse.error(exc,exc.status)
+        paged = requestDict.exists("limit") or requestDict.exists("cursor")
+        try:
+            limit = int(requestDict.getValue("limit")) if requestDict.exists("limit") else self.USER_PAGE_SIZE
+        except (ValueError, TypeError):
+            limit = 0
+        if(not paged):
+            limit = None
+        elif(limit < 1 or limit > self.MAX_USER_PAGE_SIZE):
+            exc = ResponseException("Limit must be between 1 and {}".format(self.MAX_USER_PAGE_SIZE), StatusCode.CLIENT_ERROR)
+            return JsonResponse.error(exc,exc.status)
+        afterId = None
+        if(requestDict.exists("cursor") and requestDict.getValue("cursor") not in (None, "")):
+            try:
+                afterId = int(requestDict.getValue("cursor"))
+            except (ValueError, TypeError):
+                exc = ResponseException("Invalid cursor", StatusCode.CLIENT_ERROR)
+                return JsonResponse.error(exc,exc.status)
         try:
-            users = self.interfaces.userDb.getUsersByStatus(requestDict.getValue("status"))
+            statusId = self.interfaces.userDb.getUserStatusId(requestDict.getValue("status"))
         except ValueError as e:
             # Client provided a bad status
             exc = ResponseException(str(e),StatusCode.CLIENT_ERROR,ValueError)
             return JsonResponse.error(exc,exc.status)
-        userInfo = []
-        for user in users:
-            thisInfo = {"name":user.name, "title":user.title,  "agency":user.agency, "email":user.email, "id":user.user_id }
-            userInfo.append(thisInfo)
-        return JsonResponse.create(StatusCode.OK,{"users":userInfo})
+        total = self.interfaces.userDb.countUsersByStatusId(statusId)
+        return Response(self.streamUsers(statusId, limit, afterId, total), status=StatusCode.OK, mimetype="application/json")
+
+    @staticmethod
+    def streamUsers(statusId, limit, afterId, total):
+        """ Generate JSON for one page of users, a user at a time, or every user if limit is None
+
+        Request interfaces are closed before the response is written, so this opens its own
+        """
+        interfaces = InterfaceHolder()
+        try:
+            yield '{{"total": {}, "users": ['.format(total)
+            lastId = None
+            count = 0
+            nextCursor = None
+            # Fetch one extra user to tell if there is another page
+            for user in interfaces.userDb.getUserPageByStatusId(statusId, None if limit is None else limit + 1, afterId):
+                if count == limit:
+                    nextCursor = str(lastId)
+                    break
+                thisInfo = {"name":user.name, "title":user.title,  "agency":user.agency, "email":user.email, "id":user.user_id }
+                yield ("," if count else "") + json.dumps(thisInfo)
+                lastId = user.user_id
+                count += 1
+            yield '], "next_cursor": {}}}'.format(json.dumps(nextCursor))
+        finally:
+            interfaces.close()
 
     def listSubmissionsByCurrentUser(self):
-        """ List all submission IDs associated with the current user ID """
+        """ List submission IDs associated with the current user ID, newest first, one page at a time
+
+        Query string may include "limit", the page size, "cursor", the next_cursor value from the previous page, and
+        "summary", set to true to include status, row count, and error count for each submission.  Without limit or
+        cursor every submission is listed, as before paging was added.
+        """
         userId = LoginSession.getName(flaskSession)
-        submissions = self.interfaces.jobDb.getSubmissionsByUserId(userId)
-        submissionIdList = []
-        for submission in submissions:
-            submissionIdList.append(submission.submission_id)
-        return JsonResponse.create(StatusCode.OK,{"submission_id_list": submissionIdList})
+        paged = "limit" in self.request.args or "cursor" in self.request.args
+        try:
+            limit = int(self.request.args.get("limit", self.SUBMISSION_PAGE_SIZE))
+        except ValueError:
+            limit = 0
+        if(paged and (limit < 1 or limit > self.MAX_SUBMISSION_PAGE_SIZE)):
+            exc = ResponseException("Limit must be between 1 and {}".format(self.MAX_SUBMISSION_PAGE_SIZE), StatusCode.CLIENT_ERROR)
+            return JsonResponse.error(exc,exc.status)
+        after = None
+        if(self.request.args.get("cursor")):
+            try:
+                after = self.decodeSubmissionCursor(self.request.args.get("cursor"))
+            except (ValueError, TypeError):
+                exc = ResponseException("Invalid cursor", StatusCode.CLIENT_ERROR)
+                return JsonResponse.error(exc,exc.status)
+
+        page, hasMore = self.interfaces.jobDb.getSubmissionPageForUser(userId, limit if paged else None, after)
+        responseDict = {"submission_id_list": [submissionId for submissionId, created in page],
+                        "next_cursor": self.encodeSubmissionCursor(page[-1]) if hasMore else None}
+        if(str(self.request.args.get("summary", "false")).lower() == "true"):
+            summaries = self.interfaces.jobDb.getSubmissionSummaries(responseDict["submission_id_list"])
+            errorCounts = self.interfaces.errorDb.getErrorCountsForJobList([jobId for summary in summaries.values() for jobId in summary["job_ids"]])
+            responseDict["submissions"] = []
+            for submissionId, created in page:
+                summary = summaries[submissionId]
+                responseDict["submissions"].append({"submission_id": submissionId, "created_on": created.strftime("%m/%d/%Y") if created is not None else None,
+                    "agency_name": summary["agency_name"], "status": summary["status"], "number_of_rows": summary["number_of_rows"],
+                    "number_of_errors": sum(errorCounts.get(jobId, 0) for jobId in summary["job_ids"])})
+        return JsonResponse.create(StatusCode.OK,responseDict)
+
+    @staticmethod
+    def encodeSubmissionCursor(submission):
+        """ Encode (submission_id, datetime_utc) of the last submission on a page as an opaque cursor, a missing datetime_utc is encoded as "null" """
+        submissionId, created = submission
+        created = created.strftime("%Y-%m-%dT%H:%M:%S.%f") if created is not None else "null"
+        return base64.urlsafe_b64encode("{}|{}".format(created, submissionId).encode("utf-8")).decode("utf-8")
+
+    @staticmethod
+    def decodeSubmissionCursor(cursor):
+        """ Decode a cursor into (sort time, submission_id) as used by getSubmissionPageForUser, raises ValueError if it is not valid """
+        try:
+            created, submissionId = base64.urlsafe_b64decode(str(cursor)).decode("utf-8").split("|")
+        except (TypeError, binascii.Error):
+            raise ValueError("Invalid cursor")
+        if created == "null":
+            return JobHandler.SUBMISSION_EPOCH, int(submissionId)
+        return datetime.strptime(created, "%Y-%m-%dT%H:%M:%S.%f"), int(submissionId)
 
     def setNewPassword(self):
         """ Set a new password for a user, request should have keys "user_email" and "password" """
@@ -405,7 +487,7 @@ class AccountHandler:
         link= "".join([ AccountHandler.FRONT_END,'#/forgotpassword/',emailToken])
         emailTemplate = { '[URL]':link}
         newEmail = sesEmail(user.email, system_email,templateType="reset_password",parameters=emailTemplate,database=self.interfaces.userDb)
-        newEmail.send()
+        EmailOutbox.enqueue(self.interfaces.userDb, [newEmail])
         # Return success message
         return JsonResponse.create(StatusCode.OK,{"message":"Password reset"})
 
@@ -422,18 +504,33 @@ class AccountHandler:
 
         """
         uid =  session["name"]
-        user =  self.interfaces.userDb.getUserByUID(uid)
-        permissionList = []
-        for permission in self.interfaces.userDb.getPermssionList():
-            if(self.interfaces.userDb.hasPermission(user, permission.name)):
-                permissionList.append(permission.permission_type_id)
+        # Use the user loaded by permissions_check if there is one
+        user = UserContext.getUser(uid)
+        if user is not None:
+            permissionList = UserContext.getPermissionIds()
+        else:
+            user =  self.interfaces.userDb.getUserByUID(uid)
+            permissionList = sorted(self.interfaces.userDb.getPermissionsForUser(user).values())
         return JsonResponse.create(StatusCode.OK,{"user_id": int(uid),"name":user.name,"agency":user.agency,"title":user.title, "permissions" : permissionList})
 
+    def reloadLookupTables(self):
+        """ Reload the cached lookup tables (permission types, statuses, and types) in this process
+
+        return the response object with the new cache epoch
+        """
+        epoch = LookupCache.reload(self.interfaces)
+        return JsonResponse.create(StatusCode.OK,{"message":"Lookup tables reloaded","epoch":epoch})
+
+    def getValidatorMetrics(self):
+        """ Get queue depth, in flight calls, counts and latency of the validator dispatcher in this process
+
+        return the response object with the dispatcher metrics
+        """
+        return JsonResponse.create(StatusCode.OK,ManagerProxy.getMetrics())
+
     def isUserActive(self, user):
-        today = parse(time.strftime("%c"))
-        daysActive = (today-user.last_login_date).days
-        secondsActive = (today-user.last_login_date).seconds
-        if daysActive > 120 or (daysActive == 120 and secondsActive > 0):
+        """ Mark user inactive if they have not logged in for more than INACTIVE_DAYS days, only writes when that changes """
+        if user.is_active and datetime.now() - user.last_login_date > timedelta(days=self.INACTIVE_DAYS):
             user.is_active = False
-        self.interfaces.userDb.session.commit()
+            self.interfaces.userDb.session.commit()
         return user.is_active
@@ -0,0 +1,99 @@
+import math
+from boto.s3.multipart import MultiPartUpload
+from dataactbroker.handlers.aws.signedUrlCache import SignedUrlCache
+
+class MultipartUploadManager :
+    """
+    This MultipartUploadManager is a Singleton Class/ Namespace for S3 multipart uploads that are
+    uploaded directly by the client using presigned part URLs
+
+    Constants :
+
+    MIN_PART_SIZE -- (int) Smallest part size S3 accepts for all but the last part
+    DEFAULT_PART_SIZE -- (int) Part size used when the client does not ask for one
+    MAX_PARTS -- (int) Most parts S3 allows in one upload
+    URL_LIFETIME -- (int) Seconds a part URL is valid for
+
+    """
+    MIN_PART_SIZE = 5 * 1024 * 1024
+    DEFAULT_PART_SIZE = 64 * 1024 * 1024
+    MAX_PARTS = 10000
+    URL_LIFETIME = 3600
+
+    @staticmethod
+    def getPartSize(fileSize, partSize=None) :
+        """
+        arguments:
+
+        fileSize -- (int) size of the file in bytes
+        partSize -- (int) part size requested by the client, or None for the default
+
+        returns a tuple of (part size, part count) within S3's limits
+        """
+        if partSize is None:
+            partSize = MultipartUploadManager.DEFAULT_PART_SIZE
+        partSize = max(int(partSize), MultipartUploadManager.MIN_PART_SIZE,
+                       int(math.ceil(float(fileSize) / MultipartUploadManager.MAX_PARTS)))
+        partCount = max(1, int(math.ceil(float(fileSize) / partSize)))
+        return partSize, partCount
+
+    @staticmethod
+    def getUpload(bucketName, keyName, uploadId) :
+        """
+        returns a boto MultiPartUpload for an upload started earlier, without calling S3
+        """
+        bucket = SignedUrlCache.getConnection().get_bucket(bucketName, validate=False)
+        upload = MultiPartUpload(bucket)
+        upload.key_name = keyName
+        upload.id = uploadId
+        return upload
+
+    @staticmethod
+    def initiate(bucketName, keyName) :
+        """
+        Starts a multipart upload and returns the S3 upload id
+        """
+        bucket = SignedUrlCache.getConnection().get_bucket(bucketName, validate=False)
+        return bucket.initiate_multipart_upload(keyName).id
+
+    @staticmethod
+    def getPartUrls(bucketName, keyName, uploadId, partNumbers) :
+        """
+        arguments:
+
+        bucketName -- (String) the bucket holding the upload
+        keyName -- (String) the key being uploaded
+        uploadId -- (String) the S3 upload id
+        partNumbers -- (list) part numbers to sign URLs for
+
+        returns a dict of presigned PUT URLs keyed by part number, signing is local so no S3 calls are made
+        """
+        connection = SignedUrlCache.getConnection()
+        urls = {}
+        for partNumber in partNumbers:
+            # partNumber and uploadId are S3 sub-resources, so boto includes them in the signature
+            urls[partNumber] = connection.generate_url(MultipartUploadManager.URL_LIFETIME, "PUT", bucketName, keyName,
+                response_headers={"partNumber": str(partNumber), "uploadId": uploadId})
+        return urls
+
+    @staticmethod
+    def listParts(bucketName, keyName, uploadId) :
+        """
+        returns a list of (part number, etag, size) tuples for the parts S3 has received
+        """
+        upload = MultipartUploadManager.getUpload(bucketName, keyName, uploadId)
+        return [(part.part_number, part.etag, part.size) for part in upload]
+
+    @staticmethod
+    def complete(bucketName, keyName, uploadId) :
+        """
+        Combines the received parts into the final object, boto lists the parts from S3 to build the request
+        """
+        MultipartUploadManager.getUpload(bucketName, keyName, uploadId).complete_upload()
+
+    @staticmethod
+    def abort(bucketName, keyName, uploadId) :
+        """
+        Cancels the upload, S3 discards any parts already received
+        """
+        MultipartUploadManager.getUpload(bucketName, keyName, uploadId).cancel_upload()
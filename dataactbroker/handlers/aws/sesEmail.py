@@ -1,11 +1,15 @@
+import os
 import boto
+from boto.exception import BotoServerError, NoAuthHandlerFound
 import uuid
 import urllib
 import datetime
+from threading import Lock
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.exc import MultipleResultsFound
 from dataactcore.config import CONFIG_BROKER
+from dataactbroker.handlers.emailTemplateCache import EmailTemplateCache
 
 class sesEmail(object):
 
@@ -14,8 +18,18 @@ class sesEmail(object):
     LINK_EXPIRED =  2
     LINK_ALREADY_USED = 3
     LINK_VALID  = 0
+    TOKEN_MAX_AGE = 86400 # Seconds a token is accepted for, older tokens are removed by webbroker --purge-tokens
     isLocal = False
     emailLog = "Email.log"
+    # Error codes SES returns when the credentials are missing, invalid, or expired
+    AUTH_ERROR_CODES = ("InvalidClientTokenId", "SignatureDoesNotMatch", "IncompleteSignature", "MissingAuthenticationToken",
+                        "ExpiredToken", "UnrecognizedClientException", "AccessDenied")
+    # One SES connection per process for each kind of credentials, shared by every sender
+    _connection = None
+    _connectionPid = None
+    _configKeyConnection = None
+    _configKeyConnectionPid = None
+    _connectionLock = Lock()
     def __init__(self,toAddress,fromAddress,content="",subject="",templateType=None,parameters=None, database=None):
         self.toAddress = toAddress
         self.fromAddress = fromAddress
@@ -23,29 +37,58 @@ class sesEmail(object):
             self.content = content
             self.subject = subject
         else:
-            template = database.getEmailTemplate(templateType)
-            self.subject = template.subject
-            self.content = template.content
-
-            for key in parameters :
-                if parameters[key] is not None:
-                    self.content = self.content.replace(key,parameters[key])
-                else:
-                    self.content = self.content.replace(key,"")
+            self.subject, self.content = EmailTemplateCache.render(templateType, parameters, database)
 
     def send(self):
+        """ Send this email now, callers that do not need to wait for SES should queue it with EmailOutbox instead """
+        return sesEmail.deliver(self.fromAddress, self.subject, self.content, self.toAddress)
+
+    @staticmethod
+    def getConnection(useConfigKeys=False):
+        """ Get an SES connection for this process, creating it the first time it is needed
+
+        Arguments:
+        useConfigKeys -- (boolean) get the connection using aws_key from config instead of the default credentials, the default
+            connection is kept for later sends
+        """
+        with sesEmail._connectionLock:
+            if useConfigKeys:
+                if sesEmail._configKeyConnection is None or sesEmail._configKeyConnectionPid != os.getpid():
+                    sesEmail._configKeyConnection = boto.connect_ses(aws_access_key_id=CONFIG_BROKER['aws_access_key_id'], aws_secret_access_key=CONFIG_BROKER['aws_secret_access_key'])
+                    sesEmail._configKeyConnectionPid = os.getpid()
+                return sesEmail._configKeyConnection
+            if sesEmail._connection is None or sesEmail._connectionPid != os.getpid():
+                sesEmail._connection = boto.connect_ses()
+                sesEmail._connectionPid = os.getpid()
+            return sesEmail._connection
+
+    @staticmethod
+    def isAuthError(error):
+        """ Return True if error means SES did not accept the credentials, so the email was not sent """
+        if isinstance(error, NoAuthHandlerFound):
+            return True
+        return isinstance(error, BotoServerError) and error.error_code in sesEmail.AUTH_ERROR_CODES
+
+    @staticmethod
+    def deliver(fromAddress, subject, content, toAddress):
+        """ Send one email through SES, or write it to the email log when running locally
+
+        If the default credentials are rejected, the email is sent with aws_key from config instead.  Any other error is
+        raised without retrying, since SES may already have accepted the email, and the outbox retries it later.
+        """
         if(not sesEmail.isLocal):
             # Use aws creds for ses if possible, otherwise, use aws_key from config
-            connection = boto.connect_ses()
             try:
-                return connection.send_email(self.fromAddress, self.subject,self.content,self.toAddress,format='html')
-            except:
-                connection = boto.connect_ses(aws_access_key_id=CONFIG_BROKER['aws_access_key_id'], aws_secret_access_key=CONFIG_BROKER['aws_secret_access_key'])
-                return connection.send_email(self.fromAddress, self.subject,self.content,self.toAddress,format='html')
+                return sesEmail.getConnection().send_email(fromAddress, subject, content, toAddress, format='html')
+            except (BotoServerError, NoAuthHandlerFound) as e:
+                if not sesEmail.isAuthError(e):
+                    raise
+                return sesEmail.getConnection(useConfigKeys=True).send_email(fromAddress, subject, content, toAddress, format='html')
         else:
-            newEmailText = "\n\n".join(["","Time",str(datetime.datetime.now()),"Subject",self.subject,"From",self.fromAddress,"To",self.toAddress,"Content",self.content])
-            open (sesEmail.emailLog,"a").write(newEmailText)
-
+            newEmailText = "\n\n".join(["","Time",str(datetime.datetime.now()),"Subject",subject,"From",fromAddress,"To",toAddress,"Content",content])
+            with sesEmail._connectionLock:
+                with open(sesEmail.emailLog,"a") as emailLog:
+                    emailLog.write(newEmailText)
 
     @staticmethod
     def createToken(emailAddress,database,token_type) :
@@ -71,7 +114,7 @@ class sesEmail(object):
             return False,"Link already used",sesEmail.LINK_ALREADY_USED
         ts = URLSafeTimedSerializer(sesEmail.SIGNING_KEY)
         try:
-            emailAddress = ts.loads(token, salt=saltValue[0]+token_type, max_age=86400)
+            emailAddress = ts.loads(token, salt=saltValue[0]+token_type, max_age=sesEmail.TOKEN_MAX_AGE)
             return True,emailAddress,sesEmail.LINK_VALID
         except BadSignature as e:
             #Token is malformed
@@ -1,4 +1,8 @@
+import os
+import time
 from uuid import uuid4
+from collections import OrderedDict
+from threading import Lock
 from boto.dynamodb2.fields import HashKey, GlobalAllIndex
 from boto.dynamodb2.table import Table, exceptions
 from boto.dynamodb2.types import NUMBER
@@ -177,29 +181,151 @@ class DynamoSession(CallbackDict, SessionMixin):
     arguments:
     initial -- (Session) session
     sid --   (String) the uuid string from a cookie
+    expiration -- (float) the stored expiration of this session in seconds since 1970, None for new sessions
 
     """
-    def __init__(self, initial=None, sid=None):
-        CallbackDict.__init__(self, initial)
+    def __init__(self, initial=None, sid=None, expiration=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
         self.sid = sid
+        self.expiration = expiration
         self.modified = False
 
 
+class SessionCache :
+    """
+    This SessionCache is a Singleton Class/ Namespace holding a bounded, process-local
+    LRU cache of session items read from or written to the SessionTable
+
+    Constants :
+
+    MAX_SIZE -- (int) The number of sessions to keep in the cache
+    MAX_AGE -- (int) Seconds a cached item is trusted before it is read from DynamoDB again,
+               this bounds how long another process's change to the same session can go unseen
+
+    """
+    MAX_SIZE = 1000
+    MAX_AGE = 30
+    _items = OrderedDict()
+    _lock = Lock()
+
+    @staticmethod
+    def get(uid) :
+        """
+        arguments:
+
+        uid -- (String) the session id
+
+        returns a tuple of (data, expiration) for the session, or None if it is not cached or has gone stale
+        """
+        now = toUnixTime(datetime.utcnow())
+        with SessionCache._lock:
+            entry = SessionCache._items.pop(uid, None)
+            if entry is None:
+                return None
+            data, expiration, cachedAt = entry
+            if expiration <= now or cachedAt + SessionCache.MAX_AGE <= now:
+                # Entry is stale, leave it out of the cache
+                return None
+            # Reinsert to mark as most recently used
+            SessionCache._items[uid] = entry
+            return dict(data), expiration
+
+    @staticmethod
+    def put(uid, data, expiration) :
+        """
+        arguments:
+
+        uid -- (String) the session id
+        data -- (dict) the session data
+        expiration -- (float) the time in seconds from 1970 when the session is no longer active
+
+        Adds or replaces a session in the cache, evicting the least recently used session if full
+        """
+        now = toUnixTime(datetime.utcnow())
+        with SessionCache._lock:
+            SessionCache._items.pop(uid, None)
+            SessionCache._items[uid] = (dict(data), expiration, now)
+            while len(SessionCache._items) > SessionCache.MAX_SIZE:
+                SessionCache._items.popitem(last=False)
+
+    @staticmethod
+    def remove(uid) :
+        """
+        arguments:
+
+        uid -- (String) the session id
+
+        Drops a session from the cache
+        """
+        with SessionCache._lock:
+            SessionCache._items.pop(uid, None)
+
+    @staticmethod
+    def clear() :
+        """
+        Drops all sessions from the cache
+        """
+        with SessionCache._lock:
+            SessionCache._items.clear()
+
 
 class DynamoInterface(SessionInterface):
     """
 
     Class That implements the SessionInterface and uses SessionTable to store data
 
+    Another store may be passed in place of SessionTable, it must have the same getSession,
+    newSession, and clearSessions methods, see dataactbroker/handlers/sessionBackends.py
+
+    Sessions are read once per request through SessionCache, and only written back
+    when they were modified or their stored expiration is more than
+    SESSION_REFRESH_INTERVAL seconds behind the new one
+
     """
 
 
-    SESSSION_CLEAR_COUNT_LIMIT = 10
+    SESSION_REFRESH_INTERVAL = 3600
 
-    CountLimit = 1
+    def __init__(self, store=None):
+        """
 
-    def __init__(self):
-        return
+        arguments:
+
+        store -- the session store, SessionTable if None
+
+        """
+        self.store = store if store is not None else SessionTable
+        # Cached sessions may have come from a different store
+        SessionCache.clear()
+
+    def loadSession(self, sid):
+        """
+
+        arguments:
+
+        sid -- (String) the session id
+
+        returns a tuple of (data, expiration) from the cache, falling back to a single store read, or None if the session does not exist
+
+        """
+        record = SessionCache.get(sid)
+        if record is None:
+            record = self.store.getSession(sid)
+            if record is not None:
+                SessionCache.put(sid, record[0], record[1])
+        return record
+
+    def clearSessions(self):
+        """
+
+        Removes expired sessions from the store
+
+        returns a tuple of (number of sessions removed, seconds taken)
+
+        """
+        return self.store.clearSessions()
 
     def open_session(self, app, request):
         """
@@ -213,9 +339,10 @@ class DynamoInterface(SessionInterface):
 
         """
         sid = request.cookies.get(app.session_cookie_name)
-        if(sid and SessionTable.doesSessionExist(sid)):
-            if SessionTable.getTimeout(sid)> toUnixTime(datetime.utcnow()):
-                return DynamoSession(initial=SessionTable.getData(sid),sid=sid)
+        if(sid):
+            record = self.loadSession(sid)
+            if record is not None and record[1] > toUnixTime(datetime.utcnow()):
+                return DynamoSession(initial=record[0],sid=sid,expiration=record[1])
         # This can be made better most likely need to do research
         # Maybe Hash(time + server id + random number)? Want to prevent any conflicts
         sid = str(uuid4())
@@ -246,16 +373,28 @@ class DynamoInterface(SessionInterface):
             expiration = datetime.utcnow() + timedelta(seconds=SessionTable.TIME_OUT_LIMIT)
         if(not "_uid" in session):
             session["_uid"] = _create_identifier()
-        SessionTable.newSession(session.sid,session,expiration)
-        DynamoInterface.CountLimit = DynamoInterface.CountLimit + 1
-        if DynamoInterface.CountLimit % DynamoInterface.SESSSION_CLEAR_COUNT_LIMIT == 0 :
-            SessionTable.clearSessions()
-            DynamoInterface.CountLimit = 1
+        if self.shouldSave(session, expiration):
+            self.store.newSession(session.sid,dict(session),expiration)
+            SessionCache.put(session.sid, session, toUnixTime(expiration))
 
         response.set_cookie(app.session_cookie_name, session.sid,
                             expires=self.get_expiration_time(app, session),
                             httponly=True, domain=domain)
 
+    @staticmethod
+    def shouldSave(session, expiration):
+        """
+        arguments:
+
+        session -- (DynamoSession)  the session object
+        expiration -- (DateTime) the new expiration for the session
+
+        returns (boolean) True if the session has changed, is new, or its stored expiration needs to be extended
+        """
+        if session.modified or session.expiration is None:
+            return True
+        return toUnixTime(expiration) - session.expiration > DynamoInterface.SESSION_REFRESH_INTERVAL
+
 
 class SessionTable :
     """
@@ -273,7 +412,13 @@ class SessionTable :
     Static Fields :
 
     TableConnection -- (DynamoDBConnection)the conenction to the Sessions table
+    TableHandle -- (Table) the Boto Table object shared by every thread in this process
     isLocal -- (boolean) saves if the DynamoDB instances are local
+    ConnectionMetrics -- (dict) counts of table handles created and reused by this process
+
+    The connection and table handle are created on first use and rebuilt only if the process
+    forks or the connection settings change.  Boto keeps the underlying HTTP connections alive
+    between calls, idle connections are dropped after the Boto connection_stale_duration setting.
 
     """
     TABLE_NAME = "BrokerSession"
@@ -283,18 +428,33 @@ class SessionTable :
     TIME_OUT_LIMIT = 604800
     LOCAL_PORT =  8000 # This is overwritten by the dynamo_port value taken from the configuration file
     TableConnection = ""
+    TableHandle = None
+    TableHandleKey = None
+    TableLock = Lock()
+    ConnectionMetrics = {"created": 0, "reused": 0}
     isLocal = False
     DYNAMO_REGION = False
 
     @staticmethod
     def clearSessions() :
         """
-        Removes old sessions that are expired
+        Removes old sessions that are expired.  Only the key of each expired item is read,
+        and the deletes are sent in batches.  Expired sessions are removed by running
+        webbroker --sweep-sessions on a schedule, not during requests.
+
+        returns a tuple of (number of sessions removed, seconds taken)
         """
+        startTime = time.time()
         newTime = toUnixTime(datetime.utcnow())
-        old_sessions = SessionTable.getTable().scan(expiration__lte=newTime)
-        for recordItem in old_sessions :
-            recordItem.delete()
+        table = SessionTable.getTable()
+        # The expiration-index only has a hash key, so it can not be queried with a range condition
+        old_sessions = table.scan(expiration__lte=newTime, attributes=[SessionTable.KEY_NAME])
+        removed = 0
+        with table.batch_write() as batch:
+            for recordItem in old_sessions :
+                batch.delete_item(**{SessionTable.KEY_NAME: recordItem[SessionTable.KEY_NAME]})
+                removed += 1
+        return removed, time.time() - startTime
 
     @staticmethod
     def getLocalConnection() :
@@ -306,11 +466,29 @@ class SessionTable :
     @staticmethod
     def getTable() :
         """
-        returns the Boto Table object
+        returns the Boto Table object, creating it and its connection the first time it is needed in this process
+        """
+        handleKey = (os.getpid(), SessionTable.isLocal, SessionTable.LOCAL_PORT, SessionTable.DYNAMO_REGION)
+        with SessionTable.TableLock:
+            if SessionTable.TableHandle is not None and SessionTable.TableHandleKey == handleKey:
+                SessionTable.ConnectionMetrics["reused"] += 1
+                return SessionTable.TableHandle
+            if(SessionTable.isLocal) :
+                SessionTable.TableConnection = SessionTable.getLocalConnection()
+            else:
+                SessionTable.TableConnection = connect_to_region(SessionTable.DYNAMO_REGION)
+            SessionTable.TableHandle = Table(SessionTable.TABLE_NAME,connection=SessionTable.TableConnection)
+            SessionTable.TableHandleKey = handleKey
+            SessionTable.ConnectionMetrics["created"] += 1
+            return SessionTable.TableHandle
+
+    @staticmethod
+    def getConnectionMetrics() :
+        """
+        returns (dict) the number of table handles created and reused by this process
         """
-        if(SessionTable.isLocal) :
-            return Table(SessionTable.TABLE_NAME,connection=SessionTable.getLocalConnection())
-        return Table(SessionTable.TABLE_NAME,connection=connect_to_region(SessionTable.DYNAMO_REGION))
+        with SessionTable.TableLock:
+            return dict(SessionTable.ConnectionMetrics)
 
 
 
@@ -388,6 +566,20 @@ class SessionTable :
         response = SessionTable.getTable().get_item(uid=uid)
         return response[SessionTable.DATA_FIELD]
 
+    @staticmethod
+    def getSession(uid) :
+        """
+        arguments:
+
+        uid -- (String) the uid
+        return a tuple of (data, expiration) read with a single get_item, or None if there is no such session
+        """
+        try:
+            item = SessionTable.getTable().get_item(uid=uid)
+        except exceptions.ItemNotFound:
+            return None
+        return dict(item[SessionTable.DATA_FIELD]), float(item[SessionTable.DATE_FIELD])
+
     @staticmethod
     def newSession(uid,data,expiration) :
         """
@@ -399,14 +591,8 @@ class SessionTable :
 
         Updates the exsiting session or creates a new one
         """
-        if(SessionTable.doesSessionExist(uid)) :
-            item = SessionTable.getTable().get_item(uid=uid)
-            item[SessionTable.DATA_FIELD] = data
-            item[SessionTable.DATE_FIELD] = toUnixTime(expiration)
-            item.save(overwrite=True)
-        else :
-            SessionTable.getTable().put_item(data={
-                SessionTable.KEY_NAME: uid,
-                SessionTable.DATA_FIELD: data,
-                SessionTable.DATE_FIELD: toUnixTime(expiration)
-            })
+        SessionTable.getTable().put_item(data={
+            SessionTable.KEY_NAME: uid,
+            SessionTable.DATA_FIELD: data,
+            SessionTable.DATE_FIELD: toUnixTime(expiration)
+        }, overwrite=True)
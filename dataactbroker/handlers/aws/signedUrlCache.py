@@ -0,0 +1,96 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from boto.s3 import connect_to_region
+from dataactcore.config import CONFIG_BROKER
+
+class SignedUrlCache :
+    """
+    This SignedUrlCache is a Singleton Class/ Namespace that signs S3 URLs with a single
+    process-wide connection and keeps a bounded LRU cache of the signed URLs
+
+    Signing with boto is a local computation once a connection exists, so the cost of signing
+    each URL is dominated by building the connection, which is done once per process here
+
+    Constants :
+
+    URL_LIFETIME -- (int) Seconds a signed URL is valid for
+    EXPIRATION_MARGIN -- (int) Seconds before expiration that a cached URL stops being handed out,
+                         so clients always have at least this long to use a URL
+    MAX_SIZE -- (int) The number of URLs to keep in the cache
+
+    """
+    URL_LIFETIME = CONFIG_BROKER.get("signed_url_lifetime", 2000)
+    EXPIRATION_MARGIN = 300
+    MAX_SIZE = 5000
+    _items = OrderedDict()
+    _lock = Lock()
+    _connection = None
+    _connectionKey = None
+
+    @staticmethod
+    def getConnection() :
+        """
+        returns the S3 connection for this process, creating it the first time it is needed
+        """
+        connectionKey = (os.getpid(), CONFIG_BROKER["aws_region"])
+        with SignedUrlCache._lock:
+            if SignedUrlCache._connection is None or SignedUrlCache._connectionKey != connectionKey:
+                SignedUrlCache._connection = connect_to_region(CONFIG_BROKER["aws_region"])
+                SignedUrlCache._connectionKey = connectionKey
+                SignedUrlCache._items.clear()
+            return SignedUrlCache._connection
+
+    @staticmethod
+    def getSignedUrl(path, fileName, method="GET", bucket=None) :
+        """
+        arguments:
+
+        path -- (String) the folder within the bucket
+        fileName -- (String) the file name within the folder
+        method -- (String) the HTTP method the URL is signed for
+        bucket -- (String) the bucket name, defaults to the broker bucket
+
+        returns a signed URL for the key, reusing a cached URL that is not close to expiring
+        """
+        if bucket is None:
+            bucket = CONFIG_BROKER["aws_bucket"]
+        key = "/" + path + "/" + fileName
+        cacheKey = (bucket, key, method)
+        now = time.time()
+        with SignedUrlCache._lock:
+            entry = SignedUrlCache._items.pop(cacheKey, None)
+            if entry is not None and entry[1] - SignedUrlCache.EXPIRATION_MARGIN > now:
+                # Reinsert to mark as most recently used
+                SignedUrlCache._items[cacheKey] = entry
+                return entry[0]
+        connection = SignedUrlCache.getConnection()
+        url = connection.generate_url(SignedUrlCache.URL_LIFETIME, method, bucket, key)
+        with SignedUrlCache._lock:
+            SignedUrlCache._items[cacheKey] = (url, now + SignedUrlCache.URL_LIFETIME)
+            while len(SignedUrlCache._items) > SignedUrlCache.MAX_SIZE:
+                SignedUrlCache._items.popitem(last=False)
+        return url
+
+    @staticmethod
+    def getSignedUrls(path, fileNames, method="GET", bucket=None) :
+        """
+        arguments:
+
+        path -- (String) the folder within the bucket
+        fileNames -- (list) file names within the folder
+        method -- (String) the HTTP method the URLs are signed for
+        bucket -- (String) the bucket name, defaults to the broker bucket
+
+        returns a dict of signed URLs keyed by file name
+        """
+        return dict((fileName, SignedUrlCache.getSignedUrl(path, fileName, method, bucket)) for fileName in fileNames)
+
+    @staticmethod
+    def clear() :
+        """
+        Drops all cached URLs
+        """
+        with SignedUrlCache._lock:
+            SignedUrlCache._items.clear()
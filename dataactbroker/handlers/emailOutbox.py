@@ -0,0 +1,196 @@
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta
+from threading import Condition, Lock, Thread
+from dataactcore.config import CONFIG_BROKER
+from dataactbroker.handlers.interfaceHolder import InterfaceHolder
+from dataactbroker.handlers.aws.sesEmail import sesEmail
+
+class EmailOutbox(object):
+    """ Sends emails queued in the email_outbox table with worker threads sharing the process's SES connection
+
+    Request handlers only add emails to the outbox.  Workers claim batches of due emails, send them no faster than the
+    SES send rate, record the whole batch as sent with one update, and retry failures with exponential backoff.  SES
+    sends each message with its own call, batching applies to the outbox reads and writes.  Emails are claimed with a
+    conditional update, so every broker process can work the same outbox, and an email claimed by a worker that
+    stopped is picked up again after CLAIM_TIMEOUT.
+
+    Class fields:
+    WORKER_COUNT -- Worker threads per process
+    BATCH_SIZE -- Most emails a worker claims at a time
+    MAX_SEND_RATE -- Most emails sent per second by this process, the SES account limit should be split across processes
+    MAX_ATTEMPTS -- Sends tried before an email is marked as failed
+    BACKOFF -- Seconds before the first retry, doubled for each later retry
+    POLL_INTERVAL -- Seconds an idle worker waits before checking the outbox for emails queued by other processes and retries
+    CLAIM_TIMEOUT -- Seconds before an unfinished claim is assumed to be abandoned
+    """
+    WORKER_COUNT = CONFIG_BROKER.get("email_workers", 2)
+    BATCH_SIZE = CONFIG_BROKER.get("email_batch_size", 10)
+    MAX_SEND_RATE = CONFIG_BROKER.get("ses_max_send_rate", 14)
+    MAX_ATTEMPTS = CONFIG_BROKER.get("email_max_attempts", 5)
+    BACKOFF = 30
+    POLL_INTERVAL = 10
+    CLAIM_TIMEOUT = 600
+    # One outbox per process, shared by all requests
+    outbox = None
+    outboxLock = Lock()
+
+    def __init__(self, workers = None, batchSize = None, maxSendRate = None, maxAttempts = None, backoff = None):
+        self.workerCount = workers if workers is not None else self.WORKER_COUNT
+        self.batchSize = max(1, batchSize if batchSize is not None else self.BATCH_SIZE)
+        self.sendInterval = 1.0 / (maxSendRate if maxSendRate is not None else self.MAX_SEND_RATE)
+        self.maxAttempts = maxAttempts if maxAttempts is not None else self.MAX_ATTEMPTS
+        self.backoff = backoff if backoff is not None else self.BACKOFF
+        self.condition = Condition(Lock())
+        self.woken = False
+        self.running = False
+        self.workers = []
+        self.rateLock = Lock()
+        self.nextSendTime = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.lastError = None
+        self.pid = os.getpid()
+
+    @classmethod
+    def getOutbox(cls):
+        """ Get outbox for this process, creating a new one after a fork since worker threads are not inherited """
+        with cls.outboxLock:
+            if cls.outbox is None or cls.outbox.pid != os.getpid():
+                cls.outbox = EmailOutbox()
+            return cls.outbox
+
+    @staticmethod
+    def outboxRow(email):
+        """ Build outbox row for a sesEmail, the dedupe key is a hash of the recipient, subject and content """
+        key = u"\n".join([email.toAddress, email.subject, email.content])
+        return {"to_address": email.toAddress, "from_address": email.fromAddress, "subject": email.subject,
+                "content": email.content, "dedupe_key": hashlib.sha1(key.encode("utf-8")).hexdigest()}
+
+    @classmethod
+    def enqueue(cls, database, emails):
+        """ Add emails to the outbox and wake this process's workers
+
+        Arguments:
+        database -- UserHandler used to add the emails, changes are committed
+        emails -- list of sesEmail objects
+        Returns:
+        Number of emails queued, emails identical to one that has not been sent yet are skipped
+        """
+        queued = database.queueEmails([cls.outboxRow(email) for email in emails])
+        if queued:
+            cls.getOutbox().wake()
+        return queued
+
+    def start(self):
+        """ Start worker threads if they are not running """
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+            for i in range(self.workerCount):
+                worker = Thread(target=self.work, name="email-outbox-{}".format(i))
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+
+    def stop(self):
+        """ Stop worker threads after their current batch, emails left in the outbox are sent later by any process """
+        with self.condition:
+            workers = self.workers
+            self.workers = []
+            self.running = False
+            self.condition.notify_all()
+        for worker in workers:
+            worker.join()
+
+    def wake(self):
+        """ Start the workers if needed and tell them there are emails waiting """
+        self.start()
+        with self.condition:
+            self.woken = True
+            self.condition.notify_all()
+
+    def work(self):
+        """ Worker loop, sends batches until the outbox has nothing due, then waits to be woken or for the poll interval """
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+            try:
+                claimed = self.sendBatch()
+            except Exception as e:
+                # Outbox could not be read or updated, try again after the poll interval
+                claimed = 0
+                with self.rateLock:
+                    self.lastError = str(e)
+            if claimed < self.batchSize:
+                with self.condition:
+                    if self.running and not self.woken:
+                        self.condition.wait(self.POLL_INTERVAL)
+                    self.woken = False
+
+    def sendBatch(self):
+        """ Claim and send one batch of due emails
+
+        Returns:
+        Number of emails claimed
+        """
+        interfaces = InterfaceHolder()
+        try:
+            database = interfaces.userDb
+            emails = database.claimOutboxEmails(self.batchSize, datetime.utcnow() - timedelta(seconds=self.CLAIM_TIMEOUT))
+            sentIds = []
+            for email in emails:
+                self.waitForSendSlot()
+                try:
+                    sesEmail.deliver(email.from_address, email.subject, email.content, email.to_address)
+                except Exception as e:
+                    retryAt = None
+                    if email.attempts < self.maxAttempts:
+                        retryAt = datetime.utcnow() + timedelta(seconds=self.backoff * (2 ** (email.attempts - 1)))
+                    with self.rateLock:
+                        self.lastError = str(e)
+                        if retryAt is None:
+                            self.failed += 1
+                        else:
+                            self.retries += 1
+                    database.markOutboxEmailFailed(email.email_outbox_id, str(e), retryAt)
+                else:
+                    sentIds.append(email.email_outbox_id)
+            database.markOutboxEmailsSent(sentIds)
+            with self.rateLock:
+                self.sent += len(sentIds)
+            return len(emails)
+        finally:
+            interfaces.close()
+
+    def drain(self):
+        """ Send batches on the calling thread until no email is due
+
+        Returns:
+        Number of emails claimed
+        """
+        claimed = 0
+        while True:
+            batch = self.sendBatch()
+            claimed += batch
+            if batch < self.batchSize:
+                return claimed
+
+    def waitForSendSlot(self):
+        """ Sleep until this process may send another email without going over the send rate """
+        with self.rateLock:
+            now = time.time()
+            sendTime = max(now, self.nextSendTime)
+            self.nextSendTime = sendTime + self.sendInterval
+        if sendTime > now:
+            time.sleep(sendTime - now)
+
+    def getMetrics(self):
+        """ Return counts of emails sent, retried and failed by this process """
+        with self.rateLock:
+            return {"sent": self.sent, "failed": self.failed, "retries": self.retries, "last_error": self.lastError,
+                    "workers": len(self.workers)}
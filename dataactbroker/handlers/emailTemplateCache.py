@@ -0,0 +1,78 @@
+import re
+import time
+from threading import Lock
+
+class EmailTemplateCache:
+    """ Process-wide cache of email templates, split into parts when loaded so parameters are filled in with one pass
+
+    Every template is read with one query the first time any template is needed.  The cache keeps the template version
+    it was loaded at, a trigger bumps that version whenever the email_template table changes, including changes made by
+    setupEmails in another process, and the version is checked at most every CHECK_INTERVAL seconds.
+    UserHandler.loadEmailTemplate clears the cache of its own process, so its changes are seen there at once.
+
+    Class fields:
+    PLACEHOLDER -- Parameter keys in template content, such as [URL]
+    CHECK_INTERVAL -- Seconds between checks of the template version, bounds how long changes made elsewhere go unseen
+    """
+    PLACEHOLDER = re.compile(r"(\[[A-Z_]+\])")
+    CHECK_INTERVAL = 60
+    # Maps template type name to (subject, content parts)
+    templates = None
+    version = None
+    checkedAt = 0
+    lock = Lock()
+
+    @staticmethod
+    def compile(content):
+        """ Split template content into parts, literal text at even indexes and parameter keys at odd indexes """
+        return EmailTemplateCache.PLACEHOLDER.split(content)
+
+    @staticmethod
+    def fill(parts, parameters):
+        """ Build content from compiled parts, keys without a parameter are left in place and None values are left blank """
+        content = list(parts)
+        for i in range(1, len(content), 2):
+            if content[i] in parameters:
+                value = parameters[content[i]]
+                content[i] = value if value is not None else ""
+        return "".join(content)
+
+    @staticmethod
+    def clear():
+        """ Drop cached templates, they are reloaded on next use """
+        with EmailTemplateCache.lock:
+            EmailTemplateCache.templates = None
+            EmailTemplateCache.version = None
+
+    @staticmethod
+    def getTemplate(templateType, database):
+        """ Get (subject, content parts) for a template type, loading or refreshing templates through database if needed
+
+        Arguments:
+            templateType - Name of template type
+            database - UserHandler used to check the template version and load templates
+        Returns:
+            Tuple of (subject, content parts), raises NoResultFound if there is no template of this type
+        """
+        with EmailTemplateCache.lock:
+            now = time.time()
+            if EmailTemplateCache.templates is None or now - EmailTemplateCache.checkedAt > EmailTemplateCache.CHECK_INTERVAL:
+                version = database.getEmailTemplateVersion()
+                if EmailTemplateCache.templates is None or version != EmailTemplateCache.version:
+                    EmailTemplateCache.templates = dict((name, (subject, EmailTemplateCache.compile(content)))
+                        for name, subject, content in database.getEmailTemplates())
+                    EmailTemplateCache.version = version
+                EmailTemplateCache.checkedAt = now
+            template = EmailTemplateCache.templates.get(templateType)
+            if template is None:
+                # Not loaded yet, read it alone so a missing template raises the usual error
+                row = database.getEmailTemplate(templateType)
+                template = (row.subject, EmailTemplateCache.compile(row.content))
+                EmailTemplateCache.templates[templateType] = template
+            return template
+
+    @staticmethod
+    def render(templateType, parameters, database):
+        """ Return (subject, content) for a template type with parameters filled in """
+        subject, parts = EmailTemplateCache.getTemplate(templateType, database)
+        return subject, EmailTemplateCache.fill(parts, parameters or {})
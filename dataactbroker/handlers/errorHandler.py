@@ -1,22 +1,236 @@
+from datetime import datetime
+from sqlalchemy import func
 from sqlalchemy.orm import joinedload
-from dataactcore.models.errorModels import FileStatus, ErrorData
+from dataactcore.models.errorModels import FileStatus, ErrorData, ErrorType
 from dataactcore.models.errorInterface import ErrorInterface
+from dataactcore.utils.responseException import ResponseException
+from dataactcore.utils.statusCode import StatusCode
+from dataactbroker.models.errorModels import JobVersion, ErrorMetricSummary, ErrorMetricRefresh
 
 class ErrorHandler(ErrorInterface) :
     """ Manages communication with the error database """
+    SUMMARY_BATCH_SIZE = 1000 # How many rows to fetch or insert at a time when rebuilding the error metric summary
 
     def getErrorMetricsByJobId (self,jobId) :
         """ Get error metrics for specified job, including number of errors for each field name and error type """
-        resultList = []
-
         query = self.session.query(FileStatus).options(joinedload("status")).filter(FileStatus.job_id == jobId)
-        queryResult = self.runUniqueQuery(query,"No file status for this job", "Conflicting file statuses for this job")
+        fileStatus = self.runUniqueQuery(query,"No file status for this job", "Conflicting file statuses for this job")
+        errorRows = self.session.query(ErrorData).options(joinedload("error_type")).filter(ErrorData.job_id == jobId).order_by(ErrorData.error_data_id).all()
+        return ErrorHandler.buildErrorMetrics(fileStatus, errorRows)
+
+    def getErrorMetricsForJobList(self, jobIds, limit = None, fieldName = None):
+        """ Get error metrics for every job in list, with errors grouped and summed by the database in a single query
+
+        Arguments:
+            jobIds - List of job IDs
+            limit - If provided, only the errors with the most occurrences are returned, up to this many per job
+            fieldName - If provided, only errors for this field are returned
+        Returns:
+            Dictionary of lists of error metrics keyed by job ID, ordered by occurrences with the most first
+        """
+        if not jobIds:
+            return {}
+        fileStatuses = self.getFileStatusesForJobList(jobIds)
+        for jobId in jobIds:
+            if jobId not in fileStatuses:
+                raise ResponseException("No file status for this job", StatusCode.CLIENT_ERROR)
+
+        occurrences = func.sum(ErrorData.occurrences)
+        firstErrorId = func.min(ErrorData.error_data_id)
+        query = self.session.query(ErrorData.job_id, ErrorData.field_name, ErrorType.name, ErrorType.description, ErrorData.rule_failed,
+            occurrences.label("occurrences"), firstErrorId.label("first_error_id"),
+            func.row_number().over(partition_by=ErrorData.job_id, order_by=(occurrences.desc(), firstErrorId)).label("rank"))
+        query = query.join(ErrorType, ErrorData.error_type_id == ErrorType.error_type_id).filter(ErrorData.job_id.in_(jobIds))
+        if fieldName is not None:
+            query = query.filter(ErrorData.field_name == fieldName)
+        query = query.group_by(ErrorData.job_id, ErrorData.field_name, ErrorType.name, ErrorType.description, ErrorData.rule_failed)
+        ranked = query.subquery()
+        rankedQuery = self.session.query(ranked)
+        if limit is not None:
+            rankedQuery = rankedQuery.filter(ranked.c.rank <= limit)
+        errorDict = {}
+        for row in rankedQuery.order_by(ranked.c.job_id, ranked.c.rank).all():
+            errorDict.setdefault(row.job_id, []).append({"field_name":row.field_name, "error_name":row.name, "error_description":row.description, "occurrences":str(row.occurrences), "rule_failed":row.rule_failed})
+
+        metrics = {}
+        for jobId in jobIds:
+            fileStatus = fileStatuses[jobId]
+            if(not fileStatus.status.name == "complete"):
+                metrics[jobId] = ErrorHandler.buildErrorMetrics(fileStatus, [])
+            else:
+                metrics[jobId] = errorDict.get(jobId, [])
+        return metrics
+
+    def getJobVersionSum(self, jobIds):
+        """ Get total of the change versions for jobs in list, versions are bumped by triggers whenever file status or error data for a job changes
+
+        Arguments:
+            jobIds - List of job IDs
+        Returns:
+            Sum of versions, which increases whenever any of the jobs change
+        """
+        if not jobIds:
+            return 0
+        return self.session.query(func.coalesce(func.sum(JobVersion.version), 0)).filter(JobVersion.job_id.in_(jobIds)).scalar()
+
+    def getErrorCountsForJobList(self, jobIds):
+        """ Get total error occurrences for every job in list, summed by the database in a single query
+
+        Arguments:
+            jobIds - List of job IDs
+        Returns:
+            Dictionary of error counts keyed by job ID, jobs without errors are left out
+        """
+        if not jobIds:
+            return {}
+        query = self.session.query(ErrorData.job_id, func.sum(ErrorData.occurrences)).filter(ErrorData.job_id.in_(jobIds)).group_by(ErrorData.job_id)
+        return dict((jobId, int(count or 0)) for jobId, count in query.all())
+
+    def getFileStatusesForJobList(self, jobIds):
+        """ Get file status for every job in list with a single query
+
+        Arguments:
+            jobIds - List of job IDs
+        Returns:
+            Dictionary of FileStatus objects (with status loaded) keyed by job ID, jobs without a file status are left out
+        """
+        if not jobIds:
+            return {}
+        query = self.session.query(FileStatus).options(joinedload("status")).filter(FileStatus.job_id.in_(jobIds))
+        return dict((fileStatus.job_id, fileStatus) for fileStatus in query.all())
+
+    def getErrorDataForJobList(self, jobIds):
+        """ Get all error data rows for every job in list with a single query
+
+        Arguments:
+            jobIds - List of job IDs
+        Returns:
+            Dictionary of lists of ErrorData objects (with error_type loaded) keyed by job ID, jobs without errors are left out
+        """
+        errorDict = {}
+        if not jobIds:
+            return errorDict
+        query = self.session.query(ErrorData).options(joinedload("error_type")).filter(ErrorData.job_id.in_(jobIds)).order_by(ErrorData.error_data_id)
+        for errorRow in query.all():
+            errorDict.setdefault(errorRow.job_id, []).append(errorRow)
+        return errorDict
 
-        if(not queryResult.status.status_id == self.getStatusId("complete")) :
-            return [{"field_name":"File Level Error","error_name": queryResult.status.name,"error_description":str(queryResult.status.description),"occurrences":1,"rule_failed":""}]
+    def resetErrorsForJobList(self, jobIds):
+        """ Delete all error data for every job in list with a single statement
 
-        queryResult = self.session.query(ErrorData).options(joinedload("error_type")).filter(ErrorData.job_id == jobId).all()
-        for result in queryResult:
+        Arguments:
+            jobIds - List of job IDs
+        """
+        if not jobIds:
+            return
+        self.session.query(ErrorData).filter(ErrorData.job_id.in_(jobIds)).delete(synchronize_session=False)
+        self.session.commit()
+
+    def resetFileStatusForJobList(self, jobIds):
+        """ Delete the file status for every job in list with a single statement, so the jobs show as not yet validated
+
+        Arguments:
+            jobIds - List of job IDs
+        """
+        if not jobIds:
+            return
+        self.session.query(FileStatus).filter(FileStatus.job_id.in_(jobIds)).delete(synchronize_session=False)
+        self.session.commit()
+
+    def refreshErrorMetricSummary(self, jobInfo):
+        """ Rebuild the error metric summary from error data in one transaction, readers see the previous summary until it commits
+
+        Arguments:
+            jobInfo - Dictionary of (submission date, agency name, file type name) keyed by job ID, errors for jobs not in it are left out
+        Returns:
+            Number of summary rows written
+        """
+        groups = {}
+        def addGroup(jobId, fieldName, errorName, ruleFailed, occurrences):
+            if jobId not in jobInfo:
+                return
+            key = jobInfo[jobId] + (fieldName, errorName, ruleFailed)
+            groups[key] = groups.get(key, 0) + int(occurrences or 0)
+
+        # Row errors only count for files that completed validation, as in getErrorMetricsForJobList
+        completeId = self.getStatusId("complete")
+        query = self.session.query(ErrorData.job_id, ErrorData.field_name, ErrorType.name, ErrorData.rule_failed, func.sum(ErrorData.occurrences))
+        query = query.join(ErrorType, ErrorData.error_type_id == ErrorType.error_type_id).join(FileStatus, FileStatus.job_id == ErrorData.job_id)
+        query = query.filter(FileStatus.status_id == completeId).group_by(ErrorData.job_id, ErrorData.field_name, ErrorType.name, ErrorData.rule_failed)
+        for row in query.yield_per(ErrorHandler.SUMMARY_BATCH_SIZE):
+            addGroup(*row)
+        # Files that failed before row level validation count once, as a file level error
+        for fileStatus in self.session.query(FileStatus).options(joinedload("status")).filter(FileStatus.status_id != completeId).all():
+            addGroup(fileStatus.job_id, "File Level Error", fileStatus.status.name, "", 1)
+
+        rows = [{"submission_date": key[0], "agency_name": key[1], "file_type": key[2], "field_name": key[3], "error_name": key[4],
+            "rule_failed": key[5], "occurrences": occurrences} for key, occurrences in groups.items()]
+        self.session.query(ErrorMetricSummary).delete(synchronize_session=False)
+        for start in range(0, len(rows), ErrorHandler.SUMMARY_BATCH_SIZE):
+            self.session.execute(ErrorMetricSummary.__table__.insert(), rows[start:start + ErrorHandler.SUMMARY_BATCH_SIZE])
+        self.session.merge(ErrorMetricRefresh(error_metric_refresh_id = 1, refreshed_at = datetime.utcnow()))
+        self.session.commit()
+        return len(rows)
+
+    def getErrorMetricRollup(self, agencyName = None, startDate = None, endDate = None, allAgencies = False):
+        """ Get error totals by rule, by field, and by file type from the error metric summary, in a single grouped query
+
+        Arguments:
+            agencyName - Only count submissions for this agency, unless allAgencies is set
+            startDate - If provided, only count submissions made on or after this date
+            endDate - If provided, only count submissions made on or before this date
+            allAgencies - If True, count submissions for every agency
+        Returns:
+            Dictionary with keys "by_rule", "by_field", and "by_file_type", each a list ordered by occurrences with the
+            most first, "total", and "refreshed_at", the UTC time the summary was last rebuilt or None if it never was
+        """
+        query = self.session.query(ErrorMetricSummary.file_type, ErrorMetricSummary.field_name, ErrorMetricSummary.error_name,
+            ErrorMetricSummary.rule_failed, func.sum(ErrorMetricSummary.occurrences))
+        if not allAgencies:
+            query = query.filter(ErrorMetricSummary.agency_name == agencyName)
+        if startDate is not None:
+            query = query.filter(ErrorMetricSummary.submission_date >= startDate)
+        if endDate is not None:
+            query = query.filter(ErrorMetricSummary.submission_date <= endDate)
+        query = query.group_by(ErrorMetricSummary.file_type, ErrorMetricSummary.field_name, ErrorMetricSummary.error_name, ErrorMetricSummary.rule_failed)
+
+        byRule, byField, byFileType = {}, {}, {}
+        for fileType, fieldName, errorName, ruleFailed, occurrences in query.all():
+            occurrences = int(occurrences)
+            byRule[(errorName, ruleFailed)] = byRule.get((errorName, ruleFailed), 0) + occurrences
+            byField[fieldName] = byField.get(fieldName, 0) + occurrences
+            byFileType[fileType] = byFileType.get(fileType, 0) + occurrences
+        mostFirst = lambda totals: sorted(totals.items(), key = lambda item: -item[1])
+        refreshedAt = self.session.query(ErrorMetricRefresh.refreshed_at).filter(ErrorMetricRefresh.error_metric_refresh_id == 1).scalar()
+        return {"by_rule": [{"error_name": key[0], "rule_failed": key[1], "occurrences": total} for key, total in mostFirst(byRule)],
+            "by_field": [{"field_name": key, "occurrences": total} for key, total in mostFirst(byField)],
+            "by_file_type": [{"file_type": key, "occurrences": total} for key, total in mostFirst(byFileType)],
+            "total": sum(byFileType.values()), "refreshed_at": refreshedAt}
+
+    @staticmethod
+    def buildErrorMetrics(fileStatus, errorRows):
+        """ Build list of error metrics for one job from already loaded rows
+
+        Arguments:
+            fileStatus - FileStatus object for this job, with status loaded
+            errorRows - List of ErrorData objects for this job, with error_type loaded
+        Returns:
+            List of dictionaries, one per field name and error type
+        """
+        if(not fileStatus.status.name == "complete") :
+            return [{"field_name":"File Level Error","error_name": fileStatus.status.name,"error_description":str(fileStatus.status.description),"occurrences":1,"rule_failed":""}]
+
+        resultList = []
+        for result in errorRows:
             recordDict = {"field_name":result.field_name,"error_name": result.error_type.name, "error_description": result.error_type.description, "occurrences": str(result.occurrences), "rule_failed": result.rule_failed}
             resultList.append(recordDict)
         return resultList
+
+    @staticmethod
+    def getErrorTypeForFileStatus(fileStatus):
+        """ Returns either "none", "header_errors", or "row_errors" depending on what errors occurred during validation """
+        if fileStatus.status.name == "header_error":
+            return "header_errors"
+        elif fileStatus.row_errors_present:
+            return "row_errors"
+        return "none"
@@ -1,5 +1,8 @@
 import os
-from flask import session ,request
+import json
+import time
+import hashlib
+from flask import session ,request, Response
 from datetime import datetime, timedelta
 from werkzeug import secure_filename
 from sqlalchemy.orm.exc import NoResultFound,MultipleResultsFound
@@ -10,10 +13,16 @@ from dataactcore.utils.statusCode import StatusCode
 from dataactcore.utils.responseException import ResponseException
 from dataactcore.config import CONFIG_BROKER
 from dataactbroker.handlers.managerProxy import ManagerProxy
+from dataactbroker.handlers.errorHandler import ErrorHandler
 from dataactbroker.handlers.interfaceHolder import InterfaceHolder
+from dataactbroker.handlers.localUpload import LocalUpload
+from dataactbroker.handlers.submissionEvents import SubmissionEvents
 from dataactbroker.handlers.aws.session import LoginSession
+from dataactbroker.handlers.aws.signedUrlCache import SignedUrlCache
+from dataactbroker.handlers.aws.multipartUpload import MultipartUploadManager
+from dataactbroker.handlers.userContext import UserContext
 
-class FileHandler:
+class FileHandler(object):
     """ Responsible for all tasks relating to file upload
 
     Static fields:
@@ -26,6 +35,13 @@ class FileHandler:
 
     FILE_TYPES = ["appropriations","award_financial","award","program_activity"]
     VALIDATOR_RESPONSE_FILE = "validatorResponse"
+    # Seconds a submission events request waits for a change, by default and at most
+    EVENT_TIMEOUT = 25
+    MAX_EVENT_TIMEOUT = 55
+    # Seconds an event stream stays open before the client is asked to reconnect, and between keepalive comments
+    STREAM_SECONDS = 300
+    HEARTBEAT_SECONDS = 15
+    STREAM_RETRY_MS = 1000
 
     def __init__(self,request,interfaces = None,isLocal= False,serverPath =""):
         """
@@ -36,32 +52,33 @@ class FileHandler:
         self.request = request
         if(interfaces != None):
             self.interfaces = interfaces
-            self.jobManager = interfaces.jobDb
         self.isLocal = isLocal
         self.serverPath = serverPath
 
     def addInterfaces(self,interfaces):
         self.interfaces = interfaces
-        self.jobManager = interfaces.jobDb
+
+    @property
+    def jobManager(self):
+        """ Job tracker interface, only opened when a route actually uses it """
+        return self.interfaces.jobDb
 
     def getErrorReportURLsForSubmission(self):
         """
         Gets the Signed URLs for download based on the submissionId
         """
         try :
-            self.s3manager = s3UrlHandler()
             safeDictionary = RequestDictionary(self.request)
             submissionId = safeDictionary.getValue("submission_id")
             responseDict ={}
-            for jobId in self.jobManager.getJobsBySubmission(submissionId):
-                if(self.jobManager.getJobType(jobId) == "csv_record_validation"):
-                    if(not self.isLocal):
-                        responseDict["job_"+str(jobId)+"_error_url"] = self.s3manager.getSignedUrl("errors",self.jobManager.getReportPath(jobId),"GET")
-                    else:
-                        path = os.path.join(self.serverPath, self.jobManager.getReportPath(jobId))
-                        responseDict["job_"+str(jobId)+"_error_url"] = path
+            # Report paths for all jobs come from one query, and URLs are signed locally with a cached connection
+            for jobId, reportPath in self.jobManager.getReportPathsForSubmission(submissionId):
+                if(not self.isLocal):
+                    responseDict["job_"+str(jobId)+"_error_url"] = SignedUrlCache.getSignedUrl("errors",reportPath,"GET")
+                else:
+                    responseDict["job_"+str(jobId)+"_error_url"] = os.path.join(self.serverPath, reportPath)
             if(not self.isLocal):
-                crossFileReport = self.s3manager.getSignedUrl("errors",self.jobManager.getCrossFileReportPath(submissionId),"GET")
+                crossFileReport = SignedUrlCache.getSignedUrl("errors",self.jobManager.getCrossFileReportPath(submissionId),"GET")
             else:
                 crossFileReport = os.path.join(self.serverPath, self.jobManager.getCrossFileReportPath(submissionId))
             responseDict["cross_file_error_url"] = crossFileReport
@@ -115,7 +132,7 @@ class FileHandler:
                     responseDict[fileType+"_key"] = uploadName
                     fileNameMap.append((fileType,uploadName,filename))
 
-            fileJobDict = self.jobManager.createJobs(fileNameMap,submissionId,existingSubmission)
+            fileJobDict = self.jobManager.createJobs(fileNameMap,submissionId,existingSubmission,self.interfaces.errorDb)
             for fileType in fileJobDict.keys():
                 if (not "submission_id" in fileType) :
                     responseDict[fileType+"_id"] = fileJobDict[fileType]
@@ -173,12 +190,21 @@ class FileHandler:
             # Unexpected exception, this is a 500 server error
             return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
 
-    def checkSubmissionPermission(self,submission):
-        """ Check if current user has permisson to access submission and return user object. """
+    def getCurrentUser(self):
+        """ Return tuple of (user object, True if user is an admin) for the logged in user """
         userId = LoginSession.getName(session)
+        # Use the user loaded by permissions_check if there is one
+        user = UserContext.getUser(userId)
+        if user is not None:
+            return user, UserContext.hasPermission("website_admin")
         user = self.interfaces.userDb.getUserByUID(userId)
+        return user, self.interfaces.userDb.hasPermission(user,"website_admin")
+
+    def checkSubmissionPermission(self,submission):
+        """ Check if current user has permisson to access submission and return user object. """
+        user, isAdmin = self.getCurrentUser()
         # Check that user has permission to see this submission, user must either own the submission or be an admin
-        if(submission.user_id != userId and not self.interfaces.userDb.hasPermission(user,"website_admin")):
+        if(submission.user_id != LoginSession.getName(session) and not isAdmin):
             raise ResponseException("User does not have permission to view that submission",StatusCode.CLIENT_ERROR)
         return user
 
@@ -198,8 +224,16 @@ class FileHandler:
             # Check that user has access to submission
             user = self.checkSubmissionPermission(submission)
 
-            # Get jobs in this submission
-            jobs = self.jobManager.getJobsBySubmission(submissionId)
+            # Skip building the response if the client already has the current version
+            etag = self.getSubmissionEtag(submissionId, "check_status")
+            if(etag in self.request.if_none_match):
+                return self.notModified(etag)
+
+            # Load every job in this submission, then all file statuses and error rows for those jobs, one query each
+            jobs = self.jobManager.getJobsForSubmission(submissionId)
+            jobIds = [job.job_id for job in jobs]
+            fileStatusDict = self.interfaces.errorDb.getFileStatusesForJobList(jobIds)
+            errorDataDict = self.interfaces.errorDb.getErrorDataForJobList(jobIds)
 
             # Build dictionary of submission info with info about each job
             submissionInfo = {}
@@ -207,85 +241,196 @@ class FileHandler:
             submissionInfo["agency_name"] = submission.agency_name
             submissionInfo["reporting_period_start_date"] = submission.reporting_start_date.strftime("%m/%d/%Y")
             submissionInfo["reporting_period_end_date"] = submission.reporting_end_date.strftime("%m/%d/%Y")
-            submissionInfo["created_on"] = self.interfaces.jobDb.getFormattedDatetimeBySubmissionId(submissionId)
+            submissionInfo["created_on"] = submission.datetime_utc.strftime("%m/%d/%Y")
             # Include number of errors in submission
-            submissionInfo["number_of_errors"] = self.interfaces.errorDb.sumNumberOfErrorsForJobList(jobs)
-            submissionInfo["number_of_rows"] = self.interfaces.jobDb.sumNumberOfRowsForJobList(jobs)
-
+            submissionInfo["number_of_errors"] = sum(errorRow.occurrences for errorRows in errorDataDict.values() for errorRow in errorRows if errorRow.occurrences)
+            submissionInfo["number_of_rows"] = sum(job.number_of_rows for job in jobs if job.number_of_rows)
 
-            for jobId in jobs:
-                jobInfo = {}
-                if(self.jobManager.getJobType(jobId) != "csv_record_validation"):
+            for job in jobs:
+                if(job.type.name != "csv_record_validation"):
                     continue
-                jobInfo["job_id"] = jobId
-                jobInfo["job_status"] = self.jobManager.getJobStatus(jobId)
-                jobInfo["job_type"] = self.jobManager.getJobType(jobId)
-                jobInfo["filename"] = self.jobManager.getOriginalFilenameById(jobId)
-                try:
-                    jobInfo["file_status"] = self.interfaces.errorDb.getStatusLabelByJobId(jobId)
-                except ResponseException as e:
-                    # Job ID not in error database, probably did not make it to validation, or has not yet been validated
-                    jobInfo["file_status"] = ""
-                    jobInfo["missing_headers"] = []
-                    jobInfo["duplicated_headers"] = []
-                    jobInfo["error_type"] = ""
-                    jobInfo["error_data"] = []
-                else:
-                    # If job ID was found in file_status, we should be able to get header error lists and file data
-                    # Get string of missing headers and parse as a list
-                    missingHeaderString = self.interfaces.errorDb.getMissingHeadersByJobId(jobId)
-                    if missingHeaderString is not None:
-                        # Split header string into list, excluding empty strings
-                        jobInfo["missing_headers"] = [n.strip() for n in missingHeaderString.split(",") if len(n) > 0]
-                    else:
-                        jobInfo["missing_headers"] = []
-                    # Get string of duplicated headers and parse as a list
-                    duplicatedHeaderString = self.interfaces.errorDb.getDuplicatedHeadersByJobId(jobId)
-                    if duplicatedHeaderString is not None:
-                        # Split header string into list, excluding empty strings
-                        jobInfo["duplicated_headers"] = [n.strip() for n in duplicatedHeaderString.split(",") if len(n) > 0]
-                    else:
-                        jobInfo["duplicated_headers"] = []
-                    jobInfo["error_type"] = self.interfaces.errorDb.getErrorType(jobId)
-                    jobInfo["error_data"] = self.interfaces.errorDb.getErrorMetricsByJobId(jobId)
-                # File size and number of rows not dependent on error DB
-                # Get file size
-                jobInfo["file_size"] = self.jobManager.getFileSizeById(jobId)
-                # Get number of rows in file
-                jobInfo["number_of_rows"] = self.jobManager.getNumberOfRowsById(jobId)
-
-                try :
-                    jobInfo["file_type"] = self.jobManager.getFileType(jobId)
-                except Exception as e:
-                    jobInfo["file_type"]  = ''
+                jobInfo = self.getJobStatusInfo(job, fileStatusDict.get(job.job_id), errorDataDict.get(job.job_id, []))
                 submissionInfo["jobs"].append(jobInfo)
 
             # Build response object holding dictionary
-            return JsonResponse.create(StatusCode.OK,submissionInfo)
+            return self.addEtag(JsonResponse.create(StatusCode.OK,submissionInfo), etag)
+        except ResponseException as e:
+            return JsonResponse.error(e,e.status)
+        except Exception as e:
+            # Unexpected exception, this is a 500 server error
+            return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
+
+    def getSubmissionEvents(self, submissionId):
+        """ Wait for a submission to change and return the status of its jobs
+
+        Query string may include "since", the last version the client received, and "timeout" in seconds.  Responds as
+        soon as the submission version is newer than "since", or with "changed" set to false once timeout passes.  If the
+        request accepts text/event-stream, changes are sent as server-sent events until STREAM_SECONDS pass, with the
+        version as the event ID so a reconnecting client resumes from Last-Event-ID.
+
+        Returns:
+            A flask response object holding submission_id, version, changed, and a list of jobs with job_id, job_type,
+            file_type, and status
+        """
+        try:
+            submission = self.jobManager.getSubmissionById(submissionId)
+            self.checkSubmissionPermission(submission)
+            since = int(self.request.headers.get("Last-Event-ID", self.request.args.get("since", -1)))
+            timeout = min(float(self.request.args.get("timeout", self.EVENT_TIMEOUT)), self.MAX_EVENT_TIMEOUT)
+            SubmissionEvents.startListener(self.jobManager.engine)
+            # Return this request's interfaces to the pool rather than holding them while waiting
+            self.interfaces.close()
+            if(self.request.accept_mimetypes.best == "text/event-stream"):
+                return Response(self.streamSubmissionEvents(submissionId, since), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+            return JsonResponse.create(StatusCode.OK, self.waitForSubmissionChange(submissionId, since, timeout))
+        except ( ValueError , TypeError ) as e:
+            return JsonResponse.error(e,StatusCode.CLIENT_ERROR)
         except ResponseException as e:
             return JsonResponse.error(e,e.status)
         except Exception as e:
             # Unexpected exception, this is a 500 server error
             return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
 
+    @classmethod
+    def waitForSubmissionChange(cls, submissionId, since, timeout):
+        """ Block until the submission version is newer than since or timeout passes, return dict describing the submission
+
+        Database interfaces are only held while reading, not while waiting
+        """
+        deadline = time.time() + timeout
+        token = SubmissionEvents.register(submissionId)
+        try:
+            while True:
+                interfaces = InterfaceHolder()
+                try:
+                    version, jobIds = interfaces.jobDb.getSubmissionVersion(submissionId)
+                    remaining = deadline - time.time()
+                    if(version > since or remaining <= 0):
+                        jobs = [{"job_id": job.job_id, "job_type": job.type.name, "file_type": job.file_type.name if job.file_type else "",
+                                 "status": job.status.name} for job in interfaces.jobDb.getJobsForSubmission(submissionId)]
+                        return {"submission_id": submissionId, "version": version, "changed": version > since, "jobs": jobs}
+                finally:
+                    interfaces.close()
+                token, notified = SubmissionEvents.wait(submissionId, token, remaining)
+        finally:
+            SubmissionEvents.unregister(submissionId)
+
+    @classmethod
+    def streamSubmissionEvents(cls, submissionId, since):
+        """ Generate server-sent events for each change to a submission, with comments in between to keep the connection open """
+        deadline = time.time() + cls.STREAM_SECONDS
+        yield "retry: {}\n\n".format(cls.STREAM_RETRY_MS)
+        while True:
+            remaining = deadline - time.time()
+            if(remaining <= 0):
+                return
+            event = cls.waitForSubmissionChange(submissionId, since, min(remaining, cls.HEARTBEAT_SECONDS))
+            if(event["changed"]):
+                since = event["version"]
+                yield "id: {}\nevent: status\ndata: {}\n\n".format(since, json.dumps(event))
+            else:
+                yield ": keepalive\n\n"
+
+    def getSubmissionEtag(self, submissionId, *keyParts):
+        """ Build a strong ETag for a response about a submission
+
+        The ETag is a hash of the submission's change version and the change versions of its jobs in the error database, so
+        it changes whenever the submission, a job, a file status, or an error row changes.  Key parts should name the route
+        and any request values that change the response.
+        """
+        version, jobIds = self.jobManager.getSubmissionVersion(submissionId)
+        errorVersion = self.interfaces.errorDb.getJobVersionSum(jobIds)
+        key = "|".join(str(part) for part in [submissionId, version, ",".join(str(jobId) for jobId in jobIds), errorVersion] + list(keyParts))
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def addEtag(response, etag):
+        """ Add ETag to response, and tell clients to revalidate each time rather than reuse a cached copy """
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    @staticmethod
+    def notModified(etag):
+        """ Return empty 304 response for a client that already has the current version """
+        return FileHandler.addEtag(Response(status=304), etag)
+
+    @staticmethod
+    def getJobStatusInfo(job, fileStatus, errorRows):
+        """ Build the status dictionary for one validation job from already loaded rows
+
+        Arguments:
+            job -- JobStatus object, with status, type, and file type loaded
+            fileStatus -- FileStatus object for this job, or None if the job has not been validated
+            errorRows -- List of ErrorData objects for this job
+
+        Returns:
+            Dictionary of job status info to be included in the check_status response
+        """
+        jobInfo = {}
+        jobInfo["job_id"] = job.job_id
+        jobInfo["job_status"] = job.status.name
+        jobInfo["job_type"] = job.type.name
+        jobInfo["filename"] = job.original_filename
+        if fileStatus is None:
+            # Job ID not in error database, probably did not make it to validation, or has not yet been validated
+            jobInfo["file_status"] = ""
+            jobInfo["missing_headers"] = []
+            jobInfo["duplicated_headers"] = []
+            jobInfo["error_type"] = ""
+            jobInfo["error_data"] = []
+        else:
+            # If job ID was found in file_status, we should be able to get header error lists and file data
+            jobInfo["file_status"] = fileStatus.status.name
+            jobInfo["missing_headers"] = FileHandler.splitHeaderString(fileStatus.headers_missing)
+            jobInfo["duplicated_headers"] = FileHandler.splitHeaderString(fileStatus.headers_duplicated)
+            jobInfo["error_type"] = ErrorHandler.getErrorTypeForFileStatus(fileStatus)
+            jobInfo["error_data"] = ErrorHandler.buildErrorMetrics(fileStatus, errorRows)
+        # File size and number of rows not dependent on error DB
+        jobInfo["file_size"] = job.file_size
+        jobInfo["number_of_rows"] = job.number_of_rows
+        if job.file_type is not None:
+            jobInfo["file_type"] = job.file_type.name
+        else:
+            jobInfo["file_type"] = ''
+        return jobInfo
+
+    @staticmethod
+    def splitHeaderString(headerString):
+        """ Split a comma separated header string into a list, excluding empty strings """
+        if headerString is None:
+            return []
+        return [n.strip() for n in headerString.split(",") if len(n) > 0]
+
     def getErrorMetrics(self) :
-        """ Returns an Http response object containing error information for every validation job in specified submission """
-        responseDict = {}
+        """ Returns an Http response object containing error information for every validation job in specified submission
+
+        Flask request should include "submission_id", and may include "limit", the most errors to return per file, and
+        "field_name" to only return errors for that field
+        """
         returnDict = {}
         try:
             safeDictionary = RequestDictionary(self.request)
             submission_id =  safeDictionary.getValue("submission_id")
+            limit = int(safeDictionary.getValue("limit")) if safeDictionary.exists("limit") else None
+            if(limit is not None and limit < 1):
+                raise ResponseException("Limit must be a positive integer", StatusCode.CLIENT_ERROR)
+            fieldName = safeDictionary.getValue("field_name") if safeDictionary.exists("field_name") else None
 
             # Check if user has permission to specified submission
             self.checkSubmissionPermission(self.jobManager.getSubmissionById(submission_id))
 
-            jobIds = self.jobManager.getJobsBySubmission(submission_id)
-            for currentId in jobIds :
-                if(self.jobManager.getJobType(currentId) == "csv_record_validation"):
-                    fileName = self.jobManager.getFileType(currentId)
-                    dataList = self.interfaces.errorDb.getErrorMetricsByJobId(currentId)
-                    returnDict[fileName]  = dataList
-            return JsonResponse.create(StatusCode.OK,returnDict)
+            # Skip building the response if the client already has the current version
+            etag = self.getSubmissionEtag(submission_id, "error_metrics", limit, fieldName)
+            if(etag in self.request.if_none_match):
+                return self.notModified(etag)
+
+            jobFileTypes = self.jobManager.getValidationJobFileTypes(submission_id)
+            metrics = self.interfaces.errorDb.getErrorMetricsForJobList([jobId for jobId, fileType in jobFileTypes], limit, fieldName)
+            for jobId, fileType in jobFileTypes:
+                returnDict[fileType] = metrics[jobId]
+            return self.addEtag(JsonResponse.create(StatusCode.OK,returnDict), etag)
         except ( ValueError , TypeError ) as e:
             return JsonResponse.error(e,StatusCode.CLIENT_ERROR)
         except ResponseException as e:
@@ -293,6 +438,45 @@ class FileHandler:
         except Exception as e:
             # Unexpected exception, this is a 500 server error
             return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
+
+    def getErrorMetricsRollup(self) :
+        """ Returns an Http response object containing error totals by rule, field, and file type across many submissions
+
+        Flask request may include "agency_name", and "start_date" and "end_date" in "MM/DD/YYYY" to only count submissions
+        made in that range.  Admins see every agency unless "agency_name" is given, other users only see their own agency.
+        Totals come from the error metric summary, so they are as of its last refresh.
+        """
+        try:
+            safeDictionary = RequestDictionary(self.request)
+            agencyName = safeDictionary.getValue("agency_name") if safeDictionary.exists("agency_name") else None
+            startDate = self.jobManager.createDate(safeDictionary.getValue("start_date")) if safeDictionary.exists("start_date") else None
+            endDate = self.jobManager.createDate(safeDictionary.getValue("end_date")) if safeDictionary.exists("end_date") else None
+            if(startDate is not None and endDate is not None and startDate > endDate):
+                raise ResponseException("start_date must not be after end_date", StatusCode.CLIENT_ERROR)
+
+            user, isAdmin = self.getCurrentUser()
+            if(not isAdmin):
+                if(agencyName is not None and agencyName != user.agency):
+                    raise ResponseException("User does not have permission to view that agency", StatusCode.CLIENT_ERROR)
+                if(user.agency is None):
+                    raise ResponseException("User does not have an agency", StatusCode.CLIENT_ERROR)
+                agencyName = user.agency
+
+            returnDict = self.interfaces.errorDb.getErrorMetricRollup(agencyName, startDate, endDate, allAgencies = agencyName is None)
+            if(returnDict["refreshed_at"] is not None):
+                returnDict["refreshed_at"] = returnDict["refreshed_at"].strftime("%Y-%m-%dT%H:%M:%S")
+            returnDict["agency_name"] = agencyName
+            returnDict["start_date"] = safeDictionary.getValue("start_date") if startDate is not None else None
+            returnDict["end_date"] = safeDictionary.getValue("end_date") if endDate is not None else None
+            return JsonResponse.create(StatusCode.OK,returnDict)
+        except ( ValueError , TypeError, IndexError ) as e:
+            return JsonResponse.error(e,StatusCode.CLIENT_ERROR)
+        except ResponseException as e:
+            return JsonResponse.error(e,e.status)
+        except Exception as e:
+            # Unexpected exception, this is a 500 server error
+            return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
+
     def uploadFile(self):
         """saves a file and returns the saved path"""
         try:
@@ -319,6 +503,228 @@ class FileHandler:
             # Unexpected exception, this is a 500 server error
             return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
 
+    def uploadFileStream(self):
+        """ Write one chunk of a local upload to disk as it arrives, without spooling the request body
+
+        Query string should include "offset", the byte offset the chunk starts at, and either "filename" to start a new
+        upload or "local_upload_id" to continue one started by the same user.  Optional keys are "chunk_index", returned
+        as given, "final" set to true on the last chunk, and "upload_id", the job_id of the file_upload job, to record the
+        file size on the job when finished.
+
+        Returns:
+        A flask response object with the local upload ID, the path, the bytes received so far as "offset", and the md5 of the bytes received
+        """
+        try:
+            if(not self.isLocal):
+                raise ResponseException("Route Only Valid For Local Installs", StatusCode.CLIENT_ERROR)
+            args = self.request.args
+            offset = int(args.get("offset", 0))
+            # Check every ID in the request belongs to this user before writing anything
+            job = self.getUploadJobForUser(args.get("upload_id")) if args.get("upload_id") is not None else None
+            if(args.get("local_upload_id") is not None):
+                upload = self.getLocalUploadForUser(args.get("local_upload_id"))
+            elif(args.get("filename")):
+                upload = self.jobManager.createLocalUpload(LoginSession.getName(session), LocalUpload.createPath(self.serverPath, args.get("filename")))
+            else:
+                raise ResponseException("Must include filename or local_upload_id", StatusCode.CLIENT_ERROR)
+            if(upload.status != "in_progress"):
+                raise ResponseException("Upload is already complete", StatusCode.CLIENT_ERROR)
+            LocalUpload.checkPath(self.serverPath, upload.path)
+            offset, checksum = LocalUpload.writeChunk(self.request.stream, upload.path, offset)
+            returnDict = {"local_upload_id":upload.local_upload_id, "path":upload.path, "offset":offset, "md5":checksum.hexdigest()}
+            if(args.get("chunk_index") is not None):
+                returnDict["chunk_index"] = int(args.get("chunk_index"))
+            if(str(args.get("final", "false")).lower() == "true"):
+                LocalUpload.finish(upload.path)
+                self.jobManager.setLocalUploadStatus(upload, "complete")
+                if(job is not None):
+                    self.jobManager.setFileSizeForUpload(job, offset)
+            else:
+                LocalUpload.saveChecksum(upload.path, offset, checksum)
+            return JsonResponse.create(StatusCode.OK,returnDict)
+        except ( ValueError , TypeError ) as e:
+            return JsonResponse.error(e,StatusCode.CLIENT_ERROR)
+        except ResponseException as e:
+            return JsonResponse.error(e,e.status)
+        except Exception as e:
+            # Unexpected exception, this is a 500 server error
+            return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
+
+    def getUploadOffset(self):
+        """ Return the number of bytes received for a local upload, so an interrupted upload can resume from there
+
+        Query string should include "local_upload_id" as returned by the upload route
+        """
+        try:
+            if(not self.isLocal):
+                raise ResponseException("Route Only Valid For Local Installs", StatusCode.CLIENT_ERROR)
+            if(not self.request.args.get("local_upload_id")):
+                raise ResponseException("Must include local_upload_id", StatusCode.CLIENT_ERROR)
+            upload = self.getLocalUploadForUser(self.request.args.get("local_upload_id"))
+            return JsonResponse.create(StatusCode.OK,{"local_upload_id":upload.local_upload_id, "path":upload.path, "offset":LocalUpload.getOffset(upload.path)})
+        except ( ValueError , TypeError ) as e:
+            return JsonResponse.error(e,StatusCode.CLIENT_ERROR)
+        except ResponseException as e:
+            return JsonResponse.error(e,e.status)
+        except Exception as e:
+            # Unexpected exception, this is a 500 server error
+            return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
+
+    def getLocalUploadForUser(self,localUploadId):
+        """ Return local upload after checking it was started by the current user """
+        upload = self.jobManager.getLocalUploadById(int(localUploadId))
+        if(upload.user_id != LoginSession.getName(session)):
+            raise ResponseException("Cannot upload to a file started by a different user", StatusCode.CLIENT_ERROR)
+        return upload
+
+    def getUploadJobForUser(self,jobId):
+        """ Return file_upload job after checking it belongs to a submission created by the current user """
+        job = self.jobManager.getJobById(jobId)
+        if(self.jobManager.getSubmissionForJob(job).user_id != LoginSession.getName(session)):
+            raise ResponseException("Cannot upload to a job created by a different user", StatusCode.CLIENT_ERROR)
+        return job
+
+    def getMultipartUploadForUser(self,safeDictionary):
+        """ Return multipart upload named by "multipart_upload_id" in the request after checking it belongs to the current user """
+        upload = self.jobManager.getMultipartUploadById(safeDictionary.getValue("multipart_upload_id"))
+        self.getUploadJobForUser(upload.job_id)
+        return upload
+
+    @staticmethod
+    def getMultipartUploadInfo(upload):
+        """ Return dict describing a multipart upload and which parts S3 has received """
+        receivedParts = [part.part_number for part in upload.parts]
+        missingParts = sorted(set(range(1, upload.part_count + 1)) - set(receivedParts))
+        return {"multipart_upload_id": upload.multipart_upload_id, "upload_id": upload.job_id, "bucket_name": upload.bucket,
+                "key": upload.key, "part_size": upload.part_size, "part_count": upload.part_count, "status": upload.status,
+                "received_parts": receivedParts, "missing_parts": missingParts}
+
+    def initiateMultipartUpload(self):
+        """ Start an S3 multipart upload for the file of a file_upload job
+
+        Flask request should include "upload_id", the job_id from submit_files, and "file_size" in bytes, "part_size" is optional
+
+        Returns:
+        A flask response object with the multipart upload ID, part size, and part count
+        """
+        try:
+            if(self.isLocal):
+                raise ResponseException("Route Only Valid For S3 Installs", StatusCode.CLIENT_ERROR)
+            safeDictionary = RequestDictionary(self.request)
+            job = self.getUploadJobForUser(safeDictionary.getValue("upload_id"))
+            fileSize = int(safeDictionary.getValue("file_size"))
+            partSize = int(safeDictionary.getValue("part_size")) if safeDictionary.exists("part_size") else None
+            partSize, partCount = MultipartUploadManager.getPartSize(fileSize, partSize)
+            bucket = CONFIG_BROKER["aws_bucket"]
+            s3UploadId = MultipartUploadManager.initiate(bucket, job.filename)
+            upload = self.jobManager.createMultipartUpload(job, bucket, job.filename, s3UploadId, fileSize, partSize, partCount)
+            return JsonResponse.create(StatusCode.OK,self.getMultipartUploadInfo(upload))
+        except ( ValueError , TypeError ) as e:
+            return JsonResponse.error(e,StatusCode.CLIENT_ERROR)
+        except ResponseException as e:
+            return JsonResponse.error(e,e.status)
+        except Exception as e:
+            # Unexpected exception, this is a 500 server error
+            return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
+
+    def getMultipartPartUrls(self):
+        """ Presign upload URLs for parts of a multipart upload
+
+        Flask request should include "multipart_upload_id", and optionally "part_numbers", a list of part numbers, if not
+        included URLs are returned for every part S3 has not received
+
+        Returns:
+        A flask response object with key "urls" holding a URL for each part number
+        """
+        try:
+            safeDictionary = RequestDictionary(self.request)
+            upload = self.getMultipartUploadForUser(safeDictionary)
+            if(upload.status != "in_progress"):
+                raise ResponseException("Multipart upload is " + upload.status, StatusCode.CLIENT_ERROR)
+            if(safeDictionary.exists("part_numbers")):
+                partNumbers = [int(partNumber) for partNumber in safeDictionary.getValue("part_numbers")]
+                for partNumber in partNumbers:
+                    if(partNumber < 1 or partNumber > upload.part_count):
+                        raise ResponseException("Part number out of range", StatusCode.CLIENT_ERROR)
+            else:
+                partNumbers = self.getMultipartUploadInfo(upload)["missing_parts"]
+            urls = MultipartUploadManager.getPartUrls(upload.bucket, upload.key, upload.s3_upload_id, partNumbers)
+            return JsonResponse.create(StatusCode.OK,{"multipart_upload_id": upload.multipart_upload_id, "urls": dict((str(partNumber), url) for partNumber, url in urls.items())})
+        except ( ValueError , TypeError ) as e:
+            return JsonResponse.error(e,StatusCode.CLIENT_ERROR)
+        except ResponseException as e:
+            return JsonResponse.error(e,e.status)
+        except Exception as e:
+            # Unexpected exception, this is a 500 server error
+            return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
+
+    def getMultipartUploadParts(self):
+        """ Record the parts S3 has received for a multipart upload and return which parts are still missing, used to resume an upload
+
+        Flask request should include "multipart_upload_id"
+        """
+        try:
+            safeDictionary = RequestDictionary(self.request)
+            upload = self.getMultipartUploadForUser(safeDictionary)
+            if(upload.status == "in_progress"):
+                self.jobManager.setUploadParts(upload, MultipartUploadManager.listParts(upload.bucket, upload.key, upload.s3_upload_id))
+            return JsonResponse.create(StatusCode.OK,self.getMultipartUploadInfo(upload))
+        except ( ValueError , TypeError ) as e:
+            return JsonResponse.error(e,StatusCode.CLIENT_ERROR)
+        except ResponseException as e:
+            return JsonResponse.error(e,e.status)
+        except Exception as e:
+            # Unexpected exception, this is a 500 server error
+            return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
+
+    def completeMultipartUpload(self):
+        """ Combine the parts of a multipart upload into the uploaded file, fails if any part is missing
+
+        Flask request should include "multipart_upload_id".  The finalize_job route should still be called afterwards.
+        """
+        try:
+            safeDictionary = RequestDictionary(self.request)
+            upload = self.getMultipartUploadForUser(safeDictionary)
+            if(upload.status != "in_progress"):
+                raise ResponseException("Multipart upload is " + upload.status, StatusCode.CLIENT_ERROR)
+            self.jobManager.setUploadParts(upload, MultipartUploadManager.listParts(upload.bucket, upload.key, upload.s3_upload_id))
+            uploadInfo = self.getMultipartUploadInfo(upload)
+            if(uploadInfo["missing_parts"]):
+                raise ResponseException("Parts missing from upload: " + ", ".join(str(partNumber) for partNumber in uploadInfo["missing_parts"]), StatusCode.CLIENT_ERROR)
+            MultipartUploadManager.complete(upload.bucket, upload.key, upload.s3_upload_id)
+            self.jobManager.setMultipartUploadStatus(upload, "complete")
+            uploadInfo["status"] = upload.status
+            return JsonResponse.create(StatusCode.OK,uploadInfo)
+        except ( ValueError , TypeError ) as e:
+            return JsonResponse.error(e,StatusCode.CLIENT_ERROR)
+        except ResponseException as e:
+            return JsonResponse.error(e,e.status)
+        except Exception as e:
+            # Unexpected exception, this is a 500 server error
+            return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
+
+    def abortMultipartUpload(self):
+        """ Cancel a multipart upload, S3 discards the parts received so far
+
+        Flask request should include "multipart_upload_id"
+        """
+        try:
+            safeDictionary = RequestDictionary(self.request)
+            upload = self.getMultipartUploadForUser(safeDictionary)
+            if(upload.status != "in_progress"):
+                raise ResponseException("Multipart upload is " + upload.status, StatusCode.CLIENT_ERROR)
+            MultipartUploadManager.abort(upload.bucket, upload.key, upload.s3_upload_id)
+            self.jobManager.setUploadParts(upload, [])
+            self.jobManager.setMultipartUploadStatus(upload, "aborted")
+            return JsonResponse.create(StatusCode.OK,self.getMultipartUploadInfo(upload))
+        except ( ValueError , TypeError ) as e:
+            return JsonResponse.error(e,StatusCode.CLIENT_ERROR)
+        except ResponseException as e:
+            return JsonResponse.error(e,e.status)
+        except Exception as e:
+            # Unexpected exception, this is a 500 server error
+            return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
+
     def getRss(self):
         response = {}
         if self.isLocal:
@@ -1,23 +1,105 @@
+import os
 import sys
 import traceback
+from threading import Lock
+import dataactcore.config
 from dataactcore.utils.cloudLogger import CloudLogger
 from dataactbroker.handlers.errorHandler import ErrorHandler
 from dataactbroker.handlers.jobHandler import JobHandler
 from dataactbroker.handlers.userHandler import UserHandler
 
 class InterfaceHolder:
-    """ This class holds an interface to each database as a static variable, to allow reuse of connections throughout the project """
+    """ This class holds an interface to each database, to allow reuse of connections throughout the project
+
+    Each interface (jobDb, errorDb, userDb) is only created the first time it is used.  Closed interfaces go back to a
+    per-process pool, so engines and connections are set up once per process instead of once per request.
+
+    Class fields:
+    INTERFACES -- Maps attribute names to the handler class and the CONFIG_DB key holding that database's name
+    POOL_SIZE -- Number of idle interfaces of each type to keep per process, interfaces beyond this are disposed of
+    """
+    INTERFACES = {"jobDb": (JobHandler, "job_db_name"), "errorDb": (ErrorHandler, "error_db_name"), "userDb": (UserHandler, "user_db_name")}
+    POOL_SIZE = dataactcore.config.CONFIG_DB.get("interface_pool_size", 5)
+    pool = {}
+    poolPid = os.getpid()
+    poolLock = Lock()
+
     def __init__(self):
-        """ Create the interfaces """
-        self.jobDb = JobHandler()
-        self.errorDb = ErrorHandler()
-        self.userDb = UserHandler()
+        """ Interfaces are created on first access """
+        self.openInterfaces = {}
+
+    def __getattr__(self, name):
+        """ Check out an interface from the pool the first time it is accessed """
+        if name not in InterfaceHolder.INTERFACES:
+            raise AttributeError(name)
+        interface = InterfaceHolder.acquire(name)
+        self.openInterfaces[name] = interface
+        self.__dict__[name] = interface
+        return interface
 
     def close(self):
-        """ Close all open connections """
-        InterfaceHolder.closeOne(self.jobDb)
-        InterfaceHolder.closeOne(self.errorDb)
-        InterfaceHolder.closeOne(self.userDb)
+        """ Close all open connections and return the interfaces to the pool """
+        for name in list(self.openInterfaces.keys()):
+            interface = self.openInterfaces.pop(name)
+            del self.__dict__[name]
+            InterfaceHolder.release(name, interface)
+
+    @staticmethod
+    def getPoolKey(name):
+        """ Pool interfaces by database name, so a change to the configured database does not hand out stale interfaces """
+        configKey = InterfaceHolder.INTERFACES[name][1]
+        return (name, dataactcore.config.CONFIG_DB[configKey])
+
+    @staticmethod
+    def acquire(name):
+        """ Get an idle interface of the specified type from the pool, or create one if the pool is empty """
+        key = InterfaceHolder.getPoolKey(name)
+        with InterfaceHolder.poolLock:
+            if InterfaceHolder.poolPid != os.getpid():
+                # Connections inherited from a parent process must not be reused
+                InterfaceHolder.pool = {}
+                InterfaceHolder.poolPid = os.getpid()
+            idle = InterfaceHolder.pool.get(key)
+            if idle:
+                return idle.pop()
+        return InterfaceHolder.INTERFACES[name][0]()
+
+    @staticmethod
+    def release(name, interface):
+        """ Close the interface's session and return it to the pool, disposing of it if the pool is full or closing failed """
+        try:
+            InterfaceHolder.closeOne(interface)
+        except Exception:
+            InterfaceHolder.disposeOne(interface)
+            raise
+        key = InterfaceHolder.getPoolKey(name)
+        with InterfaceHolder.poolLock:
+            idle = InterfaceHolder.pool.setdefault(key, [])
+            if len(idle) < InterfaceHolder.POOL_SIZE:
+                idle.append(interface)
+                return
+        InterfaceHolder.disposeOne(interface)
+
+    @staticmethod
+    def clearPool():
+        """ Dispose of all idle interfaces in this process """
+        with InterfaceHolder.poolLock:
+            idle = [interface for interfaces in InterfaceHolder.pool.values() for interface in interfaces]
+            InterfaceHolder.pool = {}
+        for interface in idle:
+            InterfaceHolder.disposeOne(interface)
+
+    @staticmethod
+    def disposeOne(interface):
+        """ Close the connection and engine of one interface """
+        try:
+            interface.connection.close()
+        except Exception:
+            pass
+        try:
+            interface.engine.dispose()
+        except Exception:
+            pass
 
     @staticmethod
     def closeOne(interface):
@@ -1,9 +1,13 @@
 from datetime import datetime, date
+from sqlalchemy import func, case, tuple_, literal_column
+from sqlalchemy.orm import joinedload
 from dataactcore.models.jobModels import JobStatus,JobDependency,Submission, FileType
 from dataactcore.models.jobTrackerInterface import JobTrackerInterface
 from dataactcore.utils.responseException import ResponseException
 from dataactcore.utils.statusCode import StatusCode
-from dataactbroker.handlers.errorHandler import ErrorHandler
+from dataactbroker.handlers.lookupCache import LookupCache
+from dataactbroker.handlers.submissionEvents import SubmissionEvents
+from dataactbroker.models.jobTrackerModels import MultipartUpload, UploadPart, SubmissionVersion, LocalUploadFile
 
 class JobHandler(JobTrackerInterface):
     """ Responsible for all interaction with the job tracker database
@@ -23,6 +27,9 @@ class JobHandler(JobTrackerInterface):
     externalValidationType -- type_id for "external_validation"
     """
 
+    SUBMISSION_EPOCH = datetime(1970,1,1) # Sort time of submissions without a creation time, matches getSubmissionSortTime
+    JOB_BATCH_SIZE = 1000 # How many job rows to fetch from the database at a time when reading every job
+
     # Available instance variables:  session, waitingStatus, runningStatus, fileUploadType, dbUploadType, validationType, externalValidationTYpe
 
     metaDataFieldMap = {"agency_name":"agency_name","reporting_period_start_date":"reporting_start_date","reporting_period_end_date":"reporting_end_date"}
@@ -33,10 +40,138 @@ class JobHandler(JobTrackerInterface):
         result = self.runUniqueQuery(query,"No submission with that ID","Multiple submissions with that ID")
         return result
 
+    def getTypeId(self,typeName):
+        """ Return the type_id for a job type name, using the lookup cache """
+        typeId = LookupCache.getId("job_type", typeName, self.session)
+        if typeId is not None:
+            return typeId
+        # Not in the lookup cache, query so an invalid name raises the usual error
+        return JobTrackerInterface.getTypeId(self, typeName)
+
+    def getStatusId(self,statusName):
+        """ Return the status_id for a job status name, using the lookup cache """
+        statusId = LookupCache.getId("job_status", statusName, self.session)
+        if statusId is not None:
+            return statusId
+        # Not in the lookup cache, query so an invalid name raises the usual error
+        return JobTrackerInterface.getStatusId(self, statusName)
+
+    def getFileTypeId(self,fileType):
+        """ Return the file_type_id for a file type name, using the lookup cache """
+        fileTypeId = LookupCache.getId("file_type", fileType, self.session)
+        if fileTypeId is not None:
+            return fileTypeId
+        # Not in the lookup cache, query so an invalid name raises the usual error
+        fileTypeQuery = self.session.query(FileType.file_type_id).filter(FileType.name == fileType)
+        fileTypeResult = self.runUniqueQuery(fileTypeQuery,"No matching file type", "Multiple matching file types")
+        return fileTypeResult.file_type_id
+
+    def getJobsForSubmission(self,submissionId):
+        """ Return all job objects in a submission, with status, type, and file type loaded in the same query """
+        query = self.session.query(JobStatus).options(joinedload("status"),joinedload("type"),joinedload("file_type"))
+        return query.filter(JobStatus.submission_id == submissionId).order_by(JobStatus.job_id).all()
+
+    def getSubmissionVersion(self,submissionId):
+        """ Return tuple of (change version, list of job IDs) for a submission, the version is bumped by triggers whenever the submission or one of its jobs changes """
+        query = self.session.query(JobStatus.job_id,SubmissionVersion.version).outerjoin(SubmissionVersion,SubmissionVersion.submission_id == JobStatus.submission_id)
+        rows = query.filter(JobStatus.submission_id == submissionId).order_by(JobStatus.job_id).all()
+        if not rows:
+            version = self.session.query(SubmissionVersion.version).filter(SubmissionVersion.submission_id == submissionId).scalar()
+            return (version or 0, [])
+        return (rows[0].version or 0, [row.job_id for row in rows])
+
+    def getValidationJobFileTypes(self,submissionId):
+        """ Return list of (job ID, file type name) for every record level validation job in a submission, using one query """
+        query = self.session.query(JobStatus.job_id,FileType.name).join(FileType,JobStatus.file_type_id == FileType.file_type_id)
+        query = query.filter(JobStatus.submission_id == submissionId).filter(JobStatus.type_id == self.getTypeId("csv_record_validation"))
+        return query.order_by(JobStatus.job_id).all()
+
+    def getValidationJobInfo(self):
+        """ Return dict of (submission date, agency name, file type name) keyed by job ID for every record level validation job, using one query """
+        query = self.session.query(JobStatus.job_id,Submission.datetime_utc,Submission.agency_name,FileType.name)
+        query = query.join(Submission,JobStatus.submission_id == Submission.submission_id).join(FileType,JobStatus.file_type_id == FileType.file_type_id)
+        query = query.filter(JobStatus.type_id == self.getTypeId("csv_record_validation")).filter(Submission.datetime_utc != None)
+        return dict((row.job_id,(row.datetime_utc.date(),row.agency_name,row.name)) for row in query.yield_per(self.JOB_BATCH_SIZE))
+
+    def getReportPathsForSubmission(self,submissionId):
+        """ Return list of (job ID, error report file name) for every record level validation job in a submission, using one query """
+        return [(jobId,self.getReportPathForFileType(submissionId,fileType)) for jobId, fileType in self.getValidationJobFileTypes(submissionId)]
+
+    @staticmethod
+    def getReportPathForFileType(submissionId,fileType):
+        """ Return the error report file name for a file type, same format as getReportPath, without the folder """
+        return "submission_" + str(submissionId) + "_" + fileType + "_error_report.csv"
+
     def getSubmissionsByUserId(self,userId):
         """ Returns all submissions associated with the specified user ID """
         return self.session.query(Submission).filter(Submission.user_id == userId).all()
 
+    @staticmethod
+    def getSubmissionSortTime(table=Submission.__table__):
+        """ Return the expression submissions are paged by, creation time with submissions that have none sorted as if made at SUBMISSION_EPOCH """
+        return func.coalesce(table.c.datetime_utc, literal_column("TIMESTAMP '1970-01-01 00:00:00'"))
+
+    def getSubmissionPageForUser(self,userId,limit,after=None):
+        """ Return one page of a user's submissions, newest first, selecting only the ID and creation time
+
+        Submissions without a creation time come last, ordered by ID.
+
+        Arguments:
+        userId -- User to list submissions for
+        limit -- Most submissions to return, None for all of them
+        after -- Tuple of (sort time, submission_id) of the last submission on the previous page, None for the first page,
+            the sort time is SUBMISSION_EPOCH for a submission without a creation time
+
+        Returns:
+        Tuple of (list of (submission_id, datetime_utc or None), True if there are more submissions after this page)
+        """
+        sortTime = JobHandler.getSubmissionSortTime()
+        query = self.session.query(Submission.submission_id,Submission.datetime_utc).filter(Submission.user_id == userId)
+        if after is not None:
+            # Row comparison lets the (user_id, sort time, submission_id) index find the start of the page
+            query = query.filter(tuple_(sortTime,Submission.submission_id) < tuple_(after[0],after[1]))
+        query = query.order_by(sortTime.desc(),Submission.submission_id.desc())
+        if limit is None:
+            return [(row.submission_id,row.datetime_utc) for row in query.all()], False
+        rows = query.limit(limit + 1).all()
+        return [(row.submission_id,row.datetime_utc) for row in rows[:limit]], len(rows) > limit
+
+    def getSubmissionSummaries(self,submissionIds):
+        """ Return dict of summaries keyed by submission ID, with job status counts, row counts, and job IDs from one grouped query
+
+        Each summary has keys agency_name, status, number_of_rows, and job_ids
+        """
+        if not submissionIds:
+            return {}
+        finished = self.getStatusId("finished")
+        running = self.getStatusId("running")
+        failedStatuses = [self.getStatusId("failed"),self.getStatusId("invalid")]
+        recordValidation = self.getTypeId("csv_record_validation")
+        query = self.session.query(Submission.submission_id,Submission.agency_name,
+            func.count(JobStatus.job_id).label("jobs"),
+            func.sum(case([(JobStatus.status_id == finished,1)],else_=0)).label("finished"),
+            func.sum(case([(JobStatus.status_id == running,1)],else_=0)).label("running"),
+            func.sum(case([(JobStatus.status_id.in_(failedStatuses),1)],else_=0)).label("failed"),
+            func.sum(case([(JobStatus.type_id == recordValidation,JobStatus.number_of_rows)],else_=0)).label("number_of_rows"),
+            func.array_agg(JobStatus.job_id).label("job_ids"))
+        query = query.outerjoin(JobStatus,JobStatus.submission_id == Submission.submission_id).filter(Submission.submission_id.in_(submissionIds))
+        summaries = {}
+        for row in query.group_by(Submission.submission_id,Submission.agency_name).all():
+            summaries[row.submission_id] = {"agency_name": row.agency_name, "status": self.getStatusRollup(row.jobs,row.finished,row.running,row.failed),
+                "number_of_rows": int(row.number_of_rows or 0), "job_ids": [jobId for jobId in (row.job_ids or []) if jobId is not None]}
+        return summaries
+
+    @staticmethod
+    def getStatusRollup(jobs,finished,running,failed):
+        """ Return one status for a submission from counts of its job statuses """
+        if failed:
+            return "failed"
+        if jobs and finished == jobs:
+            return "finished"
+        if running or finished:
+            return "running"
+        return "waiting"
+
     def getSubmissionsByUser(self,user):
         """ Returns all submissions associated with the provided user object """
         return self.getSubmissionsByUserId(user.user_id)
@@ -107,118 +242,128 @@ class JobHandler(JobTrackerInterface):
         # Calling submission_id to force query to load this
         return submission.submission_id
 
-    def createJobs(self, filenames, submissionId, existingSubmission = False):
+    def createJobs(self, filenames, submissionId, existingSubmission = False, errorDb = None):
         """  Given the filenames to be uploaded, create the set of jobs needing to be completed for this submission
 
         Arguments:
         filenames -- List of tuples containing (file type, upload path, original filenames)
         submissionId -- Submission ID to be linked to jobs
         existingSubmission -- True if we should update jobs in an existing submission rather than creating new jobs
+        errorDb -- ErrorHandler used to reset errors for updated jobs, only needed for existing submissions
 
         Returns:
         Dictionary of upload ids by filename to return to client, used for calling finalize_submission route
         """
-
-
-        jobsRequired, uploadDict = self.addUploadJobs(filenames,submissionId,existingSubmission)
-
         if(existingSubmission):
-            # Find cross-file and external validation jobs and mark them as waiting
-            valQuery = self.session.query(JobStatus).filter(JobStatus.submission_id == submissionId).filter(JobStatus.type_id == self.getTypeId("validation"))
-            valJob = self.runUniqueQuery(valQuery,"No cross-file validation job found","Conflicting jobs found")
-            valJob.status_id = self.getStatusId("waiting")
-            extQuery = self.session.query(JobStatus).filter(JobStatus.submission_id == submissionId).filter(JobStatus.type_id == self.getTypeId("external_validation"))
-            extJob = self.runUniqueQuery(valQuery,"No external validation job found","Conflicting jobs found")
-            extJob.status_id = self.getStatusId("waiting")
-            self.session.commit()
+            uploadDict = self.updateJobsForFiles(filenames, submissionId, errorDb)
         else:
-            # Create validation job
-            validationJob = JobStatus(status_id = self.getStatusId("waiting"), type_id = self.getTypeId("validation"), submission_id = submissionId)
-            self.session.add(validationJob)
-            # Create external validation job
-            externalJob = JobStatus(status_id = self.getStatusId("waiting"), type_id = self.getTypeId("external_validation"), submission_id = submissionId)
-            self.session.add(externalJob)
-            self.session.flush()
-            # Create dependencies for validation jobs
-            for job_id in jobsRequired:
-                valDependency = JobDependency(job_id = validationJob.job_id, prerequisite_id = job_id)
-                self.session.add(valDependency)
-                extDependency = JobDependency(job_id = externalJob.job_id, prerequisite_id = job_id)
-                self.session.add(extDependency)
-
-        # Commit all changes
-        self.session.commit()
+            uploadDict = self.insertJobGraph(filenames, submissionId)
         uploadDict["submission_id"] = submissionId
         return uploadDict
 
-    def addUploadJobs(self,filenames,submissionId,existingSubmission):
-        """  Add upload jobs to job tracker database
+    def insertJobGraph(self, filenames, submissionId):
+        """  Build every job and dependency for a new submission in memory, then insert them in one transaction with
+        one statement for the jobs and one for the dependencies
 
         Arguments:
         filenames -- List of tuples containing (file type, upload path, original filenames)
         submissionId -- Submission ID to attach to jobs
-        existingSubmission -- True if we should update existing jobs rather than creating new ones
 
         Returns:
-        jobsRequired -- List of job ids required for validation jobs, used to populate the prerequisite table
-        uploadDict -- Dictionary of upload ids by filename to return to client, used for calling finalize_submission route
+        Dictionary of upload ids by filename to return to client, used for calling finalize_submission route
         """
+        waitingStatus = self.getStatusId("waiting")
+        uploadType = self.getTypeId("file_upload")
+        recordValidationType = self.getTypeId("csv_record_validation")
+        validationType = self.getTypeId("validation")
+        externalValidationType = self.getTypeId("external_validation")
+
+        jobRows = []
+        fileTypeIds = {}
+        for fileType, filePath, filename in filenames:
+            fileTypeId = self.getFileTypeId(fileType)
+            fileTypeIds[fileType] = fileTypeId
+            # Upload job is marked as running since frontend should be doing this upload
+            jobRows.append({"original_filename": filename, "filename": filePath, "file_type_id": fileTypeId, "status_id": self.getStatusId("running"), "type_id": uploadType, "submission_id": submissionId})
+            jobRows.append({"original_filename": filename, "filename": filePath, "file_type_id": fileTypeId, "status_id": waitingStatus, "type_id": recordValidationType, "submission_id": submissionId})
+        for typeId in [validationType, externalValidationType]:
+            jobRows.append({"original_filename": None, "filename": None, "file_type_id": None, "status_id": waitingStatus, "type_id": typeId, "submission_id": submissionId})
+
+        # Insert all jobs at once, each job is identified by its type and file type
+        jobTable = JobStatus.__table__
+        insertJobs = jobTable.insert().values(jobRows).returning(jobTable.c.job_id, jobTable.c.type_id, jobTable.c.file_type_id)
+        jobIds = {}
+        for jobId, typeId, fileTypeId in self.session.execute(insertJobs).fetchall():
+            jobIds[(typeId, fileTypeId)] = jobId
 
-        # Keep list of job ids required for validation jobs
-        jobsRequired = []
-        # Dictionary of upload ids by filename to return to client
         uploadDict = {}
+        dependencyRows = []
+        for fileType, fileTypeId in fileTypeIds.items():
+            uploadJobId = jobIds[(uploadType, fileTypeId)]
+            recordValidationJobId = jobIds[(recordValidationType, fileTypeId)]
+            # Record level validation depends on the upload, later validation jobs are dependent only on record level validation
+            dependencyRows.append({"job_id": recordValidationJobId, "prerequisite_id": uploadJobId})
+            dependencyRows.append({"job_id": jobIds[(validationType, None)], "prerequisite_id": recordValidationJobId})
+            dependencyRows.append({"job_id": jobIds[(externalValidationType, None)], "prerequisite_id": recordValidationJobId})
+            uploadDict[fileType] = uploadJobId
+        self.session.execute(JobDependency.__table__.insert().values(dependencyRows))
+
+        self.session.commit()
+        return uploadDict
+
+    def updateJobsForFiles(self, filenames, submissionId, errorDb):
+        """  Point the upload and validation jobs of an existing submission at new files, and reset the validation jobs
 
+        Arguments:
+        filenames -- List of tuples containing (file type, upload path, original filenames)
+        submissionId -- Submission ID of the existing jobs
+        errorDb -- ErrorHandler used to reset errors and file statuses for the updated jobs
 
+        Returns:
+        Dictionary of upload ids by filename to return to client, used for calling finalize_submission route
+        """
+        uploadType = self.getTypeId("file_upload")
+        recordValidationType = self.getTypeId("csv_record_validation")
+        fileTypeIds = dict((fileType, self.getFileTypeId(fileType)) for fileType, filePath, filename in filenames)
+
+        # Load the upload and record level validation jobs for every file being replaced in one query
+        jobQuery = self.session.query(JobStatus).filter(JobStatus.submission_id == submissionId).filter(JobStatus.type_id.in_([uploadType, recordValidationType])).filter(JobStatus.file_type_id.in_(list(fileTypeIds.values())))
+        jobDict = {}
+        for job in jobQuery.all():
+            if (job.type_id, job.file_type_id) in jobDict:
+                raise ResponseException("Conflicting jobs found",StatusCode.CLIENT_ERROR)
+            jobDict[(job.type_id, job.file_type_id)] = job
 
+        uploadDict = {}
+        validationJobIds = []
         for fileType, filePath, filename in filenames:
-            fileTypeQuery = self.session.query(FileType.file_type_id).filter(FileType.name == fileType)
-            fileTypeResult = self.runUniqueQuery(fileTypeQuery,"No matching file type", "Multiple matching file types")
-            fileTypeId = fileTypeResult.file_type_id
-
-            if existingSubmission:
-                # Find existing upload job and mark as running
-                uploadQuery = self.session.query(JobStatus).filter(JobStatus.submission_id == submissionId).filter(JobStatus.file_type_id == fileTypeId).filter(JobStatus.type_id == self.getTypeId("file_upload"))
-                uploadJob = self.runUniqueQuery(uploadQuery,"No upload job found for this file","Conflicting jobs found")
-                # Mark as running and set new file name and path
-                uploadJob.status_id = self.getStatusId("running")
-                uploadJob.original_filename = filename
-                uploadJob.filename = filePath
-                self.session.commit()
-            else:
-                # Create upload job, mark as running since frontend should be doing this upload
-                uploadJob = JobStatus(original_filename = filename, filename = filePath, file_type_id = fileTypeId, status_id = self.getStatusId("running"), type_id = self.getTypeId("file_upload"), submission_id = submissionId)
-                self.session.add(uploadJob)
-
-            if existingSubmission:
-                valQuery = self.session.query(JobStatus).filter(JobStatus.submission_id == submissionId).filter(JobStatus.file_type_id == fileTypeId).filter(JobStatus.type_id == self.getTypeId("csv_record_validation"))
-                valJob = self.runUniqueQuery(valQuery,"No validation job found for this file","Conflicting jobs found")
-                valJob.status_id = self.getStatusId("waiting")
-                valJob.original_filename = filename
-                valJob.filename = filePath
-                # Reset file size and number of rows to be set during validation of new file
-                valJob.file_size = None
-                valJob.number_of_rows = None
-                # Reset number of errors
-                errorDb = ErrorHandler()
-                errorDb.resetErrorsByJobId(valJob.job_id)
-                errorDb.resetFileStatusByJobId(valJob.job_id)
-                self.session.commit()
-            else:
-                # Create parse into DB job
-                valJob = JobStatus(original_filename = filename, filename = filePath, file_type_id = fileTypeId, status_id = self.getStatusId("waiting"), type_id = self.getTypeId("csv_record_validation"), submission_id = submissionId)
-                self.session.add(valJob)
-                self.session.flush()
-            if not existingSubmission:
-                # Add dependency between file upload and db upload
-                uploadDependency = JobDependency(job_id = valJob.job_id, prerequisite_id = uploadJob.job_id)
-                self.session.add(uploadDependency)
-                # Later validation jobs are dependent only on record level validation, not upload jobs
-                jobsRequired.append(valJob.job_id)
+            uploadJob = jobDict.get((uploadType, fileTypeIds[fileType]))
+            if uploadJob is None:
+                raise ResponseException("No upload job found for this file",StatusCode.CLIENT_ERROR)
+            valJob = jobDict.get((recordValidationType, fileTypeIds[fileType]))
+            if valJob is None:
+                raise ResponseException("No validation job found for this file",StatusCode.CLIENT_ERROR)
+            # Mark upload as running and set new file name and path
+            uploadJob.status_id = self.getStatusId("running")
+            uploadJob.original_filename = filename
+            uploadJob.filename = filePath
+            valJob.status_id = self.getStatusId("waiting")
+            valJob.original_filename = filename
+            valJob.filename = filePath
+            # Reset file size and number of rows to be set during validation of new file
+            valJob.file_size = None
+            valJob.number_of_rows = None
+            validationJobIds.append(valJob.job_id)
             uploadDict[fileType] = uploadJob.job_id
 
-        # Return list of upload jobs
-        return jobsRequired, uploadDict
+        # Mark cross-file and external validation jobs as waiting
+        self.session.query(JobStatus).filter(JobStatus.submission_id == submissionId).filter(JobStatus.type_id.in_([self.getTypeId("validation"), self.getTypeId("external_validation")])).update({"status_id": self.getStatusId("waiting")}, synchronize_session=False)
+
+        # Reset errors and file statuses for all updated validation jobs, one statement each
+        errorDb.resetErrorsForJobList(validationJobIds)
+        errorDb.resetFileStatusForJobList(validationJobIds)
+        self.session.commit()
+        return uploadDict
 
     def checkUploadType(self, jobId):
         """ Check that specified job is a file_upload job
@@ -244,7 +389,64 @@ class JobHandler(JobTrackerInterface):
         jobId -- job_id to mark as finished
 
         """
-        JobTrackerInterface.markStatus(self, jobId, 'finished')
+        self.markStatus(jobId, 'finished')
+
+    def setFileSizeForUpload(self,uploadJob,fileSize):
+        """ Record file size on an upload job and its record level validation job, so the validator does not need to read it from the file """
+        if(uploadJob.type_id != self.getTypeId("file_upload")):
+            raise ResponseException("Wrong job type for upload",StatusCode.CLIENT_ERROR)
+        query = self.session.query(JobStatus).filter(JobStatus.submission_id == uploadJob.submission_id).filter(JobStatus.file_type_id == uploadJob.file_type_id)
+        query.filter(JobStatus.type_id.in_([uploadJob.type_id,self.getTypeId("csv_record_validation")])).update({"file_size": fileSize}, synchronize_session=False)
+        self.session.commit()
+
+    def createMultipartUpload(self,job,bucket,key,s3UploadId,fileSize,partSize,partCount):
+        """ Record a new S3 multipart upload for a file_upload job and return it """
+        if(job.type_id != self.getTypeId("file_upload")):
+            raise ResponseException("Wrong job type for upload",StatusCode.CLIENT_ERROR)
+        upload = MultipartUpload(job_id=job.job_id, bucket=bucket, key=key, s3_upload_id=s3UploadId, file_size=fileSize, part_size=partSize, part_count=partCount, status="in_progress")
+        self.session.add(upload)
+        self.session.commit()
+        return upload
+
+    def getMultipartUploadById(self,multipartUploadId):
+        """ Return multipart upload object that matches ID, with its parts loaded in the same query """
+        query = self.session.query(MultipartUpload).options(joinedload("parts")).filter(MultipartUpload.multipart_upload_id == multipartUploadId)
+        return self.runUniqueQuery(query,"No multipart upload with that ID","Multiple multipart uploads with that ID")
+
+    def setUploadParts(self,upload,parts):
+        """ Replace the recorded parts of a multipart upload with the parts S3 reports, parts is a list of (part number, etag, size) """
+        self.session.query(UploadPart).filter(UploadPart.multipart_upload_id == upload.multipart_upload_id).delete(synchronize_session=False)
+        if parts:
+            self.session.execute(UploadPart.__table__.insert().values([{"multipart_upload_id": upload.multipart_upload_id, "part_number": partNumber, "etag": etag, "size": size} for partNumber, etag, size in parts]))
+        self.session.commit()
+        self.session.expire(upload, ["parts"])
+
+    def setMultipartUploadStatus(self,upload,status):
+        """ Set status of multipart upload to in_progress, complete, or aborted """
+        upload.status = status
+        self.session.commit()
+
+    def createLocalUpload(self,userId,path):
+        """ Record a new chunked upload to path for a local install, owned by userId, and return it """
+        upload = LocalUploadFile(user_id=userId, path=path, status="in_progress")
+        self.session.add(upload)
+        self.session.commit()
+        return upload
+
+    def getLocalUploadById(self,localUploadId):
+        """ Return local upload object that matches ID """
+        query = self.session.query(LocalUploadFile).filter(LocalUploadFile.local_upload_id == localUploadId)
+        return self.runUniqueQuery(query,"No local upload with that ID","Multiple local uploads with that ID")
+
+    def setLocalUploadStatus(self,upload,status):
+        """ Set status of local upload to in_progress or complete """
+        upload.status = status
+        self.session.commit()
+
+    def markStatus(self,jobId,statusName):
+        """ Mark job as having specified status, and wake clients in this process waiting on the job's submission """
+        JobTrackerInterface.markStatus(self, jobId, statusName)
+        SubmissionEvents.notify(self.getJobById(jobId).submission_id)
 
     def getUserForSubmission(self,submission):
         """ Takes a submission object and returns the user ID """
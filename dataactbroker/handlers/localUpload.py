@@ -0,0 +1,113 @@
+import fcntl
+import hashlib
+import os
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from uuid import uuid4
+from werkzeug import secure_filename
+from dataactcore.utils.responseException import ResponseException
+from dataactcore.utils.statusCode import StatusCode
+
+class LocalUpload(object):
+    """ Writes chunked uploads for local installs straight to disk with a fixed size buffer
+
+    A file is uploaded as a series of chunks, each sent with the offset it starts at.  A chunk is only accepted if its offset
+    matches the bytes already on disk, checked while holding a lock on the file, so a client that loses its connection asks for the current offset and resumes from there.
+    Running checksums are kept in this process so each chunk is only read once, if a chunk arrives at a process that does not
+    have the checksum (or after a restart) the bytes already on disk are hashed again before appending.
+
+    Class fields:
+    BUFFER_SIZE -- Bytes read from the request and written to disk at a time
+    MAX_CHECKSUMS -- Number of in progress uploads to keep running checksums for
+    """
+    BUFFER_SIZE = 64 * 1024
+    MAX_CHECKSUMS = 100
+    checksums = OrderedDict()
+    lock = Lock()
+
+    @staticmethod
+    def createPath(serverPath, filename):
+        """ Return a new timestamped path in the server directory for an uploaded file name, unique even within the same second """
+        seconds = int((datetime.utcnow()-datetime(1970,1,1)).total_seconds())
+        return os.path.join(serverPath, "".join([str(seconds),"_",uuid4().hex[:8],"_", secure_filename(filename)]))
+
+    @staticmethod
+    def checkPath(serverPath, path):
+        """ Raise a ResponseException if path is not a file directly inside the server directory """
+        serverDirectory = os.path.realpath(serverPath)
+        if os.path.dirname(os.path.realpath(path)) != serverDirectory:
+            raise ResponseException("Upload path must be in the server file directory", StatusCode.CLIENT_ERROR)
+
+    @staticmethod
+    def getOffset(path):
+        """ Return the number of bytes received so far for path """
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path)
+
+    @classmethod
+    def getChecksum(cls, path, offset):
+        """ Return an md5 object covering the first offset bytes of path, reusing the running checksum when it is current """
+        with cls.lock:
+            entry = cls.checksums.pop(path, None)
+        if entry is not None and entry[0] == offset:
+            return entry[1]
+        checksum = hashlib.md5()
+        if offset:
+            with open(path, "rb") as existingFile:
+                remaining = offset
+                while remaining:
+                    data = existingFile.read(min(cls.BUFFER_SIZE, remaining))
+                    if not data:
+                        break
+                    checksum.update(data)
+                    remaining -= len(data)
+        return checksum
+
+    @classmethod
+    def saveChecksum(cls, path, offset, checksum):
+        """ Keep the running checksum for the next chunk of path """
+        with cls.lock:
+            cls.checksums[path] = (offset, checksum)
+            while len(cls.checksums) > cls.MAX_CHECKSUMS:
+                cls.checksums.popitem(last=False)
+
+    @classmethod
+    def writeChunk(cls, stream, path, offset):
+        """ Append a chunk read from stream to path
+
+        Arguments:
+        stream -- File-like object holding the chunk, read BUFFER_SIZE bytes at a time
+        path -- File being uploaded
+        offset -- Byte offset the chunk starts at, must equal the bytes already received
+
+        Returns:
+        Tuple of (bytes received including this chunk, md5 object covering all bytes received)
+        """
+        with open(path, "ab") as targetFile:
+            # Hold the file lock from the offset check to the end of the write, so two chunks sent for the same offset,
+            # by threads or processes, can not both be appended
+            fcntl.flock(targetFile.fileno(), fcntl.LOCK_EX)
+            try:
+                currentOffset = os.fstat(targetFile.fileno()).st_size
+                if offset != currentOffset:
+                    raise ResponseException("Chunk offset {} does not match {} bytes received".format(offset, currentOffset), StatusCode.CLIENT_ERROR)
+                checksum = cls.getChecksum(path, offset)
+                while True:
+                    data = stream.read(cls.BUFFER_SIZE)
+                    if not data:
+                        break
+                    targetFile.write(data)
+                    checksum.update(data)
+                    offset += len(data)
+                targetFile.flush()
+            finally:
+                fcntl.flock(targetFile.fileno(), fcntl.LOCK_UN)
+        return offset, checksum
+
+    @classmethod
+    def finish(cls, path):
+        """ Drop the running checksum for a completed upload """
+        with cls.lock:
+            cls.checksums.pop(path, None)
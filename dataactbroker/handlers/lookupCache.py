@@ -0,0 +1,86 @@
+import time
+from threading import Lock
+from dataactcore.models.userModel import PermissionType, UserStatus
+from dataactcore.models.jobModels import Status, Type, FileType
+
+class LookupCache:
+    """ Process-wide cache of the small, static lookup tables (permission types, user statuses, job statuses, job types,
+    and file types), so name to ID lookups do not need a database round trip.
+
+    Tables are loaded when the app is created, or on first use through the session of whichever interface asks.  A table
+    is reloaded when it is older than MAX_AGE or when reload() has moved the cache to a new epoch.
+
+    Class fields:
+    TABLES -- Maps each cached table to the interface it is read through, its model, and its ID column
+    MAX_AGE -- Seconds a loaded table is trusted, bounds how long changes made elsewhere go unseen
+    epoch -- Incremented by reload(), tables loaded in an earlier epoch are reloaded on next use
+    """
+    TABLES = {
+        "permission_type": ("userDb", PermissionType, "permission_type_id"),
+        "user_status": ("userDb", UserStatus, "user_status_id"),
+        "job_status": ("jobDb", Status, "status_id"),
+        "job_type": ("jobDb", Type, "type_id"),
+        "file_type": ("jobDb", FileType, "file_type_id")
+    }
+    MAX_AGE = 3600
+    epoch = 0
+    tables = {}
+    lock = Lock()
+
+    @staticmethod
+    def loadTable(tableName, session):
+        """ Read one lookup table and store its name to ID and ID to name maps
+
+        Arguments:
+            tableName - Key in TABLES
+            session - sqlalchemy session for the database holding the table
+        Returns:
+            Tuple of (nameToId, idToName) dictionaries
+        """
+        model, idColumn = LookupCache.TABLES[tableName][1:]
+        nameToId = {}
+        idToName = {}
+        for row in session.query(getattr(model, idColumn), model.name).all():
+            nameToId[row[1]] = row[0]
+            idToName[row[0]] = row[1]
+        with LookupCache.lock:
+            LookupCache.tables[tableName] = (nameToId, idToName, time.time(), LookupCache.epoch)
+        return nameToId, idToName
+
+    @staticmethod
+    def load(interfaces):
+        """ Load every lookup table through the provided InterfaceHolder """
+        for tableName, tableInfo in LookupCache.TABLES.items():
+            LookupCache.loadTable(tableName, getattr(interfaces, tableInfo[0]).session)
+
+    @staticmethod
+    def reload(interfaces=None):
+        """ Move to a new epoch so every table is reloaded, loading them now if interfaces are provided
+
+        Returns:
+            The new epoch
+        """
+        with LookupCache.lock:
+            LookupCache.epoch += 1
+            LookupCache.tables = {}
+        if interfaces is not None:
+            LookupCache.load(interfaces)
+        return LookupCache.epoch
+
+    @staticmethod
+    def getMaps(tableName, session):
+        """ Get the (nameToId, idToName) maps for a table, loading it through session if missing or out of date """
+        entry = LookupCache.tables.get(tableName)
+        if entry is None or entry[3] != LookupCache.epoch or time.time() - entry[2] > LookupCache.MAX_AGE:
+            return LookupCache.loadTable(tableName, session)
+        return entry[0], entry[1]
+
+    @staticmethod
+    def getId(tableName, name, session):
+        """ Get the ID for a name in a lookup table, or None if there is no such name """
+        return LookupCache.getMaps(tableName, session)[0].get(name)
+
+    @staticmethod
+    def getName(tableName, lookupId, session):
+        """ Get the name for an ID in a lookup table, or None if there is no such ID """
+        return LookupCache.getMaps(tableName, session)[1].get(lookupId)
@@ -1,29 +1,36 @@
-import requests
-import json
 import os
-from urlparse import urljoin
-import inspect
-from dataactcore.config import CONFIG_SERVICES
+from threading import Lock
+from dataactbroker.handlers.validatorDispatcher import ValidatorDispatcher
 
 class ManagerProxy(object):
     """ Temporary bypass of job manager, used to call validator directly """
     MANAGER_FILE  = "manager.json"
     JSON_HEADER = {"Content-Type": "application/json"}
+    # One dispatcher per process, shared by all requests
+    dispatcher = None
+    dispatcherLock = Lock()
+
+    @classmethod
+    def getDispatcher(cls):
+        """ Get dispatcher for this process, creating a new one after a fork since worker threads are not inherited """
+        with cls.dispatcherLock:
+            if cls.dispatcher is None or cls.dispatcher.pid != os.getpid():
+                cls.dispatcher = ValidatorDispatcher()
+            return cls.dispatcher
 
     def jobJson(self,jobId):
         """ Create JSON to hold jobId """
-        return '{"job_id":"'+str(jobId)+'"}'
+        return ValidatorDispatcher.jobJson([jobId])
 
     def sendJobRequest(self,jobId):
-        """ Send request to validator """
-        validator_host = str(CONFIG_SERVICES['validator_host'])
-        validator_port = str(CONFIG_SERVICES['validator_port'])
-        if validator_port:
-            validator_url = 'http://{}:{}/validate_threaded/'.format(
-                validator_host, validator_port)
-        else:
-            validator_url = 'http://{}/validate_threaded/'.format(
-                validator_host)
-        return requests.request(method="POST", url=validator_url,
-            data=self.jobJson(jobId), headers = self.JSON_HEADER)
+        """ Send request to validator and wait for the response, retrying on connection errors """
+        return self.getDispatcher().send([jobId])
+
+    def queueJobRequest(self,jobId):
+        """ Add job to the dispatch queue and return without waiting for the validator """
+        self.getDispatcher().dispatch(jobId)
 
+    @classmethod
+    def getMetrics(cls):
+        """ Return queue depth, in flight count and latency of the dispatcher for this process """
+        return cls.getDispatcher().getMetrics()
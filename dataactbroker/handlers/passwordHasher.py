@@ -0,0 +1,110 @@
+import os
+from multiprocessing import Pool, TimeoutError
+from threading import BoundedSemaphore, Lock
+from flask.ext.bcrypt import generate_password_hash, check_password_hash
+from dataactcore.config import CONFIG_BROKER
+
+def hashPassword(password, rounds):
+    """ Hash password with bcrypt, module level so it can run in a pool process """
+    return generate_password_hash(password, rounds)
+
+def checkPasswordHash(passwordHash, password):
+    """ Check password against a bcrypt hash, module level so it can run in a pool process """
+    return check_password_hash(passwordHash, password)
+
+class PasswordHasher(object):
+    """ Runs bcrypt in a bounded pool of processes, so hashing does not hold up other requests handled by this process
+
+    The work factor is stored in each bcrypt hash, "$2b$12$..." was made with 12 rounds, so hashes made with an older
+    setting are found by comparing their rounds to ROUNDS and replaced the next time that user logs in.
+
+    Class fields:
+    ROUNDS -- Work factor for new hashes, as log2 of the number of rounds
+    PROCESSES -- Pool processes per broker process, 0 hashes on the calling thread, small by default since each server
+        worker process has its own pool
+    MAX_WAITING -- Most hashes queued or running in the pool at once, further callers wait for a slot
+    TIMEOUT -- Seconds to wait for the pool before hashing on the calling thread instead
+    """
+    ROUNDS = CONFIG_BROKER.get("bcrypt_rounds", 12)
+    PROCESSES = CONFIG_BROKER.get("bcrypt_processes", 2)
+    MAX_WAITING = CONFIG_BROKER.get("bcrypt_max_waiting", 4 * max(1, PROCESSES))
+    TIMEOUT = 30
+    pool = None
+    poolPid = None
+    poolLock = Lock()
+    slots = BoundedSemaphore(MAX_WAITING)
+
+    @staticmethod
+    def getRounds(passwordHash):
+        """ Return work factor a bcrypt hash was made with, or None if it is not a bcrypt hash """
+        try:
+            return int(passwordHash.split("$")[2])
+        except (AttributeError, IndexError, ValueError):
+            return None
+
+    @staticmethod
+    def needsRehash(passwordHash, rounds = None):
+        """ True if the hash was made with a different work factor than the current setting """
+        return PasswordHasher.getRounds(passwordHash) != (rounds if rounds is not None else PasswordHasher.ROUNDS)
+
+    @staticmethod
+    def getPool():
+        """ Get pool for this process, creating it on first use and again after a fork, None if hashing is done inline
+
+        Call this while the process has no other threads, since starting the pool forks the process
+        """
+        if PasswordHasher.PROCESSES <= 0:
+            return None
+        with PasswordHasher.poolLock:
+            if PasswordHasher.pool is None or PasswordHasher.poolPid != os.getpid():
+                PasswordHasher.pool = Pool(PasswordHasher.PROCESSES)
+                PasswordHasher.poolPid = os.getpid()
+            return PasswordHasher.pool
+
+    @staticmethod
+    def run(function, args):
+        """ Run function in the pool and wait for its result, running it on this thread if there is no pool or it times out """
+        try:
+            pool = PasswordHasher.getPool()
+        except (OSError, ValueError):
+            pool = None
+        if pool is None:
+            return function(*args)
+        with PasswordHasher.slots:
+            result = pool.apply_async(function, args)
+            try:
+                return result.get(PasswordHasher.TIMEOUT)
+            except TimeoutError:
+                # Pool is stuck, later calls get a new one while this one finishes the work it was given
+                PasswordHasher.retirePool(pool)
+        return function(*args)
+
+    @staticmethod
+    def hash(password, rounds = None):
+        """ Hash password with rounds, or the current setting """
+        return PasswordHasher.run(hashPassword, (password, rounds if rounds is not None else PasswordHasher.ROUNDS))
+
+    @staticmethod
+    def check(passwordHash, password):
+        """ True if password matches hash """
+        return PasswordHasher.run(checkPasswordHash, (passwordHash, password))
+
+    @staticmethod
+    def retirePool(pool):
+        """ Stop handing out pool, its processes exit once the work already queued on it is done
+
+        Calls still waiting on pool get their results when that work finishes, rather than waiting for TIMEOUT
+        """
+        with PasswordHasher.poolLock:
+            if PasswordHasher.pool is pool:
+                PasswordHasher.pool = None
+        pool.close()
+
+    @staticmethod
+    def closePool():
+        """ Stop the pool processes of this process, a new pool is started on next use """
+        with PasswordHasher.poolLock:
+            pool = PasswordHasher.pool
+            PasswordHasher.pool = None
+        if pool is not None:
+            pool.terminate()
@@ -0,0 +1,316 @@
+import base64
+import hashlib
+import json
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from threading import Lock, local
+from uuid import uuid4
+from cryptography.fernet import Fernet, InvalidToken
+from flask.sessions import SessionInterface
+from flask.ext.login import _create_identifier
+from dataactbroker.handlers.interfaceHolder import InterfaceHolder
+from dataactbroker.handlers.aws.session import DynamoInterface, DynamoSession, SessionTable, toUnixTime
+
+def createSessionInterface(config):
+    """ Create the session interface named by session_backend in the broker config
+
+    arguments:
+
+    config -- (dict) the broker config
+
+    Backends are "dynamo", the default, "sqlite" for a session file at session_sqlite_path on a single node install,
+    "memory" for a single process, and "cookie", which keeps sessions in a cookie encrypted with session_secret_key
+    """
+    backend = config.get("session_backend", "dynamo")
+    if backend == "dynamo":
+        return DynamoInterface()
+    if backend == "sqlite":
+        return DynamoInterface(SqliteSessionTable(config.get("session_sqlite_path", "sessions.db")))
+    if backend == "memory":
+        return DynamoInterface(MemorySessionTable())
+    if backend == "cookie":
+        return CookieInterface(config["session_secret_key"])
+    raise ValueError("Unknown session backend: {}".format(backend))
+
+
+class MemorySessionTable(object):
+    """
+    Session store kept in this process's memory, for tests and single process installs
+
+    Has the same getSession, newSession, and clearSessions methods as SessionTable
+    """
+    def __init__(self):
+        self.items = {}
+        self.lock = Lock()
+
+    def getSession(self, uid):
+        """ returns a tuple of (data, expiration) for the session, or None if there is no such session """
+        with self.lock:
+            item = self.items.get(uid)
+        if item is None:
+            return None
+        return dict(item[0]), item[1]
+
+    def newSession(self, uid, data, expiration):
+        """ Updates the existing session or creates a new one, expiration is a UTC datetime """
+        with self.lock:
+            self.items[uid] = (dict(data), toUnixTime(expiration))
+
+    def clearSessions(self):
+        """ Removes expired sessions, returns a tuple of (number of sessions removed, seconds taken) """
+        startTime = time.time()
+        now = toUnixTime(datetime.utcnow())
+        with self.lock:
+            expired = [uid for uid, item in self.items.items() if item[1] <= now]
+            for uid in expired:
+                del self.items[uid]
+        return len(expired), time.time() - startTime
+
+
+class SqliteSessionTable(object):
+    """
+    Session store in a local SQLite file, for single node installs without DynamoDB
+
+    Has the same getSession, newSession, and clearSessions methods as SessionTable.  Each thread keeps its own
+    connection to the file, since SQLite connections can not be shared between threads.
+    """
+    TIMEOUT = 10
+
+    def __init__(self, path):
+        self.path = path
+        self.connections = local()
+        with self.getConnection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS session (uid TEXT PRIMARY KEY, data TEXT NOT NULL, expiration REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_session_expiration ON session (expiration)")
+
+    def getConnection(self):
+        """ returns the connection for this thread, opening it the first time it is needed """
+        connection = getattr(self.connections, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.TIMEOUT)
+            self.connections.connection = connection
+        return connection
+
+    def getSession(self, uid):
+        """ returns a tuple of (data, expiration) for the session, or None if there is no such session """
+        row = self.getConnection().execute("SELECT data, expiration FROM session WHERE uid = ?", (uid,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def newSession(self, uid, data, expiration):
+        """ Updates the existing session or creates a new one, expiration is a UTC datetime """
+        with self.getConnection() as connection:
+            connection.execute("INSERT OR REPLACE INTO session (uid, data, expiration) VALUES (?, ?, ?)",
+                (uid, json.dumps(data), toUnixTime(expiration)))
+
+    def clearSessions(self):
+        """ Removes expired sessions, returns a tuple of (number of sessions removed, seconds taken) """
+        startTime = time.time()
+        with self.getConnection() as connection:
+            removed = connection.execute("DELETE FROM session WHERE expiration <= ?", (toUnixTime(datetime.utcnow()),)).rowcount
+        return removed, time.time() - startTime
+
+
+class UserDbRevocationStore(object):
+    """ Keeps revoked cookie sessions in the revoked_session table of the user database """
+
+    def addRevokedSession(self, sid, expiration):
+        """ Refuse the session until expiration, a UTC datetime """
+        interfaces = InterfaceHolder()
+        try:
+            interfaces.userDb.addRevokedSession(sid, expiration)
+        finally:
+            interfaces.close()
+
+    def getRevokedSessionIds(self):
+        """ returns IDs of revoked sessions that have not expired """
+        interfaces = InterfaceHolder()
+        try:
+            return interfaces.userDb.getRevokedSessionIds()
+        finally:
+            interfaces.close()
+
+    def clearSessions(self):
+        """ Removes expired revocations, returns a tuple of (number removed, seconds taken) """
+        startTime = time.time()
+        interfaces = InterfaceHolder()
+        try:
+            removed = interfaces.userDb.deleteExpiredRevokedSessions()
+        finally:
+            interfaces.close()
+        return removed, time.time() - startTime
+
+
+class MemoryRevocationStore(object):
+    """ Keeps revoked cookie sessions in this process's memory, for tests and single process installs """
+
+    def __init__(self):
+        self.items = {}
+        self.lock = Lock()
+
+    def addRevokedSession(self, sid, expiration):
+        """ Refuse the session until expiration, a UTC datetime """
+        with self.lock:
+            self.items[sid] = expiration
+
+    def getRevokedSessionIds(self):
+        """ returns IDs of revoked sessions that have not expired """
+        now = datetime.utcnow()
+        with self.lock:
+            return [sid for sid, expiration in self.items.items() if expiration > now]
+
+    def clearSessions(self):
+        """ Removes expired revocations, returns a tuple of (number removed, seconds taken) """
+        startTime = time.time()
+        now = datetime.utcnow()
+        with self.lock:
+            expired = [sid for sid, expiration in self.items.items() if expiration <= now]
+            for sid in expired:
+                del self.items[sid]
+        return len(expired), time.time() - startTime
+
+
+class RevocationList(object):
+    """
+    Process-local copy of the revoked session IDs in a revocation store, so checking a cookie needs no I/O
+
+    The copy is read again when it is older than MAX_AGE, this bounds how long a session revoked by another
+    process can still be used here.  Sessions revoked by this process are refused at once.
+    """
+    MAX_AGE = 30
+
+    def __init__(self, store):
+        self.store = store
+        self.revoked = set()
+        self.loadedAt = None
+        self.lock = Lock()
+
+    def isRevoked(self, sid):
+        """ returns (boolean) True if the session has been revoked """
+        with self.lock:
+            if self.loadedAt is None or time.time() - self.loadedAt > self.MAX_AGE:
+                self.revoked = set(self.store.getRevokedSessionIds())
+                self.loadedAt = time.time()
+            return sid in self.revoked
+
+    def revoke(self, sid, expiration):
+        """ Refuse the session from now until expiration, a UTC datetime """
+        self.store.addRevokedSession(sid, expiration)
+        with self.lock:
+            self.revoked.add(sid)
+
+
+class CookieInterface(SessionInterface):
+    """
+
+    Class That implements the SessionInterface and keeps the whole session in an encrypted and signed cookie
+
+    The cookie holds the session ID, its expiration and its data, so requests read and write no session store.
+    Whenever a request drops a privilege key (login, register, or reset) the session's ID is added to a deny-list and
+    the session carries on under a new ID, so an old copy of the cookie can not be used to restore the privilege.
+    Like DynamoInterface, the cookie is only written again when the session changes or its expiration is more than
+    SESSION_REFRESH_INTERVAL seconds behind.
+
+    """
+    SESSION_REFRESH_INTERVAL = DynamoInterface.SESSION_REFRESH_INTERVAL
+    # Session keys that grant access, dropping any of them revokes the cookie that carried it
+    PRIVILEGE_KEYS = ("login", "register", "reset")
+
+    def __init__(self, secretKey, revocationStore=None):
+        """
+
+        arguments:
+
+        secretKey -- (String) key the cookie encryption key is derived from
+        revocationStore -- store of revoked sessions, the user database if None
+
+        """
+        key = hashlib.sha256(secretKey.encode("utf-8")).digest()
+        self.fernet = Fernet(base64.urlsafe_b64encode(key))
+        self.revocations = RevocationList(revocationStore if revocationStore is not None else UserDbRevocationStore())
+
+    def loadCookie(self, value):
+        """
+
+        arguments:
+
+        value -- (String) the cookie value
+
+        returns a tuple of (sid, data, expiration) if the cookie is valid, current, and not revoked, otherwise None
+
+        """
+        try:
+            payload = json.loads(self.fernet.decrypt(value.encode("utf-8")).decode("utf-8"))
+            sid, expiration, data = payload["sid"], float(payload["expiration"]), payload["data"]
+        except (InvalidToken, ValueError, TypeError, KeyError):
+            return None
+        if expiration <= toUnixTime(datetime.utcnow()) or self.revocations.isRevoked(sid):
+            return None
+        return sid, data, expiration
+
+    def open_session(self, app, request):
+        """
+
+        arguments:
+
+        app -- (Flask) the Flask applcation
+        request -- (Request)  the request object
+
+        implements the open_session method that reads the session from its cookie or creates a new DynamoSession object
+
+        """
+        value = request.cookies.get(app.session_cookie_name)
+        if(value):
+            record = self.loadCookie(value)
+            if record is not None:
+                session = DynamoSession(initial=record[1], sid=record[0], expiration=record[2])
+                session.privileges = [key for key in self.PRIVILEGE_KEYS if key in session]
+                return session
+        return DynamoSession(sid=str(uuid4()))
+
+    def save_session(self, app, session, response):
+        """
+        arguments:
+
+        app -- (Flask) the Flask applcation
+        session -- (Session)  the session object
+        response -- (Response)  the response object
+
+        implements the save_session method that writes the session cookie, revoking the old session ID when the
+        session has been emptied or has lost a privilege key it was opened with
+
+        """
+        domain = self.get_cookie_domain(app)
+        dropped = [key for key in getattr(session, "privileges", []) if key not in session]
+        if session.expiration is not None and (not session or dropped):
+            # Make sure copies of the old cookie are no longer accepted and carry on with a new ID
+            self.revocations.revoke(session.sid, datetime(1970, 1, 1) + timedelta(seconds=session.expiration))
+            session.sid = str(uuid4())
+            session.expiration = None
+        if not session:
+            response.delete_cookie(app.session_cookie_name, domain=domain)
+            return
+        if self.get_expiration_time(app, session):
+            expiration = self.get_expiration_time(app, session)
+        else:
+            expiration = datetime.utcnow() + timedelta(seconds=SessionTable.TIME_OUT_LIMIT)
+        if(not "_uid" in session):
+            session["_uid"] = _create_identifier()
+        if not DynamoInterface.shouldSave(session, expiration):
+            return
+        payload = json.dumps({"sid": session.sid, "expiration": toUnixTime(expiration), "data": dict(session)})
+        response.set_cookie(app.session_cookie_name, self.fernet.encrypt(payload.encode("utf-8")).decode("utf-8"),
+                            expires=self.get_expiration_time(app, session),
+                            httponly=True, domain=domain)
+
+    def clearSessions(self):
+        """
+
+        Removes expired sessions from the deny-list, cookie sessions are not stored on the server
+
+        returns a tuple of (number of revocations removed, seconds taken)
+
+        """
+        return self.revocations.store.clearSessions()
@@ -0,0 +1,126 @@
+import os
+import select
+import time
+from threading import Condition, Lock, Thread
+
+class SubmissionEvents(object):
+    """ In-process wake ups for clients waiting on submission changes
+
+    Waiters register interest in a submission and are woken when it changes, either by a notification from Postgres
+    (sent by the submission_version trigger on commit) or by an in-process notify from the broker.  Waiters only learn
+    that something may have changed, they read the submission version from the database to find out what.
+
+    Class fields:
+    CHANNEL -- Postgres notification channel used by the submission_version trigger
+    POLL_INTERVAL -- Longest a waiter sleeps before checking the database itself, used when no listener is running
+    LISTEN_TIMEOUT -- Seconds the listener waits on its connection before checking it again
+    """
+    CHANNEL = "submission_events"
+    POLL_INTERVAL = 5
+    LISTEN_TIMEOUT = 30
+    condition = Condition(Lock())
+    # Maps submission ID to [change token, number of waiters], only submissions with waiters are kept
+    submissions = {}
+    listenerPid = None
+    listening = False
+
+    @classmethod
+    def register(cls, submissionId):
+        """ Start waiting on a submission, returns the current change token """
+        with cls.condition:
+            entry = cls.submissions.setdefault(submissionId, [0, 0])
+            entry[1] += 1
+            return entry[0]
+
+    @classmethod
+    def unregister(cls, submissionId):
+        """ Stop waiting on a submission """
+        with cls.condition:
+            entry = cls.submissions.get(submissionId)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del cls.submissions[submissionId]
+
+    @classmethod
+    def notify(cls, submissionId):
+        """ Wake every waiter for a submission """
+        with cls.condition:
+            entry = cls.submissions.get(submissionId)
+            if entry is not None:
+                entry[0] += 1
+                cls.condition.notify_all()
+
+    @classmethod
+    def wait(cls, submissionId, token, timeout):
+        """ Block until the submission is notified after token was taken, or until timeout
+
+        Returns:
+        Tuple of (new change token, True if notified)
+        """
+        if not cls.listening:
+            # Without a listener changes made by other processes are not announced, so check the database regularly
+            timeout = min(timeout, cls.POLL_INTERVAL)
+        deadline = time.time() + timeout
+        with cls.condition:
+            while True:
+                entry = cls.submissions.get(submissionId)
+                if entry is not None and entry[0] != token:
+                    return entry[0], True
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return token, False
+                cls.condition.wait(remaining)
+
+    @classmethod
+    def startListener(cls, engine):
+        """ Start a thread in this process listening for Postgres notifications, if one is not already running
+
+        Returns:
+        True if a listener is running
+        """
+        with cls.condition:
+            if cls.listenerPid == os.getpid():
+                return cls.listening
+            cls.listenerPid = os.getpid()
+            cls.listening = False
+            if engine.dialect.name != "postgresql":
+                return False
+            try:
+                # Listener keeps its connection for the life of the process, so take it out of the engine's pool
+                connection = engine.raw_connection()
+                connection.detach()
+                dbConnection = connection.connection
+                dbConnection.set_isolation_level(0)
+                dbConnection.cursor().execute("LISTEN " + cls.CHANNEL)
+            except Exception:
+                return False
+            listener = Thread(target=cls.listen, args=(dbConnection,), name="submission-events-listener")
+            listener.daemon = True
+            listener.start()
+            cls.listening = True
+            return True
+
+    @classmethod
+    def listen(cls, dbConnection):
+        """ Pass notifications from Postgres on to waiters until the connection fails """
+        try:
+            while True:
+                if select.select([dbConnection], [], [], cls.LISTEN_TIMEOUT) == ([], [], []):
+                    continue
+                dbConnection.poll()
+                while dbConnection.notifies:
+                    notification = dbConnection.notifies.pop(0)
+                    cls.notify(int(notification.payload))
+        except Exception:
+            pass
+        finally:
+            with cls.condition:
+                # Next waiter starts a new listener, until then waiters poll the database
+                cls.listening = False
+                cls.listenerPid = None
+            try:
+                dbConnection.close()
+            except Exception:
+                pass
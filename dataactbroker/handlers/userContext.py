@@ -0,0 +1,55 @@
+from flask import g
+
+class UserContext:
+    """
+    This class is a wrapper for the request-scoped user context.  permissions_check loads the
+    logged in user once per request and stores it here with the user's decoded permissions, so
+    handlers can read them instead of querying the user database again.
+
+    The stored User object is detached from its database session, so it is a read-only snapshot.
+    """
+
+    @staticmethod
+    def setUser(user, permissions):
+        """
+        arguments:
+
+        user -- (User) the logged in user
+        permissions -- (dict) permission_type_id for each permission name the user has
+
+        Stores the user for the rest of the request
+        """
+        g.currentUser = user
+        g.currentPermissions = permissions
+
+    @staticmethod
+    def getUser(uid):
+        """
+        arguments:
+
+        uid -- (int) the id of the user
+
+        returns the stored User object if it matches uid, otherwise None
+        """
+        user = getattr(g, "currentUser", None)
+        if user is not None and user.user_id == uid:
+            return user
+        return None
+
+    @staticmethod
+    def hasPermission(permissionName):
+        """
+        arguments:
+
+        permissionName -- (String) the permission to check
+
+        returns (boolean) True if the stored user has the permission
+        """
+        return permissionName in getattr(g, "currentPermissions", {})
+
+    @staticmethod
+    def getPermissionIds():
+        """
+        returns (list) the sorted permission_type_ids of the stored user
+        """
+        return sorted(getattr(g, "currentPermissions", {}).values())
@@ -1,13 +1,19 @@
 import uuid
-import time
+import hashlib
+from datetime import datetime, timedelta
 from sqlalchemy.orm.exc import MultipleResultsFound
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
-from sqlalchemy import func
+from sqlalchemy import func, and_, or_
 from dataactcore.models.userModel import User, PermissionType
 from dataactcore.models.userInterface import UserInterface
 from dataactcore.utils.responseException import ResponseException
 from dataactcore.utils.statusCode import StatusCode
-from dataactcore.models.userModel import EmailToken, EmailTemplateType, EmailTemplate
+from dataactcore.models.userModel import EmailTemplateType, EmailTemplate
+from dataactbroker.handlers.lookupCache import LookupCache
+from dataactbroker.handlers.passwordHasher import PasswordHasher
+from dataactbroker.handlers.emailTemplateCache import EmailTemplateCache
+from dataactbroker.models.userModels import OutboxEmail, EmailTemplateVersion, RevokedSession, HashedEmailToken
 
 class UserHandler(UserInterface):
     """ Responsible for all interaction with the user database
@@ -21,7 +27,20 @@ class UserHandler(UserInterface):
     connection -- sqlalchemy connection to user database
     session - sqlalchemy session for ORM calls to user database
     """
-    HASH_ROUNDS = 12 # How many rounds to use for hashing passwords
+    HASH_ROUNDS = PasswordHasher.ROUNDS # How many rounds to use for hashing passwords, set by bcrypt_rounds in the broker config
+    LAST_LOGIN_INTERVAL = 3600 # Seconds a recorded login time is kept before a new login replaces it
+    USER_BATCH_SIZE = 500 # How many user rows to fetch from the database at a time when streaming user lists
+
+    @staticmethod
+    def hashToken(token):
+        """ Return the digest a token is stored and looked up by
+
+        Arguments:
+            token - Token to hash
+        Returns:
+            hex SHA-256 of the token
+        """
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
     def getTokenSalt(self,token):
         """ gets the salt from a given token so it can be decoded
@@ -31,10 +50,10 @@ class UserHandler(UserInterface):
         Returns:
             salt for this token
         """
-        return  self.session.query(EmailToken.salt).filter(EmailToken.token == token).one()
+        return  self.session.query(HashedEmailToken.salt).filter(HashedEmailToken.token_hash == UserHandler.hashToken(token)).one()
 
     def saveToken(self,salt,token):
-        """ saves token into database
+        """ saves token into database, only the digest of the token is stored
 
         Arguments:
             token - Token to save in the database
@@ -42,9 +61,9 @@ class UserHandler(UserInterface):
         Returns:
             No return value
         """
-        newToken = EmailToken()
+        newToken = HashedEmailToken()
         newToken.salt = salt
-        newToken.token = token
+        newToken.token_hash = UserHandler.hashToken(token)
         self.session.add(newToken)
         self.session.commit()
 
@@ -54,9 +73,21 @@ class UserHandler(UserInterface):
         Arguments:
             token - Token to be deleted
         """
-        oldToken = self.session.query(EmailToken).filter(EmailToken.token == token).one()
-        self.session.delete(oldToken)
+        self.session.query(HashedEmailToken).filter(HashedEmailToken.token_hash == UserHandler.hashToken(token)).delete(synchronize_session=False)
+        self.session.commit()
+
+    def deleteExpiredTokens(self,maxAge):
+        """ deletes tokens too old to be accepted
+
+        Arguments:
+            maxAge - Age in seconds after which a token is no longer accepted
+        Returns:
+            number of tokens removed
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=maxAge)
+        removed = self.session.query(HashedEmailToken).filter(HashedEmailToken.created_at < cutoff).delete(synchronize_session=False)
         self.session.commit()
+        return removed
 
     def getUserByUID(self,uid):
         """ Return a User object that matches specified uid
@@ -182,16 +213,37 @@ class UserHandler(UserInterface):
         emailId = self.session.query(EmailTemplateType.email_template_type_id).filter(EmailTemplateType.name == emailType).one()
         return self.session.query(EmailTemplate).filter(EmailTemplate.template_type_id == emailId).one()
 
-    def getUsersByStatus(self,status):
-        """ Return list of all users with specified status
+    def getEmailTemplates(self):
+        """ Return (type name, subject, content) for every email template """
+        return self.session.query(EmailTemplateType.name, EmailTemplate.subject, EmailTemplate.content).join(
+            EmailTemplate, EmailTemplate.template_type_id == EmailTemplateType.email_template_type_id).all()
+
+    def getEmailTemplateVersion(self):
+        """ Return change counter of the email templates, 0 if they have not changed since the counter was created """
+        version = self.session.query(EmailTemplateVersion.version).scalar()
+        return version or 0
+
+    def getUserPageByStatusId(self,statusId,limit,afterId=None):
+        """ Return iterator over one page of users with specified status, ordered by user ID, selecting only listed columns
 
         Arguments:
-            status - Status to check against
+            statusId - user_status_id to filter on
+            limit - Most users to return, None for all of them
+            afterId - Last user ID on the previous page, None for the first page
         Returns:
-            list of User objects
+            iterator of rows with user_id, name, title, agency, and email, fetched from the database in batches
         """
-        statusId = self.getUserStatusId(status)
-        return self.session.query(User).filter(User.user_status_id == statusId).all()
+        query = self.session.query(User.user_id,User.name,User.title,User.agency,User.email).filter(User.user_status_id == statusId)
+        if afterId is not None:
+            query = query.filter(User.user_id > afterId)
+        query = query.order_by(User.user_id)
+        if limit is not None:
+            query = query.limit(limit)
+        return iter(query.yield_per(self.USER_BATCH_SIZE))
+
+    def countUsersByStatusId(self,statusId):
+        """ Return number of users with specified status """
+        return self.session.query(func.count(User.user_id)).filter(User.user_status_id == statusId).scalar()
 
     def getStatusOfUser(self,user):
         """ Given a user object return their status as a string
@@ -214,21 +266,15 @@ class UserHandler(UserInterface):
         return user.status_id
 
     def getUsersByType(self,permissionName):
-        """ Get all users that have the specified permission
+        """ Get all users that have the specified permission, the permission check is done in the database
 
         Arguments:
             permissionName - permission to check against
         Returns:
             list of all users that have that permission
         """
-        userList = []
-        bitNumber = self.getPermissionId(permissionName)
-        users = self.session.query(User).all()
-        for user in users:
-            if self.checkPermissionByBitNumber(user, bitNumber):
-                # This user has this permission, include them in list
-                userList.append(user)
-        return userList
+        mask = self.getPermissionMask(permissionName)
+        return self.session.query(User).filter(User.permissions.op("&")(mask) != 0).all()
 
 
     def hasPermission(self, user, permissionName):
@@ -240,12 +286,7 @@ class UserHandler(UserInterface):
         Returns:
             True if user has the specified permission, False otherwise
         """
-        # Get the bit number corresponding to this permission from the permission_types table
-        bitNumber = self.getPermissionId(permissionName)
-        # Use that bit number to check whether user has the specified permission
-        if self.checkPermissionByBitNumber(user, bitNumber):
-            return True
-        return False
+        return UserHandler.checkPermissionByMask(user, self.getPermissionMask(permissionName))
 
 
     @staticmethod
@@ -259,17 +300,32 @@ class UserHandler(UserInterface):
         Returns:
             True if user has that permission, False otherwise
         """
+        return UserHandler.checkPermissionByMask(user, 1 << bitNumber)
+
+    @staticmethod
+    def checkPermissionByMask(user, mask):
+        """ Check whether any bit set in mask is also set in the user's permissions
+
+        Arguments:
+            user - User object
+            mask - int with the bits for the permissions to check set to 1
+        Returns:
+            True if user has that permission, False otherwise
+        """
         if(user.permissions == None):
             # This user has no permissions
             return False
-        # First get the value corresponding to the specified bit (i.e. 2^bitNumber)
-        bitValue = 2 ** (bitNumber)
-        # Remove all bits above the target bit by modding with the value of the next higher bit
-        # This leaves the target bit and all lower bits as the remaining value, all higher bits are set to 0
-        lowEnd = user.permissions % (bitValue * 2)
-        # Now compare the remaining value to the value for the target bit to determine if that bit is 0 or 1
-        # If the remaining value is still at least the value of the target bit, that bit is 1, so we have that permission
-        return (lowEnd >= bitValue)
+        return (user.permissions & mask) != 0
+
+    def getPermissionMask(self,permissionName):
+        """ Get the bitmask for specified permission name
+
+        Arguments:
+            permissionName - permission to get mask for
+        Returns:
+            int with only the bit for this permission set
+        """
+        return 1 << self.getPermissionId(permissionName)
 
     def setPermission(self,user,permission):
         """ Define a user's permission to set value (overwrites all current permissions)
@@ -291,10 +347,10 @@ class UserHandler(UserInterface):
         if(user.permissions == None):
             # Start users with zero permissions
             user.permissions = 0
-        bitNumber = self.getPermissionId(permissionName)
-        if not self.checkPermissionByBitNumber(user, bitNumber):
+        mask = self.getPermissionMask(permissionName)
+        if not self.checkPermissionByMask(user, mask):
             # User does not have permission, grant it
-            user.permissions = user.permissions + (2 ** bitNumber)
+            user.permissions = user.permissions | mask
             self.session.commit()
 
     def removePermission(self,user,permissionName):
@@ -307,10 +363,10 @@ class UserHandler(UserInterface):
         if(user.permissions == None):
             # Start users with zero permissions
             user.permissions = 0
-        bitNumber = self.getPermissionId(permissionName)
-        if self.checkPermissionByBitNumber(user, bitNumber):
+        mask = self.getPermissionMask(permissionName)
+        if self.checkPermissionByMask(user, mask):
             # User has permission, remove it
-            user.permissions = user.permissions - (2 ** bitNumber)
+            user.permissions = user.permissions & ~mask
             self.session.commit()
 
     def getPermissionId(self,permissionName):
@@ -321,17 +377,35 @@ class UserHandler(UserInterface):
         Returns:
             ID of this permission
         """
+        permissionId = LookupCache.getId("permission_type", permissionName, self.session)
+        if permissionId is not None:
+            return permissionId
+        # Not in the lookup cache, query so an invalid name raises the usual error
         query = self.session.query(PermissionType).filter(PermissionType.name == permissionName)
         result = self.runUniqueQuery(query,"Not a valid user type","Multiple permission entries for that type")
         return result.permission_type_id
 
+    def getUserStatusId(self,statusName):
+        """ Get ID for specified user status name
+
+        Arguments:
+            statusName - status to get ID for
+        Returns:
+            ID of this status, raises ValueError if status name is not valid
+        """
+        statusId = LookupCache.getId("user_status", statusName, self.session)
+        if statusId is not None:
+            return statusId
+        # Not in the lookup cache, query so an invalid name raises the usual error
+        return UserInterface.getUserStatusId(self, statusName)
+
     def checkPassword(self,user,password,bcrypt):
         """ Given a user object and a password, verify that the password is correct.
 
         Arguments:
             user - User object
             password - Password to check
-            bcrypt - bcrypt to use for password hashing
+            bcrypt - kept for existing callers, hashing is done by PasswordHasher
         Returns:
              True if valid password, False otherwise.
         """
@@ -339,8 +413,13 @@ class UserHandler(UserInterface):
             # If no password or empty password, reject
             return False
 
-        # Check the password with bcrypt
-        return bcrypt.check_password_hash(user.password_hash,password+user.salt)
+        # Check the password with bcrypt, in the hashing pool
+        if not PasswordHasher.check(user.password_hash,password+user.salt):
+            return False
+        if PasswordHasher.needsRehash(user.password_hash,UserHandler.HASH_ROUNDS):
+            # Work factor setting has changed since this hash was made, replace it now that the password is known
+            self.setPassword(user,password,bcrypt)
+        return True
 
     def setPassword(self,user,password,bcrypt):
         """ Given a user and a new password, changes the hashed value in the database to match new password.
@@ -348,14 +427,14 @@ class UserHandler(UserInterface):
         Arguments:
             user - User object
             password - password to be set
-            bcrypt - bcrypt to use for password hashing
+            bcrypt - kept for existing callers, hashing is done by PasswordHasher
         Returns:
              True if successful
         """
         # Generate hash with bcrypt and store it
         newSalt =  uuid.uuid4().hex
         user.salt = newSalt
-        user.password_hash = bcrypt.generate_password_hash(password+newSalt,UserHandler.HASH_ROUNDS)
+        user.password_hash = PasswordHasher.hash(password+newSalt,UserHandler.HASH_ROUNDS)
         self.session.commit()
         return True
 
@@ -370,6 +449,20 @@ class UserHandler(UserInterface):
         user.password_hash = None
         self.session.commit()
 
+    def getPermissionsForUser(self,user):
+        """ Decode all permissions a user has from the cached permission types
+
+        Arguments:
+            user - User object
+        Returns:
+            dictionary of permission_type_id for each permission name the user has
+        """
+        permissions = {}
+        for permissionName, permissionId in LookupCache.getMaps("permission_type", self.session)[0].items():
+            if self.checkPermissionByMask(user, 1 << permissionId):
+                permissions[permissionName] = permissionId
+        return permissions
+
     def getPermssionList(self):
         """ Gets the permission list
 
@@ -415,9 +508,118 @@ class UserHandler(UserInterface):
         template.template_type_id = emailId
         self.session.merge(template)
         self.session.commit()
+        # Trigger tells other processes, clear this one's cache now
+        EmailTemplateCache.clear()
 
     def updateLastLogin(self, user):
-        """ This updates the last login date to today's datetime for the user to the current date upon successful login.
+        """ This updates the last login date to the current datetime for the user upon successful login.
+
+        Inactivity is counted in days, so the write is skipped when the recorded login is less than LAST_LOGIN_INTERVAL
+        seconds old, and repeated logins do not each write to the database.
+        """
+        now = datetime.now()
+        if user.last_login_date is not None and timedelta(0) <= now - user.last_login_date < timedelta(seconds=UserHandler.LAST_LOGIN_INTERVAL):
+            return
+        user.last_login_date = now
+        self.session.commit()
+
+    def queueEmails(self, emails):
+        """ Add emails to the outbox in one insert, skipping any that match an email not yet sent
+
+        If another request queues an identical email at the same time, the unique index on unsent dedupe keys rejects
+        the insert, and the emails are then inserted one at a time, skipping the ones already queued.
+
+        Arguments:
+            emails - list of dicts with keys to_address, from_address, subject, content, and dedupe_key
+        Returns:
+            number of emails queued
         """
-        user.last_login_date = time.strftime("%c")
+        keys = set(email["dedupe_key"] for email in emails)
+        if not keys:
+            return 0
+        unsent = set(row.dedupe_key for row in self.session.query(OutboxEmail.dedupe_key).filter(
+            OutboxEmail.dedupe_key.in_(keys)).filter(OutboxEmail.status.in_(["pending", "sending"])))
+        rows = []
+        for email in emails:
+            if email["dedupe_key"] in unsent:
+                continue
+            unsent.add(email["dedupe_key"])
+            rows.append(email)
+        queued = len(rows)
+        if rows and not self.insertOutboxEmails(rows):
+            queued = len([row for row in rows if self.insertOutboxEmails([row])])
+        self.session.commit()
+        return queued
+
+    def insertOutboxEmails(self, rows):
+        """ Insert outbox rows in a savepoint, returns False and inserts nothing if an unsent email has the same dedupe key """
+        savepoint = self.session.begin_nested()
+        try:
+            self.session.execute(OutboxEmail.__table__.insert().values(rows))
+        except IntegrityError:
+            savepoint.rollback()
+            return False
+        savepoint.commit()
+        return True
+
+    def claimOutboxEmails(self, limit, staleBefore):
+        """ Mark up to limit due emails as being sent and return them
+
+        An email is due if it is pending and its next attempt time has passed, or if it was claimed before staleBefore
+        and never marked as sent or failed.  Emails are claimed with a conditional update, so an email claimed by
+        another worker in the meantime is not returned.
+
+        Arguments:
+            limit - Most emails to claim
+            staleBefore - Claims older than this are assumed to belong to a worker that stopped
+        Returns:
+            list of rows with email_outbox_id, to_address, from_address, subject, content, and attempts
+        """
+        now = datetime.utcnow()
+        table = OutboxEmail.__table__
+        due = or_(and_(table.c.status == "pending", table.c.next_attempt_at <= now),
+                  and_(table.c.status == "sending", table.c.claimed_at < staleBefore))
+        emailIds = [row.email_outbox_id for row in self.session.query(OutboxEmail.email_outbox_id).filter(due).order_by(
+            OutboxEmail.next_attempt_at).limit(limit)]
+        if not emailIds:
+            self.session.commit()
+            return []
+        claim = table.update().where(table.c.email_outbox_id.in_(emailIds)).where(due).values(
+            status="sending", claimed_at=now, attempts=table.c.attempts + 1).returning(
+            table.c.email_outbox_id, table.c.to_address, table.c.from_address, table.c.subject, table.c.content, table.c.attempts)
+        emails = self.session.execute(claim).fetchall()
+        self.session.commit()
+        return emails
+
+    def markOutboxEmailsSent(self, emailIds):
+        """ Mark claimed emails as sent """
+        if not emailIds:
+            return
+        self.session.query(OutboxEmail).filter(OutboxEmail.email_outbox_id.in_(emailIds)).update(
+            {"status": "sent", "sent_at": datetime.utcnow(), "last_error": None}, synchronize_session=False)
+        self.session.commit()
+
+    def markOutboxEmailFailed(self, emailId, error, retryAt=None):
+        """ Record a failed send, the email is tried again at retryAt, or marked as failed if retryAt is None """
+        values = {"last_error": error}
+        if retryAt is None:
+            values["status"] = "failed"
+        else:
+            values.update({"status": "pending", "next_attempt_at": retryAt})
+        self.session.query(OutboxEmail).filter(OutboxEmail.email_outbox_id == emailId).update(values, synchronize_session=False)
+        self.session.commit()
+
+    def addRevokedSession(self, sid, expiration):
+        """ Add a session to the deny-list until expiration, a UTC datetime """
+        self.session.merge(RevokedSession(sid=sid, expiration=expiration))
+        self.session.commit()
+
+    def getRevokedSessionIds(self):
+        """ Return IDs of revoked sessions that have not yet expired """
+        return [row.sid for row in self.session.query(RevokedSession.sid).filter(RevokedSession.expiration > datetime.utcnow())]
+
+    def deleteExpiredRevokedSessions(self):
+        """ Remove revoked sessions that have expired, returns number removed """
+        removed = self.session.query(RevokedSession).filter(RevokedSession.expiration <= datetime.utcnow()).delete(synchronize_session=False)
         self.session.commit()
+        return removed
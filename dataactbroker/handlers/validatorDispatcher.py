@@ -0,0 +1,174 @@
+import json
+import os
+import time
+from threading import Lock, Thread
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+import requests
+from requests.adapters import HTTPAdapter
+from dataactcore.config import CONFIG_SERVICES
+
+class ValidatorDispatcher(object):
+    """ Sends job IDs to the validator from a bounded queue serviced by worker threads sharing one pooled HTTP session
+
+    Failed calls are retried with exponential backoff, connection errors, timeouts and 5xx responses are retried,
+    other responses are final.  When batch size is greater than one, several queued job IDs are sent in a single
+    call as {"job_ids": [...]}, this should only be configured for validators that accept that format.
+    """
+    QUEUE_SIZE = CONFIG_SERVICES.get("validator_queue_size", 1000)
+    WORKER_COUNT = CONFIG_SERVICES.get("validator_workers", 4)
+    BATCH_SIZE = CONFIG_SERVICES.get("validator_batch_size", 1)
+    # Connect and read timeouts in seconds
+    TIMEOUT = (CONFIG_SERVICES.get("validator_connect_timeout", 5), CONFIG_SERVICES.get("validator_read_timeout", 30))
+    MAX_RETRIES = CONFIG_SERVICES.get("validator_max_retries", 3)
+    BACKOFF = 0.5
+    JSON_HEADER = {"Content-Type": "application/json"}
+    ROUTE = "validate_threaded/"
+
+    def __init__(self, url = None, workers = None, queueSize = None, batchSize = None, timeout = None, maxRetries = None, backoff = None):
+        self.url = url if url is not None else self.getValidatorUrl()
+        self.workerCount = workers if workers is not None else self.WORKER_COUNT
+        self.batchSize = max(1, batchSize if batchSize is not None else self.BATCH_SIZE)
+        self.timeout = timeout if timeout is not None else self.TIMEOUT
+        self.maxRetries = maxRetries if maxRetries is not None else self.MAX_RETRIES
+        self.backoff = backoff if backoff is not None else self.BACKOFF
+        self.queue = Queue(queueSize if queueSize is not None else self.QUEUE_SIZE)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workerCount + 1)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = Lock()
+        self.inFlight = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.calls = 0
+        self.totalLatency = 0.0
+        self.lastLatency = None
+        self.lastError = None
+        self.workers = []
+        self.pid = os.getpid()
+
+    @classmethod
+    def getValidatorUrl(cls):
+        """ Build validator URL from config """
+        validator_host = str(CONFIG_SERVICES['validator_host'])
+        validator_port = str(CONFIG_SERVICES['validator_port'])
+        if validator_port:
+            return 'http://{}:{}/{}'.format(validator_host, validator_port, cls.ROUTE)
+        return 'http://{}/{}'.format(validator_host, cls.ROUTE)
+
+    @staticmethod
+    def jobJson(jobIds):
+        """ Create JSON body for a list of job IDs, a single job keeps the original {"job_id": ...} format """
+        if len(jobIds) == 1:
+            return json.dumps({"job_id": str(jobIds[0])})
+        return json.dumps({"job_ids": [str(jobId) for jobId in jobIds]})
+
+    def start(self):
+        """ Start worker threads if they are not running """
+        with self.lock:
+            if self.workers:
+                return
+            for i in range(self.workerCount):
+                worker = Thread(target=self.work, name="validator-dispatch-{}".format(i))
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+
+    def stop(self):
+        """ Wait for queued jobs to be sent, then stop worker threads """
+        with self.lock:
+            workers = self.workers
+            self.workers = []
+        for worker in workers:
+            self.queue.put(None)
+        for worker in workers:
+            worker.join()
+
+    def dispatch(self, jobId, block = True, timeout = None):
+        """ Add job to the queue, raises Queue.Full if the queue stays full past timeout or block is False """
+        self.start()
+        self.queue.put(jobId, block, timeout)
+
+    def join(self):
+        """ Block until every queued job has been sent or has failed """
+        self.queue.join()
+
+    def work(self):
+        """ Worker loop, takes up to batch size jobs from the queue and sends them in one call """
+        while True:
+            jobId = self.queue.get()
+            if jobId is None:
+                self.queue.task_done()
+                return
+            batch = [jobId]
+            stopAfterBatch = False
+            while len(batch) < self.batchSize:
+                try:
+                    nextId = self.queue.get_nowait()
+                except Empty:
+                    break
+                if nextId is None:
+                    stopAfterBatch = True
+                    break
+                batch.append(nextId)
+            try:
+                self.send(batch)
+            except Exception:
+                # Failure is recorded by send, keep the worker alive
+                pass
+            finally:
+                for i in range(len(batch) + (1 if stopAfterBatch else 0)):
+                    self.queue.task_done()
+            if stopAfterBatch:
+                return
+
+    def send(self, jobIds):
+        """ Post job IDs to the validator, retrying with exponential backoff
+
+        Returns:
+        Response from the validator
+        """
+        with self.lock:
+            self.inFlight += 1
+        start = time.time()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = self.session.post(self.url, data=self.jobJson(jobIds), headers=self.JSON_HEADER, timeout=self.timeout)
+                    if response.status_code < 500:
+                        break
+                    error = requests.HTTPError("Validator returned status {}".format(response.status_code), response=response)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                if attempt >= self.maxRetries:
+                    with self.lock:
+                        self.failed += len(jobIds)
+                        self.lastError = str(error)
+                    raise error
+                with self.lock:
+                    self.retries += 1
+                time.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+            with self.lock:
+                self.sent += len(jobIds)
+            return response
+        finally:
+            latency = time.time() - start
+            with self.lock:
+                self.inFlight -= 1
+                self.calls += 1
+                self.totalLatency += latency
+                self.lastLatency = latency
+
+    def getMetrics(self):
+        """ Return queue depth, in flight calls, counts and dispatch latency in seconds """
+        with self.lock:
+            return {"queue_depth": self.queue.qsize(), "in_flight": self.inFlight, "sent": self.sent,
+                    "failed": self.failed, "retries": self.retries, "last_error": self.lastError,
+                    "last_latency": self.lastLatency,
+                    "average_latency": (self.totalLatency / self.calls) if self.calls else None}
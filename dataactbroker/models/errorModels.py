@@ -0,0 +1,78 @@
+""" Tables owned by the broker in the error database, created by setupBrokerTables alongside the core tables """
+from sqlalchemy import Column, Integer, BigInteger, Text, Date, DateTime, Index
+from sqlalchemy.ext.declarative import declarative_base
+from dataactcore.models.errorModels import FileStatus, ErrorData
+
+Base = declarative_base()
+
+class JobVersion(Base):
+    """ Change counter for a job, bumped by triggers whenever its file status or error data change """
+    __tablename__ = "job_version"
+
+    job_id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+class ErrorMetricSummary(Base):
+    """ Error occurrences summed by submission day, agency, file type, field, error type, and rule
+
+    Rebuilt from error data by webbroker --refresh-error-metrics, so rollups across many submissions read one row per
+    group rather than every error row.
+    """
+    __tablename__ = "error_metric_summary"
+    __table_args__ = (Index("ix_error_metric_summary_agency_date", "agency_name", "submission_date"),)
+
+    error_metric_summary_id = Column(Integer, primary_key=True)
+    submission_date = Column(Date, nullable=False, index=True)
+    agency_name = Column(Text)
+    file_type = Column(Text, nullable=False)
+    field_name = Column(Text)
+    error_name = Column(Text)
+    rule_failed = Column(Text)
+    occurrences = Column(BigInteger, nullable=False)
+
+class ErrorMetricRefresh(Base):
+    """ Time error_metric_summary was last rebuilt, a single row """
+    __tablename__ = "error_metric_refresh"
+
+    error_metric_refresh_id = Column(Integer, primary_key=True)
+    refreshed_at = Column(DateTime, nullable=False)
+
+# Triggers keeping job_version current, these also catch changes made by the validator
+TRIGGER_TEMPLATES = ["""
+CREATE OR REPLACE FUNCTION bump_job_version(bumpId integer) RETURNS void AS $$
+BEGIN
+    UPDATE job_version SET version = version + 1 WHERE job_id = bumpId;
+    IF NOT FOUND THEN
+        BEGIN
+            INSERT INTO job_version (job_id, version) VALUES (bumpId, 1);
+        EXCEPTION WHEN unique_violation THEN
+            UPDATE job_version SET version = version + 1 WHERE job_id = bumpId;
+        END;
+    END IF;
+END;
+$$ LANGUAGE plpgsql
+""", """
+CREATE OR REPLACE FUNCTION job_version_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' AND OLD.job_id IS NOT NULL THEN
+        PERFORM bump_job_version(OLD.job_id);
+    END IF;
+    IF TG_OP <> 'DELETE' AND NEW.job_id IS NOT NULL AND (TG_OP = 'INSERT' OR NEW.job_id IS DISTINCT FROM OLD.job_id) THEN
+        PERFORM bump_job_version(NEW.job_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+""", """
+DROP TRIGGER IF EXISTS file_status_version ON {fileStatusTable}
+""", """
+CREATE TRIGGER file_status_version AFTER INSERT OR UPDATE OR DELETE ON {fileStatusTable}
+    FOR EACH ROW EXECUTE PROCEDURE job_version_trigger()
+""", """
+DROP TRIGGER IF EXISTS error_data_version ON {errorDataTable}
+""", """
+CREATE TRIGGER error_data_version AFTER INSERT OR UPDATE OR DELETE ON {errorDataTable}
+    FOR EACH ROW EXECUTE PROCEDURE job_version_trigger()
+"""]
+
+TRIGGERS = [template.format(fileStatusTable=FileStatus.__tablename__, errorDataTable=ErrorData.__tablename__) for template in TRIGGER_TEMPLATES]
@@ -0,0 +1,94 @@
+""" Tables owned by the broker in the job tracker database, created by setupBrokerTables alongside the core tables """
+from datetime import datetime
+from sqlalchemy import Column, Integer, BigInteger, Text, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
+from dataactcore.models.jobModels import JobStatus, Submission
+
+Base = declarative_base()
+
+class MultipartUpload(Base):
+    """ An S3 multipart upload for the file of a file_upload job """
+    __tablename__ = "multipart_upload"
+
+    multipart_upload_id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey(JobStatus.__table__.c.job_id, ondelete="CASCADE"), nullable=False, index=True)
+    bucket = Column(Text, nullable=False)
+    key = Column(Text, nullable=False)
+    s3_upload_id = Column(Text, nullable=False)
+    file_size = Column(BigInteger, nullable=False)
+    part_size = Column(BigInteger, nullable=False)
+    part_count = Column(Integer, nullable=False)
+    status = Column(Text, nullable=False, default="in_progress")
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    parts = relationship("UploadPart", order_by="UploadPart.part_number", cascade="all, delete-orphan")
+
+class UploadPart(Base):
+    """ A part of a multipart upload that S3 has received """
+    __tablename__ = "upload_part"
+    __table_args__ = (UniqueConstraint("multipart_upload_id", "part_number"),)
+
+    upload_part_id = Column(Integer, primary_key=True)
+    multipart_upload_id = Column(Integer, ForeignKey("multipart_upload.multipart_upload_id", ondelete="CASCADE"), nullable=False)
+    part_number = Column(Integer, nullable=False)
+    etag = Column(Text, nullable=False)
+    size = Column(BigInteger)
+
+class LocalUploadFile(Base):
+    """ A chunked upload to the server directory of a local install, only the user who started it may add to it """
+    __tablename__ = "local_upload"
+
+    local_upload_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    path = Column(Text, nullable=False, unique=True)
+    status = Column(Text, nullable=False, default="in_progress")
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class SubmissionVersion(Base):
+    """ Change counter for a submission, bumped by triggers whenever the submission or any of its jobs change """
+    __tablename__ = "submission_version"
+
+    submission_id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+# Triggers keeping submission_version current and announcing changes, these also catch changes made by the validator
+TRIGGER_TEMPLATES = ["""
+CREATE OR REPLACE FUNCTION bump_submission_version(bumpId integer) RETURNS void AS $$
+BEGIN
+    UPDATE submission_version SET version = version + 1 WHERE submission_id = bumpId;
+    IF NOT FOUND THEN
+        BEGIN
+            INSERT INTO submission_version (submission_id, version) VALUES (bumpId, 1);
+        EXCEPTION WHEN unique_violation THEN
+            UPDATE submission_version SET version = version + 1 WHERE submission_id = bumpId;
+        END;
+    END IF;
+    -- Delivered on commit to broker processes waiting on submission events
+    PERFORM pg_notify('submission_events', bumpId::text);
+END;
+$$ LANGUAGE plpgsql
+""", """
+CREATE OR REPLACE FUNCTION submission_version_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' AND OLD.submission_id IS NOT NULL THEN
+        PERFORM bump_submission_version(OLD.submission_id);
+    END IF;
+    IF TG_OP <> 'DELETE' AND NEW.submission_id IS NOT NULL AND (TG_OP = 'INSERT' OR NEW.submission_id IS DISTINCT FROM OLD.submission_id) THEN
+        PERFORM bump_submission_version(NEW.submission_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+""", """
+DROP TRIGGER IF EXISTS job_status_version ON {jobTable}
+""", """
+CREATE TRIGGER job_status_version AFTER INSERT OR UPDATE OR DELETE ON {jobTable}
+    FOR EACH ROW EXECUTE PROCEDURE submission_version_trigger()
+""", """
+DROP TRIGGER IF EXISTS submission_version ON {submissionTable}
+""", """
+CREATE TRIGGER submission_version AFTER UPDATE ON {submissionTable}
+    FOR EACH ROW EXECUTE PROCEDURE submission_version_trigger()
+"""]
+
+TRIGGERS = [template.format(jobTable=JobStatus.__tablename__, submissionTable=Submission.__tablename__) for template in TRIGGER_TEMPLATES]
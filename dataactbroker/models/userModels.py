@@ -0,0 +1,77 @@
+""" Tables owned by the broker in the user database, created by setupBrokerTables alongside the core tables """
+from datetime import datetime
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Index, text
+from sqlalchemy.ext.declarative import declarative_base
+from dataactcore.models.userModel import EmailTemplate
+
+Base = declarative_base()
+
+class OutboxEmail(Base):
+    """ An email waiting to be sent, or already sent, by the email outbox workers """
+    __tablename__ = "email_outbox"
+    __table_args__ = (Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+        # At most one unsent email per dedupe key, so concurrent identical enqueues can not both be queued
+        Index("ix_email_outbox_unsent_dedupe_key", "dedupe_key", unique=True, postgresql_where=text("status IN ('pending', 'sending')")))
+
+    email_outbox_id = Column(Integer, primary_key=True)
+    to_address = Column(Text, nullable=False)
+    from_address = Column(Text, nullable=False)
+    subject = Column(Text, nullable=False)
+    content = Column(Text, nullable=False)
+    # Hash of recipient, subject and content, an email is not queued again while an identical one is unsent
+    dedupe_key = Column(Text, nullable=False, index=True)
+    status = Column(Text, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    claimed_at = Column(DateTime)
+    sent_at = Column(DateTime)
+    last_error = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class HashedEmailToken(Base):
+    """ A token sent in a registration or password reset link, stored by digest so lookups use a fixed width unique index """
+    __tablename__ = "email_token_hash"
+
+    email_token_hash_id = Column(Integer, primary_key=True)
+    # Hex SHA-256 of the token, the token itself is not stored
+    token_hash = Column(String(64), nullable=False, unique=True)
+    salt = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class RevokedSession(Base):
+    """ A cookie session ended by logout, cookies for it are refused until it would have expired """
+    __tablename__ = "revoked_session"
+
+    sid = Column(Text, primary_key=True)
+    expiration = Column(DateTime, nullable=False, index=True)
+
+class EmailTemplateVersion(Base):
+    """ Change counter for the email templates, a single row bumped by a trigger whenever email_template changes """
+    __tablename__ = "email_template_version"
+
+    email_template_version_id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+# Trigger keeping email_template_version current, so every process sees template changes made by setupEmails
+TRIGGER_TEMPLATES = ["""
+CREATE OR REPLACE FUNCTION email_template_version_trigger() RETURNS trigger AS $$
+BEGIN
+    UPDATE email_template_version SET version = version + 1 WHERE email_template_version_id = 1;
+    IF NOT FOUND THEN
+        BEGIN
+            INSERT INTO email_template_version (email_template_version_id, version) VALUES (1, 1);
+        EXCEPTION WHEN unique_violation THEN
+            UPDATE email_template_version SET version = version + 1 WHERE email_template_version_id = 1;
+        END;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+""", """
+DROP TRIGGER IF EXISTS email_template_version ON {emailTemplateTable}
+""", """
+CREATE TRIGGER email_template_version AFTER INSERT OR UPDATE OR DELETE ON {emailTemplateTable}
+    FOR EACH STATEMENT EXECUTE PROCEDURE email_template_version_trigger()
+"""]
+
+TRIGGERS = [template.format(emailTemplateTable=EmailTemplate.__tablename__) for template in TRIGGER_TEMPLATES]
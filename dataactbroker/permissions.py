@@ -4,8 +4,8 @@ import flask
 from flask import session
 
 from dataactbroker.handlers.aws.session import LoginSession
-from dataactbroker.handlers.userHandler import UserHandler
 from dataactbroker.handlers.interfaceHolder import InterfaceHolder
+from dataactbroker.handlers.userContext import UserContext
 
 def permissions_check(f=None,permissionList=[]):
     def actual_decorator(f):
@@ -13,15 +13,19 @@ def permissions_check(f=None,permissionList=[]):
         def decorated_function(*args, **kwargs):
             errorMessage  = "Login Required"
             if LoginSession.isLogin(session):
-                userDb = UserHandler()
+                interfaces = InterfaceHolder()
                 try:
+                    userDb = interfaces.userDb
                     user = userDb.getUserByUID(session["name"])
+                    userPermissions = userDb.getPermissionsForUser(user)
+                    # Keep the user for the rest of the request so handlers do not reload it
+                    UserContext.setUser(user, userPermissions)
                     validUser = True
                     for permission in permissionList :
-                        if(not userDb.hasPermission(user, permission)) :
+                        if(permission not in userPermissions) :
                             validUser = False
                 finally:
-                    InterfaceHolder.closeOne(userDb)
+                    interfaces.close()
                 if(validUser) :
                     return f(*args, **kwargs)
                 errorMessage  = "Wrong User Type"
@@ -1,12 +1,19 @@
 from dataactbroker.scripts.setupEmails import setupEmails
+from dataactbroker.scripts.setupBrokerTables import setupBrokerTables
 from dataactcore.scripts.setupJobTrackerDB import setupJobTrackerDB
 from dataactcore.scripts.setupErrorDB import setupErrorDB
 from dataactcore.scripts.setupUserDB import setupUserDB
 from dataactcore.utils.responseException import ResponseException
 from dataactbroker.handlers.userHandler import UserHandler
+from dataactbroker.handlers.interfaceHolder import InterfaceHolder
+from dataactbroker.handlers.emailOutbox import EmailOutbox
 from dataactbroker.handlers.aws.session import SessionTable
+from dataactbroker.handlers.aws.sesEmail import sesEmail
+from dataactbroker.handlers.sessionBackends import createSessionInterface
 from dataactcore.config import CONFIG_BROKER, CONFIG_DB
 import argparse
+import os
+import time
 from flask.ext.bcrypt import Bcrypt
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -17,6 +24,10 @@ def options():
     parser.add_argument("-i", "--initialize", action="store_true", help="Runs all of the setup options")
     parser.add_argument("-a", "--createAdmin", action="store_true", help="Creates admin user")
     parser.add_argument("-s", "--start", action="store_true", help="Starts the broker")
+    parser.add_argument("--sweep-sessions", dest="sweepSessions", action="store_true", help="Removes expired sessions from the session backend")
+    parser.add_argument("--purge-tokens", dest="purgeTokens", action="store_true", help="Removes expired registration and password reset tokens")
+    parser.add_argument("--send-emails", dest="sendEmails", action="store_true", help="Sends every email due in the email outbox")
+    parser.add_argument("--refresh-error-metrics", dest="refreshErrorMetrics", action="store_true", help="Rebuilds the error metric summary used by error metric rollups")
     args = parser.parse_args()
     optionsDict = vars(args)
 
@@ -33,8 +44,9 @@ def options():
 def initialize():
     print ("Setting up databases...")
     setupDB()
-    print ("Setting up DynamoDB session table...")
-    setupSessionTable()
+    if CONFIG_BROKER.get("session_backend", "dynamo") == "dynamo":
+        print ("Setting up DynamoDB session table...")
+        setupSessionTable()
     print ("Creating admin user...")
     createAdmin()
     print ("The broker has been initialized. You may now run the broker with the --start argument.")
@@ -44,6 +56,7 @@ def setupDB():
     setupJobTrackerDB()
     setupErrorDB()
     setupUserDB()
+    setupBrokerTables()
     setupEmails()
 
 
@@ -68,6 +81,52 @@ def setupSessionTable():
     SessionTable.createTable(CONFIG_BROKER['local'], CONFIG_DB['dynamo_port'])
 
 
+def sweepSessions():
+    """Remove expired sessions from the configured session backend, meant to be run on a schedule outside the web server."""
+    SessionTable.setup(None, CONFIG_BROKER['local'])
+    SessionTable.LOCAL_PORT = CONFIG_DB['dynamo_port']
+    if not CONFIG_BROKER['local']:
+        SessionTable.DYNAMO_REGION = CONFIG_BROKER['aws_region']
+    removed, seconds = createSessionInterface(CONFIG_BROKER).clearSessions()
+    print ("Removed {} expired sessions in {:.2f} seconds".format(removed, seconds))
+
+
+def purgeTokens():
+    """Remove email tokens too old to be accepted, meant to be run on a schedule outside the web server."""
+    userDb = UserHandler()
+    try:
+        startTime = time.time()
+        removed = userDb.deleteExpiredTokens(sesEmail.TOKEN_MAX_AGE)
+        print ("Removed {} expired tokens in {:.2f} seconds".format(removed, time.time() - startTime))
+    finally:
+        userDb.session.close()
+
+
+def refreshErrorMetrics():
+    """Rebuild the error metric summary from error data, meant to be run on a schedule outside the web server."""
+    interfaces = InterfaceHolder()
+    try:
+        startTime = time.time()
+        rows = interfaces.errorDb.refreshErrorMetricSummary(interfaces.jobDb.getValidationJobInfo())
+        print ("Wrote {} error metric summary rows in {:.2f} seconds".format(rows, time.time() - startTime))
+    finally:
+        interfaces.close()
+
+
+def sendEmails():
+    """Send every email due in the outbox, for installs where broker processes may sit idle or stopped, meant to be run on a schedule."""
+    # Same email settings as createApp, local installs write emails to a log
+    sesEmail.isLocal = CONFIG_BROKER['local']
+    if sesEmail.isLocal:
+        sesEmail.emailLog = os.path.join(CONFIG_BROKER['broker_files'], 'email.log')
+    outbox = EmailOutbox(workers=0)
+    startTime = time.time()
+    claimed = outbox.drain()
+    metrics = outbox.getMetrics()
+    print ("Sent {} of {} emails in {:.2f} seconds, {} to be retried, {} failed".format(
+        metrics["sent"], claimed, time.time() - startTime, metrics["retries"], metrics["failed"]))
+
+
 def start():
     from dataactbroker.app import runApp
     runApp()
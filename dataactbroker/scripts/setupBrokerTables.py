@@ -0,0 +1,85 @@
+from sqlalchemy import Column, Index, MetaData, Table, func, inspect, text
+from dataactcore.models.errorModels import ErrorData
+from dataactcore.models.jobModels import Submission
+from dataactcore.models.userModel import User
+from dataactbroker.handlers.errorHandler import ErrorHandler
+from dataactbroker.handlers.jobHandler import JobHandler
+from dataactbroker.handlers.userHandler import UserHandler
+from dataactbroker.models import jobTrackerModels, errorModels, userModels
+
+def setupBrokerTables():
+    """Create tables and indexes owned by the broker, run after the core database setup scripts."""
+    jobDb = JobHandler()
+    try:
+        jobTrackerModels.Base.metadata.create_all(jobDb.engine)
+        createTriggers(jobDb.engine, jobTrackerModels.TRIGGERS)
+        # Backs keyset pagination of a user's submissions, newest first, replacing an index on datetime_utc that skipped
+        # submissions without a creation time
+        jobDb.engine.execute("DROP INDEX IF EXISTS ix_submission_user_id_datetime_utc")
+        submissionColumns = Submission.__table__.c
+        createExpressionIndex(jobDb.engine, "ix_submission_user_id_sort_time",
+            [submissionColumns.user_id, submissionColumns.datetime_utc, submissionColumns.submission_id],
+            lambda table: [table.c.user_id, JobHandler.getSubmissionSortTime(table), table.c.submission_id])
+    finally:
+        jobDb.session.close()
+
+    errorDb = ErrorHandler()
+    try:
+        errorModels.Base.metadata.create_all(errorDb.engine)
+        createTriggers(errorDb.engine, errorModels.TRIGGERS)
+        # Backs error metrics, which group error data by job
+        createIndex(errorDb.engine, "ix_error_data_job_id", ErrorData.__table__.c.job_id)
+    finally:
+        errorDb.session.close()
+
+    userDb = UserHandler()
+    try:
+        userModels.Base.metadata.create_all(userDb.engine)
+        # Indexes added to broker tables after they were first created
+        createModelIndexes(userDb.engine, userModels.OutboxEmail.__table__)
+        createTriggers(userDb.engine, userModels.TRIGGERS)
+        # Backs keyset pagination of users with a given status
+        createIndex(userDb.engine, "ix_users_user_status_id_user_id", User.__table__.c.user_status_id, User.__table__.c.user_id)
+        # Backs case-insensitive lookup of users by email, used at every login
+        createLowerIndex(userDb.engine, "ix_users_lower_email", User.__table__.c.email)
+    finally:
+        userDb.session.close()
+
+def createIndex(engine, name, *columns):
+    """Create index on tables defined in the core repository, if it does not already exist."""
+    tableName = columns[0].table.name
+    if name in [index["name"] for index in inspect(engine).get_indexes(tableName)]:
+        return
+    # Build the index on a detached copy of the table so it is not added to the core table metadata
+    table = Table(tableName, MetaData(), *[Column(column.name, column.type) for column in columns])
+    Index(name, *[table.c[column.name] for column in columns]).create(engine)
+
+def createModelIndexes(engine, table):
+    """Create indexes declared on a broker table that do not exist yet, create_all only adds them to new tables."""
+    for index in table.indexes:
+        if not engine.execute(text("SELECT 1 FROM pg_indexes WHERE indexname = :name"), name=index.name).first():
+            index.create(engine)
+
+def createLowerIndex(engine, name, column):
+    """Create index on lower(column) for a table defined in the core repository, if it does not already exist."""
+    createExpressionIndex(engine, name, [column], lambda table: [func.lower(table.c[column.name])])
+
+def createExpressionIndex(engine, name, columns, buildExpressions):
+    """Create index on expressions for a table defined in the core repository, if it does not already exist.
+
+    buildExpressions is called with a detached copy of the table holding columns, and returns the indexed expressions.
+    """
+    # Expression indexes are not reflected by the inspector, so look in the catalog directly
+    if engine.execute(text("SELECT 1 FROM pg_indexes WHERE indexname = :name"), name=name).first():
+        return
+    table = Table(columns[0].table.name, MetaData(), *[Column(column.name, column.type) for column in columns])
+    Index(name, *buildExpressions(table)).create(engine)
+
+def createTriggers(engine, statements):
+    """Create or replace trigger functions and triggers, in one transaction."""
+    with engine.begin() as connection:
+        for statement in statements:
+            connection.execute(statement)
+
+if __name__ == '__main__':
+    setupBrokerTables()
@@ -80,3 +80,17 @@ def add_user_routes(app,system_email,bcrypt):
         """ gets the current user information """
         accountManager = AccountHandler(request,bcrypt = bcrypt)
         return RouteUtils.run_instance_function(accountManager, accountManager.getCurrentUser, getSession = True)
+
+    @app.route("/v1/reload_lookup_tables/", methods=["POST"])
+    @permissions_check(permissionList=["website_admin"])
+    def reload_lookup_tables():
+        """ Reload cached lookup tables after they are changed in the database """
+        accountManager = AccountHandler(request,bcrypt = bcrypt)
+        return RouteUtils.run_instance_function(accountManager, accountManager.reloadLookupTables)
+
+    @app.route("/v1/validator_metrics/", methods=["GET"])
+    @permissions_check(permissionList=["website_admin"])
+    def validator_metrics():
+        """ Get metrics for the validator dispatcher in this process """
+        accountManager = AccountHandler(request,bcrypt = bcrypt)
+        return RouteUtils.run_instance_function(accountManager, accountManager.getValidatorMetrics)
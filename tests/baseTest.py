@@ -4,6 +4,8 @@ import time
 import logging
 from random import randint
 from webtest import TestApp
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from dataactbroker.app import createApp
 from dataactbroker.handlers.interfaceHolder import InterfaceHolder
 from dataactcore.models.userModel import AccountType
@@ -14,6 +16,7 @@ from dataactcore.scripts.setupErrorDB import setupErrorDB
 from dataactcore.config import CONFIG_BROKER
 import dataactcore.config
 from dataactbroker.scripts.setupEmails import setupEmails
+from dataactbroker.scripts.setupBrokerTables import setupBrokerTables
 from dataactbroker.handlers.userHandler import UserHandler
 from flask.ext.bcrypt import Bcrypt
 
@@ -50,6 +53,8 @@ class BaseTest(unittest.TestCase):
         setupJobTrackerDB()
         # create test error db
         setupErrorDB()
+        # create tables owned by the broker
+        setupBrokerTables()
         # load e-mail templates
         setupEmails()
         # reset logging defaults
@@ -155,10 +160,13 @@ class BaseTest(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         """Tear down class-level resources."""
+        dbNames = [cls.interfaces.userDb.dbName, cls.interfaces.jobDb.dbName,
+            cls.interfaces.errorDb.dbName]
         cls.interfaces.close()
-        dropDatabase(cls.interfaces.userDb.dbName)
-        dropDatabase(cls.interfaces.jobDb.dbName)
-        dropDatabase(cls.interfaces.errorDb.dbName)
+        # Pooled interfaces hold connections to the test databases
+        InterfaceHolder.clearPool()
+        for dbName in dbNames:
+            dropDatabase(dbName)
 
     def tearDown(self):
         """Tear down broker unit tests."""
@@ -213,3 +221,17 @@ class BaseTest(unittest.TestCase):
         if message:
             self.assertEqual(message, json["message"])
 
+    def count_queries(self, route, postJson=None):
+        """Call a route (GET if no JSON is given) and count the SQL statements run while handling it."""
+        statements = []
+        def countStatement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(Engine, "before_cursor_execute", countStatement)
+        try:
+            if postJson is None:
+                response = self.app.get(route)
+            else:
+                response = self.app.post_json(route, postJson)
+        finally:
+            event.remove(Engine, "before_cursor_execute", countStatement)
+        return response, len(statements)
@@ -0,0 +1,81 @@
+""" Benchmarks for the broker's hot paths, run directly rather than as part of runTests:
+
+    python benchmarks.py
+"""
+import argparse
+import time
+from threading import Thread
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from webtest import TestApp
+from dataactbroker.app import createApp
+from dataactbroker.handlers.passwordHasher import PasswordHasher
+
+def timeThreads(function, calls, threads):
+    """ Run function calls times spread over threads, return calls per second """
+    perThread = [calls // threads + (1 if i < calls % threads else 0) for i in range(threads)]
+    def worker(count):
+        for i in range(count):
+            function()
+    workers = [Thread(target=worker, args=(count,)) for count in perThread]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return calls / (time.time() - start)
+
+def benchmarkPasswordChecks(roundsList, logins, threads):
+    """ Print password checks per second at each work factor, on request threads and in the hashing pool """
+    password = "!passw0rdUp!" + "0" * 32
+    processes = PasswordHasher.PROCESSES
+    print("Password checks per second, {} logins over {} threads, pool of {} processes".format(logins, threads, processes))
+    print("{:>6} {:>12} {:>12}".format("rounds", "inline", "pool"))
+    try:
+        for rounds in roundsList:
+            PasswordHasher.PROCESSES = 0
+            passwordHash = PasswordHasher.hash(password, rounds)
+            check = lambda: PasswordHasher.check(passwordHash, password)
+            inline = timeThreads(check, logins, threads)
+            PasswordHasher.PROCESSES = processes
+            # Start the pool before timing
+            check()
+            pooled = timeThreads(check, logins, threads)
+            print("{:>6} {:>12.1f} {:>12.1f}".format(rounds, inline, pooled))
+    finally:
+        PasswordHasher.PROCESSES = processes
+        PasswordHasher.closePool()
+
+def benchmarkLogins(email, password, logins):
+    """ Print logins per second and SQL statements per login through the login route, for an existing approved user """
+    app = TestApp(createApp())
+    statements = []
+    def countStatement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    credentials = {"username": email, "password": password}
+    # First login loads lookup tables and records the login time
+    app.post_json("/v1/login/", credentials)
+    app.post_json("/v1/logout/", {})
+    elapsed = 0
+    for i in range(logins):
+        event.listen(Engine, "before_cursor_execute", countStatement)
+        try:
+            start = time.time()
+            app.post_json("/v1/login/", credentials)
+            elapsed += time.time() - start
+        finally:
+            event.remove(Engine, "before_cursor_execute", countStatement)
+        app.post_json("/v1/logout/", {})
+    print("Logins per second: {:.1f}, SQL statements per login: {:.1f}".format(logins / elapsed, len(statements) / float(logins)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark broker hot paths")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13], help="bcrypt work factors to time")
+    parser.add_argument("--logins", type=int, default=40, help="password checks at each work factor")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent request threads")
+    parser.add_argument("--email", help="approved user to log in as, login route is only timed if given")
+    parser.add_argument("--password", help="password of that user")
+    args = parser.parse_args()
+    benchmarkPasswordChecks(args.rounds, args.logins, args.threads)
+    if args.email:
+        benchmarkLogins(args.email, args.password, args.logins)
@@ -1,19 +1,31 @@
 import unittest
 import os
 import inspect
+import hashlib
 import boto
 from datetime import datetime
 from datetime import date
 from time import sleep, time
 from boto.s3.connection import S3Connection
 from boto.s3.key import Key
+from moto import mock_s3
+from io import BytesIO
 from baseTest import BaseTest
-from dataactcore.models.jobModels import Submission, JobStatus
+from dataactcore.models.jobModels import Submission, JobStatus, JobDependency
 from dataactcore.models.errorModels import ErrorData, FileStatus
 from dataactcore.config import CONFIG_BROKER
 from dataactcore.utils.responseException import ResponseException
+from dataactcore.utils.statusCode import StatusCode
 from dataactbroker.handlers.jobHandler import JobHandler
+from dataactbroker.handlers.interfaceHolder import InterfaceHolder
+from dataactbroker.handlers.aws.multipartUpload import MultipartUploadManager
+from dataactbroker.handlers.aws.signedUrlCache import SignedUrlCache
 from shutil import copy
+from threading import Timer
+try:
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlencode
 
 class FileTests(BaseTest):
     """Test file submission routes."""
@@ -127,6 +139,16 @@ class FileTests(BaseTest):
             responseDict["appropriations_id"])
         self.assertEqual(finalizeResponse.status_code, 200)
 
+    def test_file_submission_job_graph(self):
+        """Test that file submission creates every job and dependency for the submission."""
+        response = self.call_file_submission()
+        jobs = self.interfaces.jobDb.getJobsForSubmission(response.json["submission_id"])
+        # An upload and a record level validation job per file, plus cross-file and external validation
+        self.assertEqual(len(jobs), 2 * 4 + 2)
+        jobIds = [job.job_id for job in jobs]
+        dependencies = self.interfaces.jobDb.session.query(JobDependency).filter(JobDependency.job_id.in_(jobIds)).all()
+        self.assertEqual(len(dependencies), 3 * 4)
+
     def test_update_submission(self):
         """ Test submit_files with an existing submission ID """
         self.call_file_submission()
@@ -175,6 +197,57 @@ class FileTests(BaseTest):
         # Assert 200 status
         self.assertEqual(response.status_code,200)
 
+    def test_check_status_etag(self):
+        """Test that status responses are not rebuilt until the submission changes."""
+        postJson = {"submission_id": self.status_check_submission_id}
+        response = self.app.post_json("/v1/check_status/", postJson)
+        etag = response.headers["ETag"]
+        response = self.app.post_json("/v1/check_status/", postJson, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+        # Changing a job in the submission changes the ETag
+        job = self.jobTracker.getJobById(self.jobIdDict["appropriations"])
+        job.number_of_rows += 1
+        self.jobTracker.session.commit()
+        job.number_of_rows -= 1
+        self.jobTracker.session.commit()
+        response = self.app.post_json("/v1/check_status/", postJson, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        # Error metrics with different filters have different ETags
+        metricsJson = {"submission_id": self.test_metrics_submission_id}
+        etag = self.app.post_json("/v1/error_metrics/", metricsJson).headers["ETag"]
+        metricsJson["limit"] = 1
+        response = self.app.post_json("/v1/error_metrics/", metricsJson, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_submission_events(self):
+        """Test that a waiting submission events request returns when a job changes status."""
+        submissionId = self.insertSubmission(self.jobTracker, self.submission_user_id)
+        jobId = self.insertJob(self.jobTracker, filetype=1, status=1, type_id=2, submission=submissionId)
+        route = "/v1/submission_events/{}/".format(submissionId)
+        response = self.app.get(route)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json["changed"])
+        self.assertEqual([job["job_id"] for job in response.json["jobs"]], [jobId])
+        version = response.json["version"]
+        # Nothing changes, so the request times out
+        response = self.app.get(route + "?since={}&timeout=1".format(version))
+        self.assertFalse(response.json["changed"])
+        self.assertEqual(response.json["version"], version)
+        # Change the job while the request is waiting
+        jobDb = JobHandler()
+        timer = Timer(0.5, jobDb.markStatus, args=(jobId, "running"))
+        timer.start()
+        start = time()
+        response = self.app.get(route + "?since={}&timeout=20".format(version))
+        timer.join()
+        jobDb.session.close()
+        self.assertTrue(response.json["changed"])
+        self.assertGreater(response.json["version"], version)
+        self.assertEqual(response.json["jobs"][0]["status"], "running")
+        self.assertLess(time() - start, 10)
+
     def test_check_status(self):
         """Test broker status route response."""
         postJson = {"submission_id": self.status_check_submission_id}
@@ -229,6 +302,31 @@ class FileTests(BaseTest):
         # Check that submission was created today, this test may fail if run right at midnight UTC
         self.assertEqual(json["created_on"],datetime.utcnow().strftime("%m/%d/%Y"))
 
+    def test_check_status_query_count(self):
+        """Test that check_status makes the same number of queries regardless of how many jobs are in the submission."""
+        smallSubmissionId = self.insertSubmission(self.jobTracker, self.submission_user_id, agency = "Department of the Treasury", startDate = "04/01/2016", endDate = "04/02/2016")
+        self.insertJob(self.jobTracker, filetype=1, status=2, type_id=2, submission=smallSubmissionId)
+
+        smallResponse, smallCount = self.count_queries("/v1/check_status/", {"submission_id": smallSubmissionId})
+        self.assertEqual(smallResponse.status_code, 200)
+        self.assertEqual(len(smallResponse.json["jobs"]), 1)
+        largeResponse, largeCount = self.count_queries("/v1/check_status/", {"submission_id": self.status_check_submission_id})
+        self.assertEqual(largeResponse.status_code, 200)
+        self.assertGreater(len(largeResponse.json["jobs"]), 1)
+        self.assertEqual(smallCount, largeCount)
+
+    def test_interface_pool(self):
+        """Test that interfaces are only created when used and are reused once closed."""
+        interfaces = InterfaceHolder()
+        self.assertEqual(interfaces.openInterfaces, {})
+        errorDb = interfaces.errorDb
+        self.assertEqual(list(interfaces.openInterfaces.keys()), ["errorDb"])
+        interfaces.close()
+        self.assertEqual(interfaces.openInterfaces, {})
+        newInterfaces = InterfaceHolder()
+        self.assertIs(newInterfaces.errorDb, errorDb)
+        newInterfaces.close()
+
     def check_upload_complete(self, jobId):
         """Check status of a broker file submission."""
         postJson = {"upload_id": jobId}
@@ -269,6 +367,187 @@ class FileTests(BaseTest):
             response.headers.get("Content-Type"), "application/json")
         self.assertEqual(len(response.json), 4)
 
+    def test_error_report_cached_urls(self):
+        """Test that error report paths match the job tracker and repeated calls return the same reports."""
+        postJson = {"submission_id": self.error_report_submission_id}
+        first = self.app.post_json("/v1/submission_error_reports/", postJson).json
+        second = self.app.post_json("/v1/submission_error_reports/", postJson).json
+        self.assertEqual(first, second)
+        jobDb = self.interfaces.jobDb
+        for jobId, reportPath in jobDb.getReportPathsForSubmission(self.error_report_submission_id):
+            self.assertEqual(reportPath, jobDb.getReportPath(jobId))
+
+    def test_signed_url_cache(self):
+        """Test that signed URLs are reused until they are close to expiring."""
+        mock = mock_s3()
+        mock.start()
+        self.addCleanup(mock.stop)
+        # Connection is cached per process, make sure it is created inside the mock
+        SignedUrlCache._connection = None
+        self.addCleanup(setattr, SignedUrlCache, "_connection", None)
+        SignedUrlCache.clear()
+        self.addCleanup(SignedUrlCache.clear)
+        bucket = "signed-url-cache-test"
+        connection = SignedUrlCache.getConnection()
+        connection.create_bucket(bucket)
+        signed = []
+        generateUrl = connection.generate_url
+        def countingGenerateUrl(*args, **kwargs):
+            signed.append(args)
+            return generateUrl(*args, **kwargs)
+        connection.generate_url = countingGenerateUrl
+
+        first = SignedUrlCache.getSignedUrl("reports", "errors.csv", bucket=bucket)
+        self.assertEqual(SignedUrlCache.getSignedUrl("reports", "errors.csv", bucket=bucket), first)
+        self.assertEqual(len(signed), 1)
+        # Another key, or the same key in another bucket, is signed separately
+        SignedUrlCache.getSignedUrl("reports", "warnings.csv", bucket=bucket)
+        SignedUrlCache.getSignedUrl("reports", "errors.csv", bucket=CONFIG_BROKER["aws_bucket"])
+        self.assertEqual(len(signed), 3)
+        # An entry inside the expiration margin is signed again
+        cacheKey = (bucket, "/reports/errors.csv", "GET")
+        SignedUrlCache._items[cacheKey] = (first, time() + SignedUrlCache.EXPIRATION_MARGIN - 1)
+        SignedUrlCache.getSignedUrl("reports", "errors.csv", bucket=bucket)
+        self.assertEqual(len(signed), 4)
+        self.assertEqual(signed[-1][2:], (bucket, "/reports/errors.csv"))
+        self.assertGreater(SignedUrlCache._items[cacheKey][1] - SignedUrlCache.EXPIRATION_MARGIN, time())
+
+    def test_local_upload_stream(self):
+        """Test chunked local upload, resuming after a rejected chunk."""
+        if not CONFIG_BROKER['local']:
+            self.skipTest("Route is only available for local installs")
+        chunks = [b"a,b,c\n", b"1,2,3\n", b"4,5,6\n"]
+        response = self.app.put("/v1/local_upload_stream/?filename=stream.csv&offset=0&chunk_index=0",
+            chunks[0], content_type="application/octet-stream")
+        self.assertEqual(response.status_code, 200)
+        uploadId, path = response.json["local_upload_id"], response.json["path"]
+        self.assertEqual(response.json["offset"], len(chunks[0]))
+        # Chunk with the wrong offset is rejected
+        response = self.app.put("/v1/local_upload_stream/?" + urlencode({"local_upload_id": uploadId, "offset": 0, "chunk_index": 1}),
+            chunks[1], content_type="application/octet-stream", expect_errors=True)
+        self.assertEqual(response.status_code, 400)
+        # Resume from the offset the server reports
+        offset = self.app.get("/v1/local_upload_stream/?" + urlencode({"local_upload_id": uploadId})).json["offset"]
+        for index, chunk in enumerate(chunks[1:]):
+            response = self.app.put("/v1/local_upload_stream/?" + urlencode({"local_upload_id": uploadId, "offset": offset,
+                "chunk_index": index + 1, "final": str(index == len(chunks) - 2).lower()}),
+                chunk, content_type="application/octet-stream")
+            offset = response.json["offset"]
+        data = b"".join(chunks)
+        self.assertEqual(offset, len(data))
+        self.assertEqual(response.json["md5"], hashlib.md5(data).hexdigest())
+        # A finished upload takes no more chunks
+        response = self.app.put("/v1/local_upload_stream/?" + urlencode({"local_upload_id": uploadId, "offset": offset}),
+            b"7,8,9\n", content_type="application/octet-stream", expect_errors=True)
+        self.assertEqual(response.status_code, 400)
+        with open(path, "rb") as uploadedFile:
+            self.assertEqual(uploadedFile.read(), data)
+        os.remove(path)
+
+    def test_local_upload_stream_other_user(self):
+        """Test that a user can not add chunks to an upload started by someone else."""
+        if not CONFIG_BROKER['local']:
+            self.skipTest("Route is only available for local installs")
+        response = self.app.put("/v1/local_upload_stream/?filename=owned.csv&offset=0",
+            b"a,b,c\n", content_type="application/octet-stream")
+        uploadId, path = response.json["local_upload_id"], response.json["path"]
+        self.login_approved_user()
+        query = urlencode({"local_upload_id": uploadId, "offset": 6})
+        response = self.app.put("/v1/local_upload_stream/?" + query, b"1,2,3\n",
+            content_type="application/octet-stream", expect_errors=True)
+        self.assertEqual(response.status_code, 400)
+        response = self.app.get("/v1/local_upload_stream/?" + query, expect_errors=True)
+        self.assertEqual(response.status_code, 400)
+        with open(path, "rb") as uploadedFile:
+            self.assertEqual(uploadedFile.read(), b"a,b,c\n")
+        os.remove(path)
+
+    def setup_multipart_upload_job(self):
+        """Start moto's S3 stand-in with the broker bucket and create a file_upload job for the submission user."""
+        if CONFIG_BROKER['local']:
+            self.skipTest("Multipart upload routes are only available for S3 installs")
+        mock = mock_s3()
+        mock.start()
+        self.addCleanup(mock.stop)
+        # Connection is cached per process, make sure it is created inside the mock
+        SignedUrlCache._connection = None
+        self.addCleanup(setattr, SignedUrlCache, "_connection", None)
+        bucket = boto.s3.connect_to_region(CONFIG_BROKER["aws_region"]).create_bucket(CONFIG_BROKER["aws_bucket"])
+        jobDb = self.jobTracker
+        submissionId = FileTests.insertSubmission(jobDb, self.submission_user_id)
+        jobId = FileTests.insertJob(jobDb, filetype=1, status=1, type_id=jobDb.getTypeId("file_upload"), submission=submissionId)
+        job = jobDb.getJobById(jobId)
+        job.filename = "{}/multipart_award.csv".format(submissionId)
+        jobDb.session.commit()
+        return bucket, job
+
+    def get_multipart_upload(self, multipartUploadId):
+        """Load a multipart upload as the routes last saved it."""
+        self.jobTracker.session.expire_all()
+        return self.jobTracker.getMultipartUploadById(multipartUploadId)
+
+    def upload_part(self, multipartUploadId, partNumber, data):
+        """Send one part straight to S3, as a client would with a presigned part URL."""
+        upload = self.get_multipart_upload(multipartUploadId)
+        MultipartUploadManager.getUpload(upload.bucket, upload.key, upload.s3_upload_id).upload_part_from_file(BytesIO(data), partNumber)
+
+    def test_multipart_upload_routes(self):
+        """Test a multipart upload through the routes, resuming after a missing part."""
+        bucket, job = self.setup_multipart_upload_job()
+        partData = [b"a" * MultipartUploadManager.MIN_PART_SIZE, b"b" * 10]
+        response = self.app.post_json("/v1/multipart_upload/initiate/", {"upload_id": job.job_id,
+            "file_size": sum(len(data) for data in partData), "part_size": MultipartUploadManager.MIN_PART_SIZE})
+        self.check_response(response, StatusCode.OK)
+        self.assertEqual(response.json["part_count"], 2)
+        self.assertEqual(response.json["missing_parts"], [1, 2])
+        uploadJson = {"multipart_upload_id": response.json["multipart_upload_id"]}
+
+        response = self.app.post_json("/v1/multipart_upload/part_urls/", uploadJson)
+        self.assertEqual(sorted(response.json["urls"].keys()), ["1", "2"])
+        self.upload_part(uploadJson["multipart_upload_id"], 1, partData[0])
+        # Completing with a part missing fails, and the parts route reports what is left to send
+        response = self.app.post_json("/v1/multipart_upload/complete/", uploadJson, expect_errors=True)
+        self.check_response(response, StatusCode.CLIENT_ERROR)
+        response = self.app.post_json("/v1/multipart_upload/parts/", uploadJson)
+        self.assertEqual(response.json["received_parts"], [1])
+        self.assertEqual(response.json["missing_parts"], [2])
+        self.assertEqual([part.part_number for part in self.get_multipart_upload(uploadJson["multipart_upload_id"]).parts], [1])
+        response = self.app.post_json("/v1/multipart_upload/part_urls/", uploadJson)
+        self.assertEqual(list(response.json["urls"].keys()), ["2"])
+
+        self.upload_part(uploadJson["multipart_upload_id"], 2, partData[1])
+        response = self.app.post_json("/v1/multipart_upload/complete/", uploadJson)
+        self.check_response(response, StatusCode.OK)
+        self.assertEqual(response.json["status"], "complete")
+        self.assertEqual(bucket.get_key(job.filename).get_contents_as_string(), b"".join(partData))
+        response = self.app.post_json("/v1/multipart_upload/abort/", uploadJson, expect_errors=True)
+        self.check_response(response, StatusCode.CLIENT_ERROR)
+
+    def test_multipart_upload_abort(self):
+        """Test aborting a multipart upload through the routes."""
+        bucket, job = self.setup_multipart_upload_job()
+        response = self.app.post_json("/v1/multipart_upload/initiate/", {"upload_id": job.job_id, "file_size": 100})
+        uploadJson = {"multipart_upload_id": response.json["multipart_upload_id"]}
+        response = self.app.post_json("/v1/multipart_upload/abort/", uploadJson)
+        self.check_response(response, StatusCode.OK)
+        self.assertEqual(response.json["status"], "aborted")
+        response = self.app.post_json("/v1/multipart_upload/part_urls/", uploadJson, expect_errors=True)
+        self.check_response(response, StatusCode.CLIENT_ERROR)
+
+    def test_multipart_upload_other_user(self):
+        """Test that multipart upload routes reject a user who does not own the job."""
+        bucket, job = self.setup_multipart_upload_job()
+        response = self.app.post_json("/v1/multipart_upload/initiate/", {"upload_id": job.job_id, "file_size": 100})
+        uploadJson = {"multipart_upload_id": response.json["multipart_upload_id"]}
+        self.logout()
+        self.login_approved_user()
+        response = self.app.post_json("/v1/multipart_upload/initiate/", {"upload_id": job.job_id, "file_size": 100}, expect_errors=True)
+        self.check_response(response, StatusCode.CLIENT_ERROR)
+        for route in ["part_urls", "parts", "complete", "abort"]:
+            response = self.app.post_json("/v1/multipart_upload/{}/".format(route), uploadJson, expect_errors=True)
+            self.check_response(response, StatusCode.CLIENT_ERROR)
+        self.assertEqual(self.get_multipart_upload(uploadJson["multipart_upload_id"]).status, "in_progress")
+
     def check_metrics(self, submission_id, exists, type_file) :
         """Get error metrics for specified submission."""
         postJson = {"submission_id": submission_id}
@@ -292,6 +571,47 @@ class FileTests(BaseTest):
         self.check_metrics(self.test_metrics_submission_id,
             True, "appropriations")
 
+    def test_metrics_filters(self):
+        """Test error metrics limit and field name filters."""
+        postJson = {"submission_id": self.test_metrics_submission_id, "limit": 1}
+        response = self.app.post_json("/v1/error_metrics/", postJson)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json["award_financial"]), 1)
+        postJson = {"submission_id": self.test_metrics_submission_id, "field_name": "header 1"}
+        response = self.app.post_json("/v1/error_metrics/", postJson)
+        self.assertGreater(len(response.json["award_financial"]), 0)
+        for error in response.json["award_financial"]:
+            self.assertEqual(error["field_name"], "header 1")
+        postJson = {"submission_id": self.test_metrics_submission_id, "field_name": "not a field"}
+        response = self.app.post_json("/v1/error_metrics/", postJson)
+        self.assertEqual(len(response.json["award_financial"]), 0)
+        postJson = {"submission_id": self.test_metrics_submission_id, "limit": 0}
+        response = self.app.post_json("/v1/error_metrics/", postJson, expect_errors=True)
+        self.assertEqual(response.status_code, 400)
+
+    def test_error_metrics_rollup(self):
+        """Test error totals across an agency's submissions from the refreshed summary."""
+        self.interfaces.errorDb.refreshErrorMetricSummary(self.interfaces.jobDb.getValidationJobInfo())
+        today = datetime.utcnow().strftime("%m/%d/%Y")
+        postJson = {"agency_name": "Department of the Treasury", "start_date": today, "end_date": today}
+        # Users without an agency can not see another agency's totals
+        response = self.app.post_json("/v1/error_metrics_rollup/", postJson, expect_errors=True)
+        self.assertEqual(response.status_code, 400)
+
+        self.login_admin_user()
+        response = self.app.post_json("/v1/error_metrics_rollup/", postJson)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.json["refreshed_at"])
+        byField = dict((row["field_name"], row["occurrences"]) for row in response.json["by_field"])
+        self.assertGreaterEqual(byField["header_three"], 7)
+        self.assertGreaterEqual(byField["header_four"], 5)
+        self.assertIn("Header three value must be real", [row["rule_failed"] for row in response.json["by_rule"]])
+        self.assertEqual(response.json["total"], sum(row["occurrences"] for row in response.json["by_file_type"]))
+        postJson["start_date"] = "01/01/2000"
+        postJson["end_date"] = "01/02/2000"
+        response = self.app.post_json("/v1/error_metrics_rollup/", postJson)
+        self.assertEqual(response.json["total"], 0)
+
     @staticmethod
     def insertSubmission(jobTracker, submission_user_id, submission=None, agency = None, startDate = None, endDate = None):
         """Insert one submission into job tracker and get submission ID back."""
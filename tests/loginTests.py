@@ -1,6 +1,9 @@
 import unittest
 from baseTest import BaseTest
 from webtest.app import AppError
+from dataactbroker.handlers.aws.session import SessionTable
+from dataactbroker.handlers.passwordHasher import PasswordHasher
+from dataactbroker.handlers.userHandler import UserHandler
 
 
 class LoginTests(BaseTest):
@@ -24,6 +27,33 @@ class LoginTests(BaseTest):
         self.assertIn("agency", json)
         self.assertIn("permissions", json)
 
+    def test_login_query_count(self):
+        """Test that a successful login runs at most two queries."""
+        self.logout()
+        # First login records the login time, later logins within the hour do not
+        self.login_approved_user()
+        self.logout()
+        user = {"username": self.test_users['approved_email'].upper(), "password": self.user_password}
+        response, queryCount = self.count_queries("/v1/login/", user)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(queryCount, 2)
+        self.logout()
+
+    def test_login_rehash(self):
+        """Test that a password hashed with an old work factor is rehashed at login."""
+        userDb = self.userDb
+        user = userDb.getUserByEmail(self.test_users['approved_email'])
+        user.password_hash = PasswordHasher.hash(self.user_password + user.salt, 4)
+        userDb.session.commit()
+        self.assertTrue(PasswordHasher.needsRehash(user.password_hash, UserHandler.HASH_ROUNDS))
+        response = self.login_approved_user()
+        self.assertEqual(response.status_code, 200)
+        userDb.session.expire_all()
+        user = userDb.getUserByEmail(self.test_users['approved_email'])
+        self.assertEqual(PasswordHasher.getRounds(user.password_hash), UserHandler.HASH_ROUNDS)
+        self.assertFalse(PasswordHasher.check(user.password_hash, "wrong" + user.salt))
+        self.logout()
+
     def test_inactive_login(self):
         """Test broker inactive user login"""
         response = self.login_inactive_user()
@@ -73,5 +103,15 @@ class LoginTests(BaseTest):
             self.fail("Response is missing JSON component")
         self.assertEquals(response.json["status"].lower(), "false")
 
+    def test_session_connection_reuse(self):
+        """Test that session lookups reuse the DynamoDB table handle."""
+        self.login_approved_user()
+        before = SessionTable.getConnectionMetrics()
+        self.session_route()
+        self.session_route()
+        after = SessionTable.getConnectionMetrics()
+        self.assertEqual(after["created"], before["created"])
+        self.assertGreater(after["reused"], before["reused"])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from io import BytesIO
+import boto
+from moto import mock_s3
+from dataactcore.config import CONFIG_BROKER
+from dataactbroker.handlers.aws.multipartUpload import MultipartUploadManager
+from dataactbroker.handlers.aws.signedUrlCache import SignedUrlCache
+
+
+class MultipartUploadTests(unittest.TestCase):
+    """ Test S3 multipart upload handling against moto's S3 stand-in """
+
+    BUCKET = "multipart-upload-test"
+    KEY = "1/1234_award_financial.csv"
+
+    def setUp(self):
+        self.mock = mock_s3()
+        self.mock.start()
+        # Connection is cached per process, make sure it is created inside the mock
+        SignedUrlCache._connection = None
+        self.bucket = boto.s3.connect_to_region(CONFIG_BROKER["aws_region"]).create_bucket(self.BUCKET)
+
+    def tearDown(self):
+        SignedUrlCache._connection = None
+        self.mock.stop()
+
+    def test_part_size(self):
+        """Test that part sizes stay within S3 limits."""
+        self.assertEqual(MultipartUploadManager.getPartSize(100), (MultipartUploadManager.DEFAULT_PART_SIZE, 1))
+        partSize, partCount = MultipartUploadManager.getPartSize(200 * 1024 * 1024, 1)
+        self.assertEqual(partSize, MultipartUploadManager.MIN_PART_SIZE)
+        self.assertEqual(partCount, 40)
+        partSize, partCount = MultipartUploadManager.getPartSize(10 ** 12)
+        self.assertLessEqual(partCount, MultipartUploadManager.MAX_PARTS)
+        self.assertGreaterEqual(partSize * partCount, 10 ** 12)
+
+    def test_part_urls(self):
+        """Test that part URLs are signed for the upload and part number."""
+        uploadId = MultipartUploadManager.initiate(self.BUCKET, self.KEY)
+        urls = MultipartUploadManager.getPartUrls(self.BUCKET, self.KEY, uploadId, [1, 2])
+        self.assertEqual(sorted(urls.keys()), [1, 2])
+        self.assertIn("partNumber=2", urls[2])
+        self.assertIn("uploadId=", urls[2])
+        self.assertIn("Signature=", urls[2])
+
+    def test_resume_and_complete(self):
+        """Test that received parts are listed for resuming and combined on completion."""
+        partData = [b"a" * MultipartUploadManager.MIN_PART_SIZE, b"b" * 10]
+        uploadId = MultipartUploadManager.initiate(self.BUCKET, self.KEY)
+        upload = MultipartUploadManager.getUpload(self.BUCKET, self.KEY, uploadId)
+        upload.upload_part_from_file(BytesIO(partData[0]), 1)
+        self.assertEqual([part[0] for part in MultipartUploadManager.listParts(self.BUCKET, self.KEY, uploadId)], [1])
+        # Resume with the remaining part
+        upload.upload_part_from_file(BytesIO(partData[1]), 2)
+        parts = MultipartUploadManager.listParts(self.BUCKET, self.KEY, uploadId)
+        self.assertEqual([part[0] for part in parts], [1, 2])
+        MultipartUploadManager.complete(self.BUCKET, self.KEY, uploadId)
+        self.assertEqual(self.bucket.get_key(self.KEY).get_contents_as_string(), b"".join(partData))
+
+    def test_abort(self):
+        """Test that an aborted upload leaves no object behind."""
+        uploadId = MultipartUploadManager.initiate(self.BUCKET, self.KEY)
+        MultipartUploadManager.abort(self.BUCKET, self.KEY, uploadId)
+        self.assertIsNone(self.bucket.get_key(self.KEY))
+
+if __name__ == '__main__':
+    unittest.main()
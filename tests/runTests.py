@@ -2,6 +2,9 @@ import unittest
 from loginTests import LoginTests
 from fileTests import FileTests
 from userTests import UserTests
+from validatorDispatcherTests import ValidatorDispatcherTests
+from multipartUploadTests import MultipartUploadTests
+from sessionTests import SessionTests
 import cProfile
 import pstats
 
@@ -13,6 +16,9 @@ suite = unittest.TestSuite()
 suite.addTests(unittest.makeSuite(LoginTests))
 suite.addTests(unittest.makeSuite(FileTests))
 suite.addTests(unittest.makeSuite(UserTests))
+suite.addTests(unittest.makeSuite(ValidatorDispatcherTests))
+suite.addTests(unittest.makeSuite(MultipartUploadTests))
+suite.addTests(unittest.makeSuite(SessionTests))
 # to run a single test:
 #suite.addTest(FileTests('test_check_status'))
 
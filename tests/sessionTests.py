@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from flask import Flask, session
+from webtest import TestApp
+from dataactbroker.handlers.aws.session import DynamoInterface, LoginSession
+from dataactbroker.handlers.sessionBackends import (createSessionInterface, CookieInterface, MemoryRevocationStore,
+    MemorySessionTable, SqliteSessionTable)
+
+
+class SessionTests(unittest.TestCase):
+    """ Test session backends with in-process stores, no DynamoDB or database needed """
+
+    @staticmethod
+    def createApp(sessionInterface):
+        """Create a small app that logs in and out through the session interface."""
+        app = Flask(__name__)
+        app.session_interface = sessionInterface
+
+        @app.route("/login/", methods=["POST"])
+        def login():
+            LoginSession.login(session, 1)
+            return "ok"
+
+        @app.route("/logout/", methods=["POST"])
+        def logout():
+            LoginSession.logout(session)
+            return "ok"
+
+        @app.route("/reset/", methods=["POST"])
+        def reset():
+            LoginSession.resetPassword(session)
+            return "ok"
+
+        @app.route("/reset_status/")
+        def resetStatus():
+            return str(LoginSession.isResetingPassword(session))
+
+        @app.route("/status/")
+        def status():
+            return str(LoginSession.isLogin(session))
+
+        return TestApp(app)
+
+    def check_login_logout(self, app):
+        """Log in and out, checking the session is kept between requests."""
+        self.assertEqual(app.get("/status/").text, "False")
+        app.post("/login/")
+        self.assertEqual(app.get("/status/").text, "True")
+        app.post("/logout/")
+        self.assertEqual(app.get("/status/").text, "False")
+
+    def test_memory_store(self):
+        """Test sessions kept in memory."""
+        store = MemorySessionTable()
+        self.check_login_logout(self.createApp(DynamoInterface(store)))
+        self.assertEqual(len(store.items), 1)
+        self.assertEqual(store.clearSessions()[0], 0)
+
+    def test_sqlite_store(self):
+        """Test sessions kept in a SQLite file."""
+        fileHandle, path = tempfile.mkstemp()
+        try:
+            store = SqliteSessionTable(path)
+            self.check_login_logout(self.createApp(DynamoInterface(store)))
+            self.assertEqual(store.clearSessions()[0], 0)
+        finally:
+            os.close(fileHandle)
+            os.remove(path)
+
+    def test_cookie_sessions(self):
+        """Test sessions kept in a cookie, and that a logged out cookie can not be replayed."""
+        revocations = MemoryRevocationStore()
+        app = self.createApp(CookieInterface("test key", revocations))
+        self.check_login_logout(app)
+        self.assertEqual(len(revocations.getRevokedSessionIds()), 1)
+        app.post("/login/")
+        loggedIn = app.cookies["session"]
+        self.assertNotIn("login", loggedIn)
+        app.post("/logout/")
+        self.assertEqual(len(revocations.getRevokedSessionIds()), 2)
+        app.set_cookie("session", loggedIn)
+        self.assertEqual(app.get("/status/").text, "False")
+        # Tampered cookies are ignored
+        app.set_cookie("session", loggedIn[:-4] + "AAAA")
+        self.assertEqual(app.get("/status/").text, "False")
+
+    def test_cookie_reset_replay(self):
+        """Test that a cookie from a finished password reset can not be replayed."""
+        revocations = MemoryRevocationStore()
+        app = self.createApp(CookieInterface("test key", revocations))
+        app.post("/reset/")
+        resetting = app.cookies["session"]
+        self.assertEqual(app.get("/reset_status/").text, "True")
+        # Setting the password ends the reset with logout
+        app.post("/logout/")
+        self.assertEqual(app.get("/reset_status/").text, "False")
+        self.assertEqual(len(revocations.getRevokedSessionIds()), 1)
+        app.set_cookie("session", resetting)
+        self.assertEqual(app.get("/reset_status/").text, "False")
+
+    def test_unknown_backend(self):
+        """Test that an unknown backend name is an error."""
+        self.assertIsInstance(createSessionInterface({"session_backend": "memory"}), DynamoInterface)
+        self.assertRaises(ValueError, createSessionInterface, {"session_backend": "floppy"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,16 @@
 from baseTest import BaseTest
+import os
+import tempfile
+from datetime import datetime, timedelta
+from boto.exception import BotoServerError, NoAuthHandlerFound
 from dataactbroker.handlers.aws.sesEmail import sesEmail
+from dataactbroker.handlers.emailOutbox import EmailOutbox
+from dataactbroker.handlers.emailTemplateCache import EmailTemplateCache
+from dataactbroker.handlers.lookupCache import LookupCache
+from dataactbroker.models.userModels import OutboxEmail, HashedEmailToken
 from dataactcore.models.jobModels import Submission, JobStatus
+from dataactcore.models.userModel import UserStatus
+from sqlalchemy import func
 from dataactcore.utils.statusCode import StatusCode
 
 class UserTests(BaseTest):
@@ -138,6 +148,36 @@ class UserTests(BaseTest):
             postJson, expect_errors=True)
         self.check_response(response, StatusCode.CLIENT_ERROR)
 
+    def test_list_users_pages(self):
+        """Test listing every user without a limit and paging through them with a cursor."""
+        postJson = {"status": "awaiting_approval"}
+        response = self.app.post_json("/v1/list_users_with_status/", postJson)
+        self.check_response(response, StatusCode.OK)
+        allIds = [user["id"] for user in response.json["users"]]
+        self.assertEqual(response.json["total"], len(allIds))
+        self.assertIsNone(response.json["next_cursor"])
+        pagedIds = []
+        postJson["limit"] = 1
+        while True:
+            response = self.app.post_json("/v1/list_users_with_status/", postJson)
+            self.check_response(response, StatusCode.OK)
+            self.assertLessEqual(len(response.json["users"]), 1)
+            self.assertEqual(response.json["total"], len(allIds))
+            pagedIds.extend([user["id"] for user in response.json["users"]])
+            postJson["cursor"] = response.json["next_cursor"]
+            if not postJson["cursor"]:
+                break
+        self.assertEqual(pagedIds, sorted(allIds))
+        # A full last page does not lead to an empty page
+        response = self.app.post_json("/v1/list_users_with_status/",
+            {"status": "awaiting_approval", "limit": len(allIds)})
+        self.check_response(response, StatusCode.OK)
+        self.assertEqual(len(response.json["users"]), len(allIds))
+        self.assertIsNone(response.json["next_cursor"])
+        response = self.app.post_json("/v1/list_users_with_status/",
+            {"status": "awaiting_approval", "cursor": "notacursor"}, expect_errors=True)
+        self.check_response(response, StatusCode.CLIENT_ERROR)
+
     def test_get_users_by_type(self):
         """Test getting user list by type."""
         agencyUsers = self.userDb.getUsersByType("agency_user")
@@ -151,6 +191,13 @@ class UserTests(BaseTest):
             self.assertIn(email, emails)
         self.assertNotIn('user@agency.gov', emails)
 
+    def test_get_admins_by_type(self):
+        """Test that the permission bitmask filter only returns admins."""
+        adminEmails = [user.email for user in self.userDb.getUsersByType("website_admin")]
+        self.assertIn(self.test_users["admin_email"], adminEmails)
+        self.assertNotIn("approved@agency.gov", adminEmails)
+        self.assertNotIn("user@agency.gov", adminEmails)
+
     def test_list_submissions(self):
         """Test listing user's submissions."""
         self.logout()
@@ -161,6 +208,84 @@ class UserTests(BaseTest):
         self.assertEqual(len(response.json["submission_id_list"]), 5)
         self.logout()
 
+    def test_list_submissions_pages(self):
+        """Test paging through user's submissions with a cursor."""
+        self.logout()
+        self.login_approved_user()
+        allIds = self.app.get("/v1/list_submissions/").json["submission_id_list"]
+        pagedIds = []
+        cursor = None
+        while True:
+            route = "/v1/list_submissions/?limit=2"
+            if cursor:
+                route += "&cursor=" + cursor
+            response = self.app.get(route)
+            self.check_response(response, StatusCode.OK)
+            self.assertLessEqual(len(response.json["submission_id_list"]), 2)
+            pagedIds.extend(response.json["submission_id_list"])
+            cursor = response.json["next_cursor"]
+            if not cursor:
+                break
+        # Submissions made in setUpClass have no creation time, they are still paged through
+        self.assertEqual(len(pagedIds), 5)
+        self.assertEqual(pagedIds, allIds)
+        response = self.app.get("/v1/list_submissions/?summary=true")
+        self.assertEqual([submission["submission_id"] for submission in response.json["submissions"]], allIds)
+        for submission in response.json["submissions"]:
+            for key in ["created_on", "agency_name", "status", "number_of_rows", "number_of_errors"]:
+                self.assertIn(key, submission)
+        self.assertIsNone(self.app.get("/v1/list_submissions/").json["next_cursor"])
+        response = self.app.get("/v1/list_submissions/?cursor=notacursor", expect_errors=True)
+        self.check_response(response, StatusCode.CLIENT_ERROR)
+        self.logout()
+
+    def test_email_outbox(self):
+        """Test that queued emails are deduplicated and sent by the outbox."""
+        userDb = self.userDb
+        subject = "Outbox test {}".format(os.getpid())
+        # Stop this process's workers so the emails are only sent by the outbox below
+        EmailOutbox.getOutbox().stop()
+        emails = [EmailOutbox.outboxRow(sesEmail("outbox{}@agency.gov".format(i), "broker@agency.gov", content="Hello", subject=subject)) for i in range(3)]
+        self.assertEqual(userDb.queueEmails(emails), 3)
+        # Identical emails are not queued again while unsent
+        self.assertEqual(userDb.queueEmails(emails[:1]), 0)
+        # Even when the check before inserting misses them, as when another request queues them at the same time
+        self.assertFalse(userDb.insertOutboxEmails(emails[:1]))
+        self.assertEqual(userDb.session.query(OutboxEmail).filter(OutboxEmail.subject == subject).count(), 3)
+        outbox = EmailOutbox(workers=0, batchSize=10, maxSendRate=1000)
+        isLocal, emailLog = sesEmail.isLocal, sesEmail.emailLog
+        logFile, logPath = tempfile.mkstemp()
+        sesEmail.isLocal, sesEmail.emailLog = True, logPath
+        try:
+            while outbox.sendBatch():
+                pass
+            with open(logPath) as log:
+                self.assertEqual(log.read().count(subject), 3)
+        finally:
+            sesEmail.isLocal, sesEmail.emailLog = isLocal, emailLog
+            os.close(logFile)
+            os.remove(logPath)
+        queued = userDb.session.query(OutboxEmail).filter(OutboxEmail.subject == subject).all()
+        self.assertEqual([email.status for email in queued], ["sent"] * 3)
+        self.assertGreaterEqual(outbox.getMetrics()["sent"], 3)
+
+    def test_email_template_cache(self):
+        """Test that cached templates are filled in and refreshed when a template changes."""
+        userDb = self.userDb
+        original = userDb.getEmailTemplate("validate_email")
+        subject, content = original.subject, original.content
+        email = sesEmail("user@agency.gov", "broker@agency.gov", templateType="validate_email",
+            parameters={"[URL]": "http://broker/link", "[USER]": None}, database=userDb)
+        self.assertEqual(email.subject, subject)
+        self.assertEqual(email.content, content.replace("[URL]", "http://broker/link"))
+        try:
+            userDb.loadEmailTemplate(subject, "Go to [URL] or [URL], [MISSING]", "validate_email")
+            self.assertEqual(EmailTemplateCache.render("validate_email", {"[URL]": "here", "[MISSING]": None}, userDb),
+                (subject, "Go to here or here, "))
+            self.assertEqual(EmailTemplateCache.render("validate_email", {}, userDb)[1], "Go to [URL] or [URL], [MISSING]")
+        finally:
+            userDb.loadEmailTemplate(subject, content, "validate_email")
+
     def test_list_users_with_status_non_admin(self):
         """Test requesting user list from a non-admin account."""
         self.login_approved_user()
@@ -180,6 +305,17 @@ class UserTests(BaseTest):
         self.check_response(response, StatusCode.CLIENT_ERROR, "Cannot finalize a job created by a different user")
         self.logout()
 
+    def test_ses_auth_errors(self):
+        """Test that only credential errors fall back to the configured keys."""
+        denied = BotoServerError(403, "Forbidden")
+        denied.error_code = "InvalidClientTokenId"
+        throttled = BotoServerError(400, "Bad Request")
+        throttled.error_code = "Throttling"
+        self.assertTrue(sesEmail.isAuthError(denied))
+        self.assertTrue(sesEmail.isAuthError(NoAuthHandlerFound("No handler")))
+        self.assertFalse(sesEmail.isAuthError(throttled))
+        self.assertFalse(sesEmail.isAuthError(BotoServerError(500, "Internal Server Error")))
+
     def test_send_email(self):
         """Test confirm e-mail."""
         # Always use simulator to test emails!
@@ -227,6 +363,19 @@ class UserTests(BaseTest):
         user = userDb.getUserByEmail(email)
         self.assertTrue(user.password_hash)
 
+    def test_purge_tokens(self):
+        """Test that tokens are stored by digest and expired tokens are purged."""
+        userDb = self.userDb
+        token = sesEmail.createToken(self.test_users["password_reset_email"], userDb, "validate_email")
+        stored = userDb.session.query(HashedEmailToken).filter(HashedEmailToken.token_hash == userDb.hashToken(token)).one()
+        self.assertEqual(len(stored.token_hash), 64)
+        stored.created_at = datetime.utcnow() - timedelta(seconds=sesEmail.TOKEN_MAX_AGE + 60)
+        userDb.session.commit()
+        self.assertGreaterEqual(userDb.deleteExpiredTokens(sesEmail.TOKEN_MAX_AGE), 1)
+        response = self.app.post_json("/v1/confirm_email_token/", {"token": token})
+        self.check_response(response, StatusCode.OK, "Link already used")
+        self.assertEqual(response.json["errorCode"], sesEmail.LINK_ALREADY_USED)
+
     def test_check_password_token(self):
         """Test password reset with valid token."""
         userDb = self.userDb
@@ -252,3 +401,39 @@ class UserTests(BaseTest):
         self.check_response(response, StatusCode.OK)
         self.assertEqual(response.json["name"], "Mr. Manager")
         self.assertEqual(response.json["agency"], "Unknown")
+
+    def test_current_user_query_count(self):
+        """Test that the current user is only loaded once per request."""
+        response, queryCount = self.count_queries("/v1/current_user/")
+        self.check_response(response, StatusCode.OK)
+        self.assertEqual(response.json["name"], "Mr. Manager")
+        # Permission types come from the lookup cache, so only the user is queried
+        self.assertLessEqual(queryCount, 1)
+
+    def test_reload_lookup_tables(self):
+        """Test that reloading the lookup table cache picks up a row added to the database."""
+        session = self.userDb.session
+        # Load the cached table before the new row exists
+        self.assertNotIn("reload_test", LookupCache.getMaps("user_status", session)[0])
+        statusId = session.query(func.max(UserStatus.user_status_id)).scalar() + 1
+        session.add(UserStatus(user_status_id=statusId, name="reload_test", description="Added by test_reload_lookup_tables"))
+        session.commit()
+        try:
+            self.assertNotIn("reload_test", LookupCache.getMaps("user_status", session)[0])
+            epoch = LookupCache.epoch
+            response = self.app.post_json("/v1/reload_lookup_tables/", {})
+            self.check_response(response, StatusCode.OK, "Lookup tables reloaded")
+            self.assertGreater(response.json["epoch"], epoch)
+            self.assertEqual(LookupCache.getMaps("user_status", session)[0]["reload_test"], statusId)
+            self.assertEqual(self.userDb.getUserStatusId("reload_test"), statusId)
+        finally:
+            session.query(UserStatus).filter(UserStatus.user_status_id == statusId).delete()
+            session.commit()
+            LookupCache.reload()
+
+    def test_validator_metrics(self):
+        """Test getting validator dispatcher metrics as an admin."""
+        response = self.app.get("/v1/validator_metrics/")
+        self.check_response(response, StatusCode.OK)
+        for key in ["queue_depth", "in_flight", "sent", "failed", "retries", "average_latency"]:
+            self.assertIn(key, response.json)
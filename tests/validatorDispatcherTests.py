@@ -0,0 +1,96 @@
+import json
+import unittest
+from threading import Thread, Lock
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+from dataactbroker.handlers.validatorDispatcher import ValidatorDispatcher
+
+
+class StubValidatorHandler(BaseHTTPRequestHandler):
+    """ Records posted bodies, returns 503 for the first failCount requests """
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length).decode("utf-8"))
+        with self.server.lock:
+            self.server.requestCount += 1
+            failing = self.server.requestCount <= self.server.failCount
+            if not failing:
+                self.server.bodies.append(body)
+        self.send_response(503 if failing else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ValidatorDispatcherTests(unittest.TestCase):
+    """ Test validator dispatch queue against a local stub validator """
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), StubValidatorHandler)
+        self.server.lock = Lock()
+        self.server.bodies = []
+        self.server.requestCount = 0
+        self.server.failCount = 0
+        self.serverThread = Thread(target=self.server.serve_forever)
+        self.serverThread.daemon = True
+        self.serverThread.start()
+        self.url = "http://127.0.0.1:{}/validate_threaded/".format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_dispatch(self):
+        """Test that queued jobs are each sent to the validator."""
+        dispatcher = ValidatorDispatcher(url=self.url, workers=2, backoff=0)
+        for jobId in range(5):
+            dispatcher.dispatch(jobId)
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(sorted(int(body["job_id"]) for body in self.server.bodies), list(range(5)))
+        metrics = dispatcher.getMetrics()
+        self.assertEqual(metrics["sent"], 5)
+        self.assertEqual(metrics["queue_depth"], 0)
+        self.assertEqual(metrics["in_flight"], 0)
+        self.assertIsNotNone(metrics["average_latency"])
+
+    def test_retry(self):
+        """Test that server errors are retried."""
+        self.server.failCount = 2
+        dispatcher = ValidatorDispatcher(url=self.url, workers=1, maxRetries=3, backoff=0)
+        response = dispatcher.send([1])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(dispatcher.getMetrics()["retries"], 2)
+
+    def test_retry_exhausted(self):
+        """Test that a job is recorded as failed once retries run out."""
+        self.server.failCount = 10
+        dispatcher = ValidatorDispatcher(url=self.url, workers=1, maxRetries=1, backoff=0)
+        dispatcher.dispatch(1)
+        dispatcher.join()
+        dispatcher.stop()
+        metrics = dispatcher.getMetrics()
+        self.assertEqual(metrics["failed"], 1)
+        self.assertEqual(metrics["sent"], 0)
+        self.assertIsNotNone(metrics["last_error"])
+
+    def test_batching(self):
+        """Test that queued jobs are combined into one call when batching is enabled."""
+        dispatcher = ValidatorDispatcher(url=self.url, workers=1, batchSize=10, backoff=0)
+        # Fill queue before workers start so all jobs are available for one batch
+        for jobId in range(4):
+            dispatcher.queue.put(jobId)
+        dispatcher.start()
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(self.server.bodies, [{"job_ids": ["0", "1", "2", "3"]}])
+
+if __name__ == '__main__':
+    unittest.main()